@@ -0,0 +1,125 @@
+"""
+Cache data set configuration from stagecraft
+
+Entries are served from memory while they are fresh. Once an entry is older
+than the ttl it is still served, and a refresh is started in a background
+thread, so requests only wait on stagecraft for data sets they have never
+seen. Entries older than max_age are never served: they are fetched again
+before the request goes on, and any error from stagecraft is raised. Data
+sets that do not exist are never cached.
+"""
+import logging
+import threading
+import time
+
+from backdrop import statsd
+
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['CachedAdminAPI']
+
+
+class CachedAdminAPI(object):
+
+    def __init__(self, admin_api, ttl=60, max_age=300):
+        self._admin_api = admin_api
+        self._ttl = ttl
+        self._max_age = max(ttl, max_age)
+
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._refreshing = set()
+
+    def __getattr__(self, name):
+        # Anything that is not data set configuration goes straight through
+        return getattr(self._admin_api, name)
+
+    def get_data_set(self, data_group, data_type):
+        return self._get(('data_set', data_group, data_type),
+                         self._admin_api.get_data_set, data_group, data_type)
+
+    def get_data_set_by_name(self, name):
+        return self._get(('name', name),
+                         self._admin_api.get_data_set_by_name, name)
+
+    def list_data_sets(self):
+        data_set_configs = self._admin_api.list_data_sets()
+        for config in data_set_configs:
+            self._store(config)
+        return data_set_configs
+
+    def preload(self):
+        """Fill the cache with every data set"""
+        self.list_data_sets()
+
+    def _get(self, key, fetch, *args):
+        with self._lock:
+            entry = self._entries.get(key)
+
+        if entry is None:
+            statsd.incr('stagecraft_cache.miss')
+            config = fetch(*args)
+            if config is not None:
+                self._store(config)
+            return config
+
+        config, fetched_at = entry
+        age = time.time() - fetched_at
+        if age >= self._max_age:
+            statsd.incr('stagecraft_cache.expired', data_set=config['name'])
+            config = fetch(*args)
+            if config is None:
+                self._forget(key)
+            else:
+                self._store(config)
+        elif age < self._ttl:
+            statsd.incr('stagecraft_cache.hit', data_set=config['name'])
+        else:
+            statsd.incr('stagecraft_cache.stale', data_set=config['name'])
+            self._refresh_in_background(key, fetch, *args)
+
+        return config
+
+    def _store(self, config):
+        entry = (config, time.time())
+        with self._lock:
+            self._entries[('name', config['name'])] = entry
+            self._entries[('data_set', config.get('data_group'),
+                           config.get('data_type'))] = entry
+
+    def _forget(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                config, _ = entry
+                self._entries.pop(('name', config['name']), None)
+                self._entries.pop(('data_set', config.get('data_group'),
+                                   config.get('data_type')), None)
+
+    def _refresh_in_background(self, key, fetch, *args):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        thread = threading.Thread(
+            target=self._refresh, args=(key, fetch) + args)
+        thread.daemon = True
+        thread.start()
+
+    def _refresh(self, key, fetch, *args):
+        try:
+            config = fetch(*args)
+            if config is None:
+                self._forget(key)
+            else:
+                self._store(config)
+        except Exception as e:
+            # Keep serving the stale entry until stagecraft is back or it
+            # reaches max_age
+            logger.warning(
+                'Could not refresh data set config {0}: {1}'.format(key, e))
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
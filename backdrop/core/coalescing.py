@@ -0,0 +1,66 @@
+"""
+Share the results of identical queries that are running at the same time
+
+When a popular dashboard's cache expires, many requests for the same
+query arrive together. The first runs the query and the others wait for
+it and are given its results.
+"""
+import sys
+import threading
+
+from backdrop import statsd
+
+
+__all__ = ['QueryCoalescer']
+
+
+class _Flight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiters = 0
+        self.result = None
+        self.exc_info = None
+
+
+class QueryCoalescer(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def execute(self, data_set, query, execute, kind='query'):
+        """Return execute(data_set, query), sharing it with any identical
+        query on the same version of the data set that is already running
+
+        kind keeps apart executions that return different things for the
+        same query.
+        """
+        key = (kind, data_set.name, data_set.get_version(), query.cache_key)
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.waiters += 1
+
+        if not leader:
+            flight.done.wait()
+            statsd.incr('query_coalescing.saved', data_set=data_set.name)
+            if flight.exc_info is not None:
+                raise flight.exc_info[0], flight.exc_info[1], \
+                    flight.exc_info[2]
+            return flight.result
+
+        try:
+            flight.result = execute(data_set, query)
+            return flight.result
+        except Exception:
+            flight.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
@@ -4,9 +4,10 @@ from .records import add_auto_ids, parse_timestamps, validate_record,\
 from .validation import validate_record_schema
 from .nested_merge import nested_merge, flat_merge
 from .errors import InvalidSortError
+from .pagination import document_cursor
 from backdrop.core.response import (FlatData, GroupedData, PeriodData,
                                     PeriodGroupedData, PeriodFlatData,
-                                    SimpleData)
+                                    SimpleData, simple_document)
 
 import timeutils
 import datetime
@@ -15,6 +16,13 @@ log = logging.getLogger(__name__)
 
 DEFAULT_MAX_AGE_EXPECTED = 2678400
 
+# Data set config that overrides the storage engine's query limits
+QUERY_LIMIT_CONFIG = {
+    'max_query_time_ms': 'max_time_ms',
+    'max_query_documents_examined': 'max_documents_examined',
+    'max_query_results': 'max_results',
+}
+
 
 class DataSet(object):
 
@@ -23,6 +31,7 @@ class DataSet(object):
         self.config = config
 
         self._last_updated = None
+        self._version = None
 
     @property
     def name(self):
@@ -71,8 +80,20 @@ class DataSet(object):
         if not self.storage.data_set_exists(self.name):
             self.storage.create_data_set(self.name, self.config['capped_size'])
 
+    def get_version(self):
+        if self._version is None:
+            self._version = self.storage.get_version(
+                self.name, secondary_ok=not self.is_realtime())
+        return self._version
+
+    def _bump_version(self):
+        self.storage.bump_version(self.name)
+        self._version = None
+
     def empty(self):
-        return self.storage.empty_data_set(self.name)
+        result = self.storage.empty_data_set(self.name)
+        self._bump_version()
+        return result
 
     def store(self, records):
         log.info('received {} records'.format(len(records)))
@@ -109,28 +130,104 @@ class DataSet(object):
             # Add period data
             records = map(add_period_keys, records)
 
-            for record in records:
-                self.storage.save_record(self.name, record)
-            # errors should be empty
+            errors = self.storage.save_records(self.name, records)
+            self._bump_version()
+
             return errors
 
+    def is_realtime(self):
+        return self.config.get('realtime', False)
+
+    def get_query_limits(self):
+        """Return the query limits this data set sets for itself"""
+        return dict((limit, self.config[key])
+                    for key, limit in QUERY_LIMIT_CONFIG.items()
+                    if self.config.get(key) is not None)
+
     def execute_query(self, query):
-        results = self.storage.execute_query(self.name, query)
+        if query.delta and query.period and not query.flatten:
+            return self._execute_shifting_query(query)
+
+        return build_data(self._fetch_results(query), query).data()
+
+    def execute_page(self, query):
+        """Return a page of a raw query's results and the cursor for the
+        next page, which is None on the last page"""
+        if not query.is_paginated:
+            raise ValueError("Only raw queries asking for pages are paginated")
+
+        results = list(self._fetch_results(query))
+
+        next_cursor = None
+        if len(results) == query.limit:
+            next_cursor = document_cursor(results[-1])
+
+        return SimpleData(results, fields=query.fields).data(), next_cursor
+
+    def _fetch_results(self, query):
+        # Realtime data sets must see their latest writes so are always read
+        # from the primary
+        return self.storage.execute_query(
+            self.name, query, secondary_ok=not self.is_realtime(),
+            limits=self.get_query_limits())
+
+    def _execute_shifting_query(self, query):
+        """Run a query for a number of periods, shifting the window so that
+        it starts (or ends, when looking back) on a period with data
+
+        The window can move by up to one less than its number of periods, so
+        the results for every period it could cover are fetched at once and
+        the shifted window is cut from them.
+        """
+        reach = query.period.delta * (abs(query.delta) - 1)
+        if query.delta < 0:
+            widened = query._replace(start_at=query.start_at - reach)
+        else:
+            widened = query._replace(end_at=query.end_at + reach)
+        results = list(self._fetch_results(widened))
+
+        data = build_data(_results_within(results, query), query)
+        shift = data.amount_to_shift(query.delta)
+        if shift == 0:
+            return data.data()
+
+        shifted_query = query.get_shifted_query(shift)
+        return build_data(
+            _results_within(results, shifted_query), shifted_query).data()
+
+    def stream_query(self, query, batch_size):
+        """Iterate over the documents matched by a raw query, fetching
+        batch_size of them from storage at a time"""
+        if query.is_grouped:
+            raise ValueError("Only raw queries can be streamed")
+
+        results = self.storage.stream_query(
+            self.name, query, batch_size, secondary_ok=not self.is_realtime(),
+            limits=self.get_query_limits())
+
+        return (simple_document(result, query.fields) for result in results)
+
 
-        data = build_data(results, query)
+def _results_within(results, query):
+    """Return the results for periods between the query's start and end"""
+    start_at_key = query.period.start_at_key
 
-        if query.delta:
-            shift = data.amount_to_shift(query.delta)
-            if shift != 0:
-                return self.execute_query(query.get_shifted_query(shift))
+    def within(result):
+        if start_at_key not in result:
+            # Leave it for build_data to reject
+            return True
+        start_at = timeutils.as_utc(result[start_at_key])
+        if query.inclusive:
+            return query.start_at <= start_at <= query.end_at
+        return query.start_at <= start_at < query.end_at
 
-        return data.data()
+    return [result for result in results if within(result)]
 
 
 def build_data(results, query):
     if not query.is_grouped:
         # TODO: strip internal fields
-        return SimpleData(results)
+        return SimpleData(results, fields=query.fields)
 
     if query.flatten:
         merge_fn = flat_merge
@@ -17,6 +17,13 @@ class DataSetCreationError(BackdropError):
     pass
 
 
+class QueryLimitError(BackdropError):
+
+    """Raised if a query would examine or return more documents, or take
+    longer, than its data set allows"""
+    pass
+
+
 class InvalidSortError(ValueError):
     pass
 
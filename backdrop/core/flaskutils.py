@@ -1,6 +1,6 @@
 from werkzeug.routing import BaseConverter, ValidationError
 from backdrop.core.validation import data_set_is_valid
-from flask import request
+from flask import request, has_request_context
 
 
 class DataSetConverter(BaseConverter):
@@ -12,4 +12,7 @@ class DataSetConverter(BaseConverter):
 
 
 def generate_request_id():
+    if not has_request_context():
+        # Made from a background thread or at start up
+        return ''
     return request.headers.get('Govuk-Request-Id', '')
@@ -1,18 +1,40 @@
 """
-HTTP Validation decorators for flask apps
+HTTP Validation helpers for flask apps
 See http://tools.ietf.org/html/rfc7234#section-4.3
 """
-import hashlib
-from flask import make_response, request
-from functools import wraps
+from flask import request
+from werkzeug.http import is_resource_modified, quote_etag
 
+from .timeutils import as_utc
 
-def etag(func):
-    @wraps(func)
-    def new_func(*args, **kwargs):
-        resp = make_response(func(*args, **kwargs))
-        resp.set_etag(hashlib.sha1(resp.data).hexdigest())
-        resp.make_conditional(request)
-        return resp
 
-    return new_func
+def _http_date(value):
+    # werkzeug compares against naive datetimes in UTC
+    if value is not None:
+        return as_utc(value).replace(tzinfo=None)
+
+
+def is_fresh(etag, last_modified):
+    """Check whether the client already has the current representation
+    according to the conditional request headers
+
+    etag: a weak ETag that changes whenever the representation does
+    last_modified: when the representation last changed, or None
+    """
+    return not is_resource_modified(
+        request.environ,
+        etag=_weak_etag(etag),
+        last_modified=_http_date(last_modified))
+
+
+def _weak_etag(etag):
+    # werkzeug marks weak etags with a lowercase w/, which RFC 7232 does not
+    # allow
+    return 'W/' + quote_etag(etag)
+
+
+def set_validators(response, etag, last_modified):
+    response.headers['ETag'] = _weak_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _http_date(last_modified)
+    return response
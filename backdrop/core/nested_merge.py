@@ -1,6 +1,5 @@
 from .errors import InvalidOperationError
 
-from operator import add
 import itertools
 
 
@@ -13,57 +12,135 @@ def _multi_itemgetter(items):
 
 
 def nested_merge(keys, collect, data):
+    """Group results into a hierarchy, one level for each combination of keys,
+    and add the collected values to every group
+
+    The hierarchy is built in a single pass and each result is only
+    copied once.
+
+    >>> nested_merge([['a'], ['b']], [('c', 'sum')], [
+    ...     {'a': 2, 'b': 1, '_count': 1, 'c': [3]},
+    ...     {'a': 1, 'b': 2, '_count': 2, 'c': [4, 5]},
+    ...     {'a': 1, 'b': 1, '_count': 1, 'c': [6]}]) == [
+    ...     {'a': 1, '_count': 3, '_group_count': 2, 'c:sum': 15,
+    ...      '_subgroup': [{'b': 1, '_count': 1, 'c:sum': 6},
+    ...                    {'b': 2, '_count': 2, 'c:sum': 9}]},
+    ...     {'a': 2, '_count': 1, '_group_count': 1, 'c:sum': 3,
+    ...      '_subgroup': [{'b': 1, '_count': 1, 'c:sum': 3}]}]
+    True
+    """
     if len(keys) > 1:
-        data = group_by(data, keys)
-        data = apply_counts(data)
-
-    data = apply_collect(data, collect)
-    data = sort_subgroups(data, keys)
+        groups = _group_hierarchy(data, keys)
+    else:
+        groups = sorted((dict(result) for result in data),
+                        key=_multi_itemgetter(keys[0]))
 
-    return data
-
-
-def flat_merge(keys, collect, data):
-    if not collect:
-        return data
+    methods = {}
+    for key, method in collect:
+        methods.setdefault(key, []).append(method)
+    collect = [(key, method, collect_key(key, method))
+               for key, method in collect]
 
-    data = apply_collect(data, collect)
+    for group in groups:
+        _collect_group(group, collect, methods)
 
-    return data
+    return groups
 
 
-def group_by(data, keys):
-    """Recursively group an array of results by a list of keys
+def _group_hierarchy(data, keys):
+    """Return the groups for the first combination of keys, each with its
+    _subgroup, _count and _group_count, sorted at every level
 
-    data: a list of dictionaries as returned by MongoDriver.group
-    keys: a list of combinations of keys to group by
+    Groups are found by hashing their values, so sorting is only needed
+    for the distinct groups at each level. The results themselves form the
+    last level, in their original order within each group of equal values.
+    """
+    getters = [_multi_itemgetter(key_combo) for key_combo in keys]
+    grouped_keys = set(itertools.chain.from_iterable(keys[:-1]))
+    last_level = len(keys) - 2
+
+    top = {}
+    for result in data:
+        index = top
+        for level, getter in enumerate(getters[:-1]):
+            values = getter(result)
+            node = index.get(values)
+            if node is None:
+                node = index[values] = (
+                    dict(zip(keys[level], values)),
+                    [] if level == last_level else {})
+            index = node[1]
+
+        index.append(dict(
+            (key, value) for key, value in result.iteritems()
+            if key not in grouped_keys))
+
+    def build(index, level):
+        groups = []
+        for values in sorted(index):
+            group, children = index[values]
+            if level == last_level:
+                subgroups = sorted(children, key=getters[level + 1])
+            else:
+                subgroups = build(children, level + 1)
+
+            group['_subgroup'] = subgroups
+            group['_count'] = sum(subgroup['_count'] for subgroup in subgroups)
+            group['_group_count'] = len(subgroups)
+            groups.append(group)
+        return groups
+
+    return build(top, 0)
+
+
+def _collect_group(group, collect, methods):
+    """Add the collected values to a group and its subgroups, in place
+
+    collect: a list of field name, collection method and collect_key
+    methods: the collection methods of each field
+    Returns the partial results for each collected field, which are merged
+    into the results of the group's parent.
     """
-    key_combo = keys[0]
-    getter = _multi_itemgetter(key_combo)
-    data = sorted(data, key=getter)
+    if '_subgroup' in group:
+        subgroup_partials = [_collect_group(subgroup, collect, methods)
+                             for subgroup in group['_subgroup']]
+
+    partials = {}
+    for key, _, _ in collect:
+        if key in partials:
+            continue
+        if key in group:
+            values = group[key]
+            if not isinstance(values, PreReduced):
+                values = PreReduced.from_values(values, methods[key])
+            partials[key] = values
+        elif '_subgroup' in group:
+            partials[key] = reduce(PreReduced.merge, [
+                subgroup[key] for subgroup in subgroup_partials])
+        else:
+            partials[key] = PreReduced.from_values(None, methods[key])
+
+    for key, method, output_key in collect:
+        group[output_key] = partials[key].reduce(method)
+
+    for key, _, _ in collect:
+        group.pop(key, None)
 
-    if len(keys) > 1:
-        grouped_data = []
-        for values, subgroups in itertools.groupby(data, getter):
-            # create a dict containing key value pairs and _subgroup
-            result = dict(zip(key_combo, values))
-            result['_subgroup'] = group_by(
-                remove_keys_from_all(subgroups, key_combo),
-                keys[1:]
-            )
-            grouped_data.append(result)
-        data = grouped_data
+    # Hack in the old way
+    for key, method, output_key in collect:
+        if method == 'default':
+            group[key] = group[output_key]
+
+    return partials
 
-    return data
 
+def flat_merge(keys, collect, data):
+    if not collect:
+        return data
 
-def remove_keys_from_all(groups, keys):
-    """Remove keys from each group in a list of groups
+    data = apply_collect(data, collect)
 
-    groups: a list of groups (dictionaries)
-    key: the key to remove
-    """
-    return [remove_keys(group, keys) for group in groups]
+    return data
 
 
 def remove_keys(doc, keys):
@@ -80,24 +157,6 @@ def remove_keys(doc, keys):
         (k, v) for k, v in doc.items() if k not in keys)
 
 
-def apply_counts(groups):
-    """Add the _count and _group_count fields to a list of groups"""
-    return [
-        apply_counts_to_group(group)
-        for group in groups
-    ]
-
-
-def apply_counts_to_group(group):
-    """Add the _count and _group_count fields to a group"""
-    if '_subgroup' in group:
-        subgroups = apply_counts(group['_subgroup'])
-        group['_subgroup'] = subgroups
-        group['_count'] = sum(subgroup['_count'] for subgroup in subgroups)
-        group['_group_count'] = len(subgroups)
-    return group
-
-
 def apply_collect(groups, collect):
     """Apply collected values to a list of groups
 
@@ -148,17 +207,126 @@ def collect_key(key, method):
 
 
 def collect_value(group, key, method):
-    reducer = collect_reducer(method)
-    return reducer(collect_all_values(group, key))
+    return _reduce_values(collect_all_values(group, key), method)
 
 
 def collect_all_values(group, key):
     if key in group:
         return group[key]
     elif '_subgroup' in group:
-        _subgroup = [
-            collect_all_values(sub, key) for sub in group['_subgroup']]
-        return reduce(add, _subgroup)
+        return _merge_values([
+            collect_all_values(sub, key) for sub in group['_subgroup']])
+
+
+def _reduce_values(values, method):
+    if isinstance(values, PreReduced):
+        return values.reduce(method)
+    reducer = collect_reducer(method)
+    return reducer(values)
+
+
+def _merge_values(subgroup_values):
+    """Combine the values collected from each subgroup"""
+    if all(isinstance(values, PreReduced) for values in subgroup_values):
+        return reduce(PreReduced.merge, subgroup_values)
+    return list(itertools.chain.from_iterable(subgroup_values))
+
+
+class PreReduced(object):
+    """Collected values that have already been reduced, by the storage
+    engine or by from_values
+
+    Rather than every raw value, only the partial result needed by each
+    collect method is held, so the values for a parent group are found by
+    merging the partials of its subgroups.
+
+    partials: a dict of collect method to partial result, where a sum
+              or a count is a number, a mean is a (total, count) pair and
+              a set is a set of values
+    """
+
+    def __init__(self, partials):
+        self.partials = partials
+
+    @classmethod
+    def from_values(cls, values, methods):
+        """Return the partial results of collecting a list of values with
+        each of methods
+
+        >>> pre_reduced = PreReduced.from_values([1, 2, 2], ['sum', 'mean'])
+        >>> pre_reduced.partials == {'sum': 5, 'mean': (5, 3)}
+        True
+        >>> PreReduced.from_values([1, 2, 2], ['default']).partials
+        {'set': set([1, 2])}
+        >>> PreReduced.from_values(['a'], ['mean'])
+        Traceback (most recent call last):
+            ...
+        InvalidOperationError: Unable to find the mean of that data
+        """
+        partials = {}
+        for method in methods:
+            method = replace_default_method(method)
+            if method == 'sum':
+                partials[method] = collect_reducer_sum(values)
+            elif method == 'count':
+                partials[method] = collect_reducer_count(values)
+            elif method == 'mean':
+                try:
+                    partials[method] = (sum(values), len(values))
+                except TypeError:
+                    raise InvalidOperationError(
+                        "Unable to find the mean of that data")
+            elif method == 'set':
+                partials[method] = set(values)
+            else:
+                raise ValueError(
+                    "Unknown collection method {}".format(method))
+        return cls(partials)
+
+    def merge(self, other):
+        """Return the combination of two sets of partial results
+
+        >>> a = PreReduced({'sum': 3, 'mean': (3, 2), 'set': set([1, 2])})
+        >>> b = PreReduced({'sum': 4, 'mean': (4, 1), 'set': set([2, 4])})
+        >>> merged = a.merge(b)
+        >>> merged.reduce('sum'), merged.reduce('mean'), merged.reduce('set')
+        (7, 2.3333333333333335, [1, 2, 4])
+        """
+        partials = {}
+        for method, partial in self.partials.items():
+            other_partial = other.partials[method]
+            if method == 'mean':
+                partials[method] = (partial[0] + other_partial[0],
+                                    partial[1] + other_partial[1])
+            elif method == 'set':
+                partials[method] = partial | other_partial
+            else:
+                partials[method] = partial + other_partial
+        return PreReduced(partials)
+
+    def reduce(self, method):
+        """Return the final value for a collect method
+
+        >>> PreReduced({'mean': (0, 0)}).reduce('mean')
+        >>> PreReduced({'set': set(['b', 'a'])}).reduce('default')
+        ['a', 'b']
+        >>> PreReduced({'sum': 1}).reduce('count')
+        Traceback (most recent call last):
+            ...
+        ValueError: Collection method count was not reduced
+        """
+        method = replace_default_method(method)
+        if method not in self.partials:
+            raise ValueError(
+                "Collection method {} was not reduced".format(method))
+
+        partial = self.partials[method]
+        if method == 'mean':
+            total, count = partial
+            return total / float(count) if count else None
+        elif method == 'set':
+            return sorted(partial)
+        return partial
 
 
 def collect_reducer(method):
@@ -219,11 +387,3 @@ def collect_reducer_mean(values):
         return sum(values) / float(len(values))
     except TypeError:
         raise InvalidOperationError("Unable to find the mean of that data")
-
-
-def sort_subgroups(data, keys):
-    key_combo = keys[0]
-    if len(keys) > 1:
-        for i, group in enumerate(data):
-            data[i]['_subgroup'] = sort_subgroups(group['_subgroup'], keys[1:])
-    return sorted(data, key=_multi_itemgetter(key_combo))
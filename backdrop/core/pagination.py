@@ -0,0 +1,67 @@
+"""
+Cursors for paging through raw queries
+
+A page of a raw query ends on the document with the greatest _timestamp
+and _id, so the next page is every document after that pair. Cursors are
+opaque to clients; they encode the pair as base64 JSON.
+"""
+import base64
+import json
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from .timeutils import as_utc, parse_time_as_utc
+
+
+__all__ = ['encode_cursor', 'decode_cursor', 'document_cursor']
+
+
+def encode_cursor(timestamp, _id):
+    """Return the cursor for the documents after a _timestamp and _id
+
+    >>> from datetime import datetime
+    >>> decode_cursor(encode_cursor(datetime(2014, 1, 1), 'abc'))
+    (datetime.datetime(2014, 1, 1, 0, 0, tzinfo=<UTC>), u'abc')
+    >>> _id = ObjectId('5301a6a3e4b0d2d45d5b7f16')
+    >>> decode_cursor(encode_cursor(None, _id))
+    (None, ObjectId('5301a6a3e4b0d2d45d5b7f16'))
+    """
+    if timestamp is not None:
+        timestamp = as_utc(timestamp).isoformat()
+    if isinstance(_id, ObjectId):
+        _id = {'$oid': str(_id)}
+
+    return base64.urlsafe_b64encode(
+        json.dumps([timestamp, _id], separators=(',', ':')))
+
+
+def decode_cursor(cursor):
+    """Return the _timestamp and _id a cursor was made from
+
+    Raises ValueError if the cursor is not one made by encode_cursor.
+
+    >>> decode_cursor('not a cursor')
+    Traceback (most recent call last):
+        ...
+    ValueError: Invalid cursor
+    """
+    try:
+        timestamp, _id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')))
+
+        if timestamp is not None:
+            timestamp = parse_time_as_utc(timestamp)
+        if isinstance(_id, dict):
+            _id = ObjectId(_id['$oid'])
+        elif not isinstance(_id, (basestring, int, long)):
+            raise ValueError
+    except (TypeError, ValueError, KeyError, InvalidId, AttributeError):
+        raise ValueError('Invalid cursor')
+
+    return timestamp, _id
+
+
+def document_cursor(document):
+    """Return the cursor for the documents after this one"""
+    return encode_cursor(document.get('_timestamp'), document['_id'])
@@ -1,5 +1,9 @@
+import hashlib
+import json
 from collections import namedtuple
 
+from .nested_merge import collect_key
+from .pagination import encode_cursor
 from .timeutils import now
 
 
@@ -12,7 +16,7 @@ _Query = namedtuple(
     '_Query',
     ['start_at', 'end_at', 'delta', 'period',
      'filter_by', 'filter_by_prefix', 'group_by', 'sort_by', 'limit',
-     'collect', 'flatten', 'inclusive'])
+     'collect', 'flatten', 'inclusive', 'fields', 'after', 'paginate'])
 
 
 class Query(_Query):
@@ -22,7 +26,8 @@ class Query(_Query):
                start_at=None, end_at=None, duration=None, delta=None,
                period=None, filter_by=None, filter_by_prefix=None,
                group_by=None, sort_by=None, limit=None, collect=None,
-               flatten=None, inclusive=None):
+               flatten=None, inclusive=None, fields=None, after=None,
+               paginate=None):
         delta = None
         if duration is not None:
             date = start_at or end_at or now()
@@ -31,7 +36,8 @@ class Query(_Query):
                                                              delta)
         return Query(start_at, end_at, delta, period, filter_by or [],
                      filter_by_prefix or [], group_by or [], sort_by, limit,
-                     collect or [], flatten, inclusive)
+                     collect or [], flatten, inclusive, fields, after,
+                     paginate)
 
     @staticmethod
     def __calculate_start_and_end(period, date, delta):
@@ -76,6 +82,31 @@ class Query(_Query):
             keys.append([self.period.start_at_key])
         return keys
 
+    @property
+    def flat_keys(self):
+        """Return the keys of the rows of a flattened grouped query, in
+        the order they are exported
+
+        They are known from the query alone so rows can be written out
+        without looking at all of them first.
+
+        >>> from ..core.timeseries import WEEK
+        >>> Query.create(group_by=['foo'], period=WEEK,
+        ...              collect=[('bar', 'sum'), ('baz', 'default')]
+        ...              ).flat_keys
+        ['foo', '_start_at', '_end_at', '_count', 'bar:sum', 'baz:set', 'baz']
+        """
+        keys = list(self.group_by)
+        if self.period:
+            keys.extend(['_start_at', '_end_at'])
+        keys.append('_count')
+        for field, method in self.collect:
+            keys.append(collect_key(field, method))
+            if method == 'default':
+                # Still returned under the field name as well
+                keys.append(field)
+        return keys
+
     @property
     def is_grouped(self):
         """
@@ -88,6 +119,64 @@ class Query(_Query):
         """
         return bool(self.group_by) or bool(self.period)
 
+    @property
+    def is_paginated(self):
+        """Raw queries with a limit that ask for pages, or for the page
+        after a cursor, are returned in pages ordered by _timestamp and _id
+
+        >>> Query.create(limit=10, paginate=True).is_paginated
+        True
+        >>> Query.create(limit=10, after=(None, 'abc')).is_paginated
+        True
+        >>> Query.create(limit=10).is_paginated
+        False
+        >>> Query.create(limit=10, paginate=True,
+        ...              sort_by=['foo', 'ascending']).is_paginated
+        False
+        >>> Query.create(limit=10, paginate=True,
+        ...              group_by=['foo']).is_paginated
+        False
+        """
+        if not self.paginate and self.after is None:
+            return False
+        return bool(self.limit) and not self.sort_by and not self.is_grouped
+
+    @property
+    def cache_key(self):
+        """Return a key that is the same for queries that return the same
+        results
+
+        The order of filters, collected fields and selected fields does not
+        matter, nor does whether strings are unicode.
+
+        >>> Query.create(filter_by=[['a', 1], ['b', u'c']]).cache_key == \\
+        ...     Query.create(filter_by=[['b', 'c'], ['a', 1]]).cache_key
+        True
+        >>> Query.create(limit=1).cache_key == Query.create().cache_key
+        False
+        """
+        def isoformat(value):
+            return value.isoformat() if value else None
+
+        return hashlib.sha1(json.dumps([
+            isoformat(self.start_at),
+            isoformat(self.end_at),
+            self.delta,
+            self.period.name if self.period else None,
+            sorted(map(list, self.filter_by)),
+            sorted([key, getattr(value, 'pattern', value)]
+                   for key, value in self.filter_by_prefix),
+            self.group_by,
+            self.sort_by,
+            self.limit,
+            sorted(map(list, self.collect)),
+            self.flatten,
+            self.inclusive,
+            sorted(self.fields) if self.fields is not None else None,
+            encode_cursor(*self.after) if self.after else None,
+            self.paginate,
+        ])).hexdigest()
+
     def get_shifted_query(self, shift):
         """Return a new Query where the date is shifted by n periods"""
         args = self._asdict()
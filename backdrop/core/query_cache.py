@@ -0,0 +1,116 @@
+"""
+Cache query results against the version of the data set they came from
+
+Every write to a data set bumps its version, so cached results never have
+to be invalidated. Results for old versions are no longer asked for and
+age out of the cache.
+"""
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+from pymongo.errors import DuplicateKeyError
+
+from backdrop import statsd
+
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['QueryCache', 'InProcessBackend', 'MongoBackend']
+
+
+class InProcessBackend(object):
+    """A least recently used cache limited by entries and bytes"""
+
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        if len(value) > self._max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+
+            self._entries[key] = value
+            self._bytes += len(value)
+
+            while len(self._entries) > self._max_entries \
+                    or self._bytes > self._max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+
+class MongoBackend(object):
+    """A cache shared between processes, kept in a capped collection
+
+    The collection evicts its oldest entries once it is full. Values too
+    large to store in a single document are not cached.
+    """
+
+    def __init__(self, collection, max_value_bytes=8 * 1024 * 1024):
+        self._collection = collection
+        self._max_value_bytes = max_value_bytes
+
+    def get(self, key):
+        entry = self._collection.find_one({'_id': key})
+        if entry is not None:
+            return entry['value']
+
+    def set(self, key, value):
+        if len(value) > self._max_value_bytes:
+            return
+
+        try:
+            self._collection.insert({'_id': key, 'value': value})
+        except DuplicateKeyError:
+            # Another process cached the same results first
+            pass
+
+
+class QueryCache(object):
+
+    def __init__(self, backend, cls=json.JSONEncoder):
+        self._backend = backend
+        self._cls = cls
+
+    def execute_query(self, data_set, query):
+        """Return the results of a query on a data set, running the query
+        only if it has not been cached for the current version"""
+        return self._cached(data_set, query, 'query', data_set.execute_query)
+
+    def execute_page(self, data_set, query):
+        """Return a page of results and the next cursor, as
+        DataSet.execute_page does"""
+        return tuple(self._cached(
+            data_set, query, 'page', data_set.execute_page))
+
+    def _cached(self, data_set, query, kind, execute):
+        key = '{0}:{1}:{2}:{3}'.format(
+            data_set.name, data_set.get_version(), kind, query.cache_key)
+
+        cached = self._backend.get(key)
+        if cached is not None:
+            statsd.incr('query_cache.hit', data_set=data_set.name)
+            return json.loads(cached)
+
+        statsd.incr('query_cache.miss', data_set=data_set.name)
+        data = execute(query)
+        self._backend.set(key, json.dumps(data, cls=self._cls))
+
+        return data
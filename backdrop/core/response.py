@@ -39,18 +39,27 @@ def first_nonempty(data, is_reversed):
     return first_nonempty_index
 
 
+def simple_document(document, fields=None):
+    """Prepare a document from a raw query for the response"""
+    if fields is not None:
+        document = dict((key, value) for key, value in document.items()
+                        if key in fields)
+    if "_timestamp" in document:
+        document["_timestamp"] = \
+            document["_timestamp"].replace(tzinfo=pytz.utc)
+    return document
+
+
 class SimpleData(object):
 
-    def __init__(self, cursor):
+    def __init__(self, cursor, fields=None):
         self._data = []
+        self._fields = fields
         for doc in cursor:
             self.__add(doc)
 
     def __add(self, document):
-        if "_timestamp" in document:
-            document["_timestamp"] = \
-                document["_timestamp"].replace(tzinfo=pytz.utc)
-        self._data.append(document)
+        self._data.append(simple_document(document, self._fields))
 
     def data(self):
         return tuple(self._data)
@@ -204,13 +213,14 @@ class PeriodFlatData(object):
         if collect:
             default.update((collect_key(k, v), None) for k, v in collect)
 
-        filled_in_data = fill_group_by_permutations(start=start_date,
-                                                    end=end_date,
-                                                    period=self._period,
-                                                    data=self._data,
-                                                    default=default,
-                                                    group_by=group_by,
-                                                    )
+        filled_in_data = list(fill_group_by_permutations(
+            start=start_date,
+            end=end_date,
+            period=self._period,
+            data=self._data,
+            default=default,
+            group_by=group_by,
+        ))
 
         self._data = filled_in_data
         return filled_in_data
@@ -0,0 +1,230 @@
+"""Recommend indexes for data sets from the shape of the queries run on them
+
+Each query is reduced to its shape: which fields it filters, groups and
+sorts on and whether it is bounded in time. Shapes are counted per data
+set (in this process) and each is mapped to the compound index that would
+serve it, following the equality, sort, range ordering. Indexes can
+optionally be created in the background once a shape has been seen often
+enough.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple, defaultdict, OrderedDict
+
+import pymongo
+
+from .mongo import get_mongo_spec, time_range_to_mongo_query
+
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['IndexAdvisor', 'query_shape', 'recommend_index']
+
+
+QueryShape = namedtuple(
+    'QueryShape',
+    ['filter_keys', 'prefix_keys', 'group_keys', 'period', 'sort',
+     'time_bounded'])
+
+
+def query_shape(query):
+    """Return the normalised shape of a Query
+
+    >>> from backdrop.core.query import Query
+    >>> from backdrop.core.timeseries import WEEK
+    >>> shape = query_shape(Query.create(
+    ...     filter_by=[('b', 1), ('a', 2)], group_by=['c'], period=WEEK))
+    >>> shape.filter_keys, shape.group_keys, shape.period
+    (('a', 'b'), ('c',), 'week')
+    >>> query_shape(Query.create(sort_by=['a', 'descending'])).sort
+    ('a', 'descending')
+    """
+    return QueryShape(
+        filter_keys=tuple(sorted(set(key for key, _ in query.filter_by))),
+        prefix_keys=tuple(
+            sorted(set(key for key, _ in query.filter_by_prefix))),
+        group_keys=tuple(query.group_by),
+        period=query.period.name if query.period else None,
+        sort=tuple(query.sort_by) if query.sort_by else None,
+        time_bounded=bool(query.start_at or query.end_at))
+
+
+def recommend_index(shape):
+    """Return the index keys that would best serve a query shape
+
+    Equality filters come first, then the sort key of raw queries and
+    finally the range conditions. Returns None if the default _timestamp
+    index is as good as it gets.
+
+    >>> from backdrop.core.query import Query
+    >>> recommend_index(query_shape(Query.create(filter_by=[('a', 1)])))
+    [('a', 1)]
+    >>> from datetime import datetime
+    >>> recommend_index(query_shape(Query.create(
+    ...     filter_by=[('a', 1)], start_at=datetime(2012, 1, 1))))
+    [('a', 1), ('_timestamp', -1)]
+    >>> recommend_index(query_shape(Query.create(
+    ...     start_at=datetime(2012, 1, 1))))
+    """
+    keys = [(key, pymongo.ASCENDING) for key in shape.filter_keys]
+
+    if shape.sort and not (shape.group_keys or shape.period):
+        field, direction = shape.sort
+        if field not in shape.filter_keys:
+            keys.append((field, pymongo.ASCENDING
+                         if direction == 'ascending' else pymongo.DESCENDING))
+
+    keys += [(key, pymongo.ASCENDING) for key in shape.prefix_keys
+             if key not in shape.filter_keys]
+
+    if shape.time_bounded:
+        keys.append(('_timestamp', pymongo.DESCENDING))
+
+    if not keys or [key for key, _ in keys] == ['_timestamp']:
+        return None
+
+    return keys
+
+
+def index_is_covered(keys, existing_indexes):
+    """Check whether an existing index starts with the given keys
+
+    >>> index_is_covered([('a', 1)], [[('a', 1), ('b', 1)]])
+    True
+    >>> index_is_covered([('a', 1), ('b', 1)], [[('a', 1)]])
+    False
+    """
+    fields = [field for field, _ in keys]
+    return any([field for field, _ in index][:len(fields)] == fields
+               for index in existing_indexes)
+
+
+class IndexAdvisor(object):
+    """Count query shapes per data set and recommend indexes for them
+
+    Only the most recently used max_shapes shapes of each data set are
+    kept, and reports are reused for report_ttl seconds as each one runs a
+    count per shape.
+    """
+
+    def __init__(self, storage, auto_create=False, min_queries=100,
+                 max_shapes=100, report_ttl=60):
+        self._storage = storage
+        self._auto_create = auto_create
+        self._min_queries = min_queries
+        self._max_shapes = max_shapes
+        self._report_ttl = report_ttl
+
+        self._lock = threading.Lock()
+        # data set -> shape -> (count, most recent query), in LRU order
+        self._shapes = defaultdict(OrderedDict)
+        self._provisioning = {}
+        self._reports = {}
+
+    def record(self, data_set_id, query):
+        """Count the shape of a query run against a data set"""
+        shape = query_shape(query)
+        with self._lock:
+            shapes = self._shapes[data_set_id]
+            count, _ = shapes.pop(shape, (0, None))
+            shapes[shape] = (count + 1, query)
+            while len(shapes) > self._max_shapes:
+                shapes.popitem(last=False)
+
+        if self._auto_create and count + 1 >= self._min_queries:
+            self._provision(data_set_id, shape)
+
+    def _provision(self, data_set_id, shape):
+        keys = recommend_index(shape)
+        if keys is None:
+            return
+
+        with self._lock:
+            if (data_set_id, tuple(keys)) in self._provisioning:
+                return
+            # Building an index can take a long time, so it must not hold
+            # up the request that triggered it
+            thread = threading.Thread(
+                target=self._create_index, args=(data_set_id, keys))
+            thread.daemon = True
+            self._provisioning[(data_set_id, tuple(keys))] = thread
+        thread.start()
+
+    def _create_index(self, data_set_id, keys):
+        try:
+            if not index_is_covered(
+                    keys, self._storage.get_indexes(data_set_id)):
+                logger.info(
+                    'Creating index {0} on {1}'.format(keys, data_set_id))
+                self._storage.create_index(data_set_id, keys)
+        except Exception:
+            logger.exception(
+                'Failed to create index {0} on {1}'.format(keys, data_set_id))
+
+    def report(self, data_set_id=None):
+        """Return the recommended indexes for each recorded query shape
+
+        The number of documents scanned is estimated for the most recent
+        query of each shape, both with the indexes the data set has now and
+        with the recommended index, and weighted by how often the shape has
+        been seen.
+        """
+        now = time.time()
+        with self._lock:
+            shapes = dict((name, dict(shapes))
+                          for name, shapes in self._shapes.items()
+                          if data_set_id in (None, name))
+            cached = dict((name, self._reports[name][1]) for name in shapes
+                          if name in self._reports and
+                          now - self._reports[name][0] < self._report_ttl)
+
+        reports = []
+        for name in sorted(shapes):
+            if name not in cached:
+                cached[name] = self._data_set_report(name, shapes[name])
+                with self._lock:
+                    self._reports[name] = (now, cached[name])
+            reports.append(cached[name])
+
+        return reports
+
+    def _data_set_report(self, data_set_id, shapes):
+        existing_indexes = self._storage.get_indexes(data_set_id)
+        total = self._storage.count(data_set_id)
+
+        recommendations = []
+        for shape, (count, query) in sorted(shapes.items(),
+                                            key=lambda i: -i[1][0]):
+            keys = recommend_index(shape)
+            if keys is None:
+                continue
+
+            exists = index_is_covered(keys, existing_indexes)
+            with_index = self._storage.count(
+                data_set_id, get_mongo_spec(query))
+            if exists:
+                scanned = with_index
+            elif query.start_at or query.end_at:
+                scanned = self._storage.count(
+                    data_set_id,
+                    time_range_to_mongo_query(
+                        query.start_at, query.end_at, query.inclusive))
+            else:
+                scanned = total
+
+            recommendations.append({
+                'index': keys,
+                'exists': exists,
+                'queries': count,
+                'shape': shape._asdict(),
+                'documents_scanned': scanned,
+                'documents_scanned_with_index': with_index,
+                'estimated_scan_savings': count * (scanned - with_index),
+            })
+
+        return {
+            'name': data_set_id,
+            'documents': total,
+            'recommendations': recommendations,
+        }
@@ -1,14 +1,21 @@
 import os
+import time
 import logging
 import datetime
 import itertools
+from collections import defaultdict
 
 import pymongo
-from pymongo.errors import AutoReconnect, CollectionInvalid
-from bson import Code
+from pymongo.errors import AutoReconnect, BulkWriteError, \
+    CollectionInvalid, ExecutionTimeout, OperationFailure
+from pymongo.read_preferences import ReadPreference
+from bson import Code, ObjectId
+
+from backdrop import statsd
 
 from .. import timeutils
-from ..errors import DataSetCreationError
+from ..errors import DataSetCreationError, QueryLimitError
+from ..nested_merge import PreReduced, replace_default_method
 
 
 logger = logging.getLogger(__name__)
@@ -70,41 +77,215 @@ def reconnecting_save(collection, record, tries=3):
             raise
 
 
-LAST_UPDATED_COMBINED_JS = """
-function(collection_names) {
-    return collection_names.map(function(name) {
-        return db[name];
-    }).filter(function(collection) {
-        return collection !== undefined;
-    }).map(function(collection, i) {
-        query = collection.find().sort({_timestamp:-1}).limit(1);
-        return {
-            name: collection_names[i],
-            last_updated: query.hasNext() ? query.next()['_timestamp'] : undefined
-        }
-    });
+def reconnecting_bulk_save(collection, records, tries=3):
+    """Upsert a batch of records keyed on _id, retrying if necesarry
+
+    Every record must already have an _id so that replaying the whole
+    batch after a reconnect cannot duplicate any of them.
+    """
+    bulk = collection.initialize_unordered_bulk_op()
+    for record in records:
+        bulk.find({'_id': record['_id']}).upsert().replace_one(record)
+
+    try:
+        bulk.execute()
+    except AutoReconnect:
+        logger.warning('AutoReconnect on bulk save : {}'.format(tries))
+        if tries > 1:
+            return reconnecting_bulk_save(collection, records, tries - 1)
+        else:
+            raise
+
+
+def write_error_messages(bulk_write_error, offset=0):
+    """Return a message for each record that failed in a bulk write
+
+    offset: the position of the first record of the batch in the records
+            being saved
+
+    >>> error = BulkWriteError({'writeErrors': [
+    ...     {'index': 1, 'code': 11000, 'errmsg': 'duplicate key'}]})
+    >>> write_error_messages(error, offset=10)
+    ['record 11 could not be saved: duplicate key']
+    """
+    return ['record {0} could not be saved: {1}'.format(
+            offset + error['index'], error['errmsg'])
+            for error in bulk_write_error.details.get('writeErrors', [])]
+
+
+# Holds the time of the last write and the latest _timestamp for each data
+# set, keyed on the data set name. Data set names cannot start with an
+# underscore so this can never clash with a data set.
+FRESHNESS_COLLECTION = '_data_set_freshness'
+FRESHNESS_FIELDS = ('_updated_at', '_timestamp')
+
+
+GROUP_ENGINES = ('group', 'aggregate')
+
+# Collect methods that the aggregation pipeline can reduce to the same
+# result as the python reducers. The values of fields collected with any
+# other method, count included since $sum cannot tell null from missing,
+# are pushed into an array and reduced in nested_merge.
+PUSHDOWN_METHODS = ('sum', 'mean', 'set')
+
+BULK_WRITE_CHUNK_SIZE = 1000
+
+# Pages of raw queries are read in order from this index
+PAGE_INDEX = [('_timestamp', pymongo.DESCENDING), ('_id', pymongo.DESCENDING)]
+
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primary_preferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondary_preferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST,
 }
-"""
+
+# How long, in seconds, a measurement of the replication lag is trusted
+REPLICATION_LAG_TTL = 10
+
+# What a query may cost: how long it may run in milliseconds, how many
+# documents it may examine and how many results it may return. None is no
+# limit.
+QUERY_LIMITS = ('max_time_ms', 'max_documents_examined', 'max_results')
+
+
+def replication_lag(status):
+    """Return how far, in seconds, the slowest secondary is behind the
+    primary given the output of replSetGetStatus
+
+    Returns None unless there is both a primary and a secondary.
+
+    >>> from datetime import datetime as dt
+    >>> replication_lag({'members': [
+    ...     {'stateStr': 'PRIMARY', 'optimeDate': dt(2014, 1, 1, 0, 0, 30)},
+    ...     {'stateStr': 'SECONDARY', 'optimeDate': dt(2014, 1, 1, 0, 0, 20)},
+    ...     {'stateStr': 'SECONDARY', 'optimeDate': dt(2014, 1, 1, 0, 0, 28)},
+    ...     {'stateStr': 'ARBITER'}]})
+    10.0
+    >>> replication_lag({'members': [
+    ...     {'stateStr': 'PRIMARY', 'optimeDate': dt(2014, 1, 1)}]})
+    """
+    optimes = defaultdict(list)
+    for member in status.get('members', []):
+        optimes[member.get('stateStr')].append(member.get('optimeDate'))
+
+    if not optimes['PRIMARY'] or not optimes['SECONDARY']:
+        return None
+
+    return (max(optimes['PRIMARY']) -
+            min(optimes['SECONDARY'])).total_seconds()
 
 
 class MongoStorageEngine(object):
 
     @classmethod
-    def create(cls, hosts, port, database):
-        return cls(get_mongo_client(hosts, port), database)
+    def create(cls, hosts, port, database, group_engine='group',
+               collect_pushdown=False,
+               bulk_write_chunk_size=BULK_WRITE_CHUNK_SIZE,
+               read_preference='primary', max_staleness=None,
+               query_limits=None):
+        return cls(get_mongo_client(hosts, port), database,
+                   group_engine=group_engine,
+                   collect_pushdown=collect_pushdown,
+                   bulk_write_chunk_size=bulk_write_chunk_size,
+                   read_preference=read_preference,
+                   max_staleness=max_staleness,
+                   query_limits=query_limits)
+
+    def __init__(self, mongo, database, group_engine='group',
+                 collect_pushdown=False,
+                 bulk_write_chunk_size=BULK_WRITE_CHUNK_SIZE,
+                 read_preference='primary', max_staleness=None,
+                 query_limits=None):
+        """
+        read_preference: where queries may be sent, one of READ_PREFERENCES.
+                         Writes and all other operations always go to the
+                         primary.
+        max_staleness: the number of seconds secondaries may fall behind the
+                       primary before queries are sent to the primary
+                       instead, or None for no limit
+        query_limits: the default for each of QUERY_LIMITS, for data sets
+                      that do not set their own
+        """
+        if group_engine not in GROUP_ENGINES:
+            raise ValueError(
+                "Unknown group engine {}".format(group_engine))
+        if collect_pushdown and group_engine != 'aggregate':
+            raise ValueError(
+                "Collect pushdown requires the aggregate group engine")
+        if read_preference not in READ_PREFERENCES:
+            raise ValueError(
+                "Unknown read preference {}".format(read_preference))
+        if set(query_limits or {}) - set(QUERY_LIMITS):
+            raise ValueError(
+                "Unknown query limits {}".format(query_limits))
 
-    def __init__(self, mongo, database):
         self._mongo = mongo
         self._db = mongo[database]
+        self._group_engine = group_engine
+        self._collect_pushdown = collect_pushdown
+        self._bulk_write_chunk_size = bulk_write_chunk_size
+        self._read_preference = READ_PREFERENCES[read_preference]
+        self._max_staleness = max_staleness
+        self._query_limits = dict.fromkeys(QUERY_LIMITS)
+        self._query_limits.update(query_limits or {})
+
+        self._replication_lag = None
+        self._replication_lag_expire_at = 0
+
+        # Data sets known to have PAGE_INDEX
+        self._page_indexed = set()
 
     def _collection(self, data_set_id):
         return self._db[data_set_id]
 
+    def _query_collection(self, data_set_id, secondary_ok):
+        collection = self._collection(data_set_id)
+        collection.read_preference = self._query_read_preference(
+            data_set_id, secondary_ok)
+        return collection
+
+    def _query_read_preference(self, data_set_id, secondary_ok):
+        if not secondary_ok or \
+                self._read_preference == ReadPreference.PRIMARY:
+            return ReadPreference.PRIMARY
+
+        if self._max_staleness is not None:
+            lag = self._get_replication_lag()
+            if lag is None or lag > self._max_staleness:
+                statsd.incr('storage.read_preference.stale',
+                            data_set=data_set_id)
+                return ReadPreference.PRIMARY
+
+        return self._read_preference
+
+    def _get_replication_lag(self):
+        if time.time() >= self._replication_lag_expire_at:
+            try:
+                self._replication_lag = replication_lag(
+                    self._mongo.admin.command('replSetGetStatus'))
+            except (AutoReconnect, OperationFailure) as e:
+                logger.warning(
+                    'Could not get replica set status: {}'.format(e))
+                self._replication_lag = None
+            self._replication_lag_expire_at = \
+                time.time() + REPLICATION_LAG_TTL
+
+        return self._replication_lag
+
     def alive(self):
         return self._mongo.alive()
 
     def data_set_exists(self, data_set_id):
-        return data_set_id in self._db.collection_names()
+        """Look up the one collection rather than listing them all
+
+        This is not cached, as writing to a collection that another process
+        has dropped would recreate it uncapped and without its indexes.
+        """
+        return self._db['system.namespaces'].find_one(
+            {'name': '{0}.{1}'.format(self._db.name, data_set_id)},
+            fields=['name']) is not None
 
     def create_data_set(self, data_set_id, size):
         try:
@@ -113,65 +294,308 @@ class MongoStorageEngine(object):
             else:
                 self._db.create_collection(data_set_id, capped=False)
 
-            self._collection(data_set_id).create_index(
-                [('_timestamp', pymongo.DESCENDING)])
+            self._collection(data_set_id).create_index(PAGE_INDEX)
+            self._page_indexed.add(data_set_id)
         except CollectionInvalid as e:
             raise DataSetCreationError(e.message)
 
     def delete_data_set(self, data_set_id):
         self._db.drop_collection(data_set_id)
+        self._clear_freshness(data_set_id)
+
+    def get_capped_collection(self, name, size, max_documents=None):
+        """Return a capped collection, creating it if it does not exist
+
+        Names starting with an underscore cannot clash with data sets.
+        """
+        options = {'capped': True, 'size': size}
+        if max_documents:
+            options['max'] = max_documents
+
+        try:
+            self._db.create_collection(name, **options)
+        except CollectionInvalid:
+            pass
+
+        return self._db[name]
+
+    def get_indexes(self, data_set_id):
+        """Return the keys of each index on a data set"""
+        return [index['key'] for index
+                in self._collection(data_set_id).index_information().values()]
+
+    def create_index(self, data_set_id, keys):
+        self._collection(data_set_id).create_index(keys, background=True)
+
+    def _ensure_page_index(self, data_set_id):
+        """Make sure a data set has PAGE_INDEX before it is paginated
+
+        Data sets created before pagination only have a _timestamp index, so
+        it is built the first time one is paginated rather than migrating
+        every collection up front. Mongo does nothing if it already exists.
+        """
+        if data_set_id not in self._page_indexed:
+            self._collection(data_set_id).ensure_index(
+                PAGE_INDEX, background=True)
+            self._page_indexed.add(data_set_id)
+
+    def count(self, data_set_id, spec=None):
+        return self._collection(data_set_id).find(spec).count()
 
     def get_last_updated(self, data_set_id):
-        last_updated = self._collection(data_set_id).find_one(
-            sort=[("_updated_at", pymongo.DESCENDING)])
-        if last_updated and last_updated.get('_updated_at') is not None:
-            return timeutils.utc(last_updated['_updated_at'])
+        freshness = self._get_freshness(data_set_id)
+        if freshness.get('_updated_at') is not None:
+            return timeutils.utc(freshness['_updated_at'])
 
     def batch_last_updated(self, data_sets):
-        all_last_updated = self._db.eval(
-            LAST_UPDATED_COMBINED_JS,
-            [ds.name for ds in data_sets]
-        )
-
-        for i, last_updated in enumerate(all_last_updated):
-            data_sets[i]._last_updated = time_as_utc(
-                last_updated.get('last_updated', datetime.datetime.min))
+        all_freshness = dict(
+            (freshness['_id'], freshness) for freshness in
+            self._db[FRESHNESS_COLLECTION].find(
+                {'_id': {'$in': [ds.name for ds in data_sets]}}))
+
+        for data_set in data_sets:
+            freshness = all_freshness.get(data_set.name)
+            if freshness is None:
+                freshness = self._backfill_freshness(data_set.name)
+
+            data_set._last_updated = time_as_utc(
+                freshness.get('_timestamp') or datetime.datetime.min)
+
+    def _get_freshness(self, data_set_id):
+        freshness = self._db[FRESHNESS_COLLECTION].find_one(
+            {'_id': data_set_id})
+        if freshness is None:
+            freshness = self._backfill_freshness(data_set_id)
+        return freshness
+
+    def _backfill_freshness(self, data_set_id):
+        """Find the freshness of a data set written before the freshness
+        collection existed and store it for next time"""
+        freshness = {}
+        for field in FRESHNESS_FIELDS:
+            latest = self._collection(data_set_id).find_one(
+                sort=[(field, pymongo.DESCENDING)])
+            if latest and latest.get(field) is not None:
+                freshness[field] = latest[field]
+
+        if freshness:
+            self._update_freshness(data_set_id, freshness)
+        return freshness
+
+    def _update_freshness(self, data_set_id, freshness):
+        self._db[FRESHNESS_COLLECTION].update(
+            {'_id': data_set_id}, {'$max': freshness}, upsert=True)
+
+    def _record_write(self, data_set_id, records, updated_at):
+        freshness = {'_updated_at': updated_at}
+        timestamps = [record['_timestamp'] for record in records
+                      if isinstance(record.get('_timestamp'),
+                                    datetime.datetime)]
+        if timestamps:
+            freshness['_timestamp'] = max(timestamps)
+
+        self._update_freshness(data_set_id, freshness)
+
+    def get_version(self, data_set_id, secondary_ok=True):
+        """Return a number that changes every time a data set is written
+
+        The version is read from the same members as queries would be, so
+        that it is never ahead of the data those queries can see.
+        """
+        collection = self._db[FRESHNESS_COLLECTION]
+        collection.read_preference = self._query_read_preference(
+            data_set_id, secondary_ok)
+
+        freshness = collection.find_one({'_id': data_set_id},
+                                        fields=['_version'])
+        return (freshness or {}).get('_version', 0)
+
+    def bump_version(self, data_set_id):
+        self._db[FRESHNESS_COLLECTION].update(
+            {'_id': data_set_id}, {'$inc': {'_version': 1}}, upsert=True)
+
+    def _clear_freshness(self, data_set_id):
+        self._db[FRESHNESS_COLLECTION].update(
+            {'_id': data_set_id},
+            {'$unset': dict((field, '') for field in FRESHNESS_FIELDS)})
 
     def empty_data_set(self, data_set_id):
         self._collection(data_set_id).remove({})
+        self._clear_freshness(data_set_id)
 
     def save_record(self, data_set_id, record):
         record['_updated_at'] = timeutils.now()
         self._collection(data_set_id).save(record)
+        self._record_write(data_set_id, [record], record['_updated_at'])
+
+    def save_records(self, data_set_id, records):
+        """Save records with unordered bulk upserts keyed on _id
+
+        Records are written in chunks, each of which is retried on a
+        reconnect. Returns a list of error messages for any records that
+        could not be saved.
+        """
+        collection = self._collection(data_set_id)
+        updated_at = timeutils.now()
+        chunk_size = self._bulk_write_chunk_size
+
+        errors = []
+        for offset in range(0, len(records), chunk_size):
+            chunk = records[offset:offset + chunk_size]
+            for record in chunk:
+                record['_updated_at'] = updated_at
+                if '_id' not in record:
+                    record['_id'] = ObjectId()
+
+            try:
+                reconnecting_bulk_save(collection, chunk)
+            except BulkWriteError as e:
+                errors += write_error_messages(e, offset)
+
+        if records:
+            self._record_write(data_set_id, records, updated_at)
+
+        return errors
+
+    def execute_query(self, data_set_id, query, secondary_ok=True,
+                      limits=None):
+        """Run a query, on a secondary if the read preference allows and
+        secondary_ok is set
+
+        limits overrides the default QUERY_LIMITS. A query that breaks one
+        raises QueryLimitError; one that would examine too many documents
+        does so before it is run.
+        """
+        limits = self._limits(limits)
+        if query.is_paginated:
+            self._ensure_page_index(data_set_id)
+        collection = self._query_collection(data_set_id, secondary_ok)
+        self._check_documents_examined(data_set_id, collection, query, limits)
+
+        try:
+            results = list(self._execute_query(collection, query, limits))
+        except ExecutionTimeout:
+            statsd.incr('storage.query_limit.max_time_ms',
+                        data_set=data_set_id)
+            raise QueryLimitError(
+                "The query took longer than {} ms, try a shorter time "
+                "range or more filters".format(limits['max_time_ms']))
+
+        if limits['max_results'] is not None and \
+                len(results) > limits['max_results']:
+            statsd.incr('storage.query_limit.max_results',
+                        data_set=data_set_id)
+            raise QueryLimitError(
+                "The query returned more than {} results, try a limit, a "
+                "shorter time range or more filters".format(
+                    limits['max_results']))
+
+        return map(convert_datetimes_to_utc, results)
+
+    def stream_query(self, data_set_id, query, batch_size, secondary_ok=True,
+                     limits=None):
+        """Iterate over the results of a raw query, fetching batch_size
+        documents from the database at a time
+
+        Only the time and documents examined limits apply, and a query that
+        runs out of time fails part way through.
+        """
+        if query.is_grouped:
+            raise ValueError("Only raw queries can be streamed")
+
+        limits = self._limits(limits)
+        collection = self._query_collection(data_set_id, secondary_ok)
+        self._check_documents_examined(data_set_id, collection, query, limits)
 
-    def execute_query(self, data_set_id, query):
-        return map(convert_datetimes_to_utc,
-                   self._execute_query(data_set_id, query))
+        cursor = self._basic_query(
+            collection, query, dict(limits, max_results=None))
+        return itertools.imap(convert_datetimes_to_utc,
+                              cursor.batch_size(batch_size))
 
-    def _execute_query(self, data_set_id, query):
+    def _limits(self, limits):
+        return dict(self._query_limits, **(limits or {}))
+
+    def _check_documents_examined(self, data_set_id, collection, query,
+                                  limits):
+        max_documents = limits['max_documents_examined']
+        if max_documents is None:
+            return
+
+        try:
+            estimate = estimate_documents_examined(
+                collection, query, limits['max_time_ms'])
+        except ExecutionTimeout:
+            # Even counting the documents in range took too long
+            estimate = None
+
+        if estimate is None or estimate > max_documents:
+            statsd.incr('storage.query_limit.max_documents_examined',
+                        data_set=data_set_id)
+            raise QueryLimitError(
+                "The query would examine more than the {} documents "
+                "allowed, try a shorter time range or more "
+                "filters".format(max_documents))
+
+    def _execute_query(self, collection, query, limits):
         if query.is_grouped:
-            return self._group_query(data_set_id, query)
+            return self._group_query(collection, query, limits)
         else:
-            return self._basic_query(data_set_id, query)
+            return self._basic_query(collection, query, limits)
+
+    def _group_query(self, collection, query, limits):
+        if self._group_engine == 'aggregate':
+            return self._aggregate_query(collection, query, limits)
 
-    def _group_query(self, data_set_id, query):
         # flatten the list of key combos to form a flat list of keys
         keys = list(itertools.chain.from_iterable(query.group_keys))
         spec = get_mongo_spec(query)
         collect_fields = query.collect_fields
 
-        return self._collection(data_set_id).group(
+        return collection.group(
             key=keys,
             condition=build_group_condition(keys, spec),
             initial=build_group_initial_state(collect_fields),
-            reduce=Code(build_group_reducer(collect_fields)))
+            reduce=Code(build_group_reducer(collect_fields)),
+            **get_mongo_command_options(limits))
 
-    def _basic_query(self, data_set_id, query):
+    def _aggregate_query(self, collection, query, limits, pushdown=None):
+        keys = list(itertools.chain.from_iterable(query.group_keys))
         spec = get_mongo_spec(query)
+
+        if pushdown is None:
+            pushdown = self._collect_pushdown
+        if pushdown:
+            pushdown, collect_fields = split_pushdown_collect(query.collect)
+        else:
+            pushdown, collect_fields = [], query.collect_fields
+
+        pipeline = build_group_pipeline(keys, spec, collect_fields, pushdown)
+
+        cursor = collection.aggregate(pipeline, cursor={},
+                                      **get_mongo_command_options(limits))
+        results = map(flatten_group_result, cursor)
+
+        if pushdown:
+            if any(has_non_numeric_values(result, pushdown)
+                   for result in results):
+                # Let the python reducers decide what these values mean
+                return self._aggregate_query(collection, query, limits,
+                                             pushdown=False)
+            results = [pre_reduce_result(result, pushdown)
+                       for result in results]
+
+        return results
+
+    def _basic_query(self, collection, query, limits):
+        spec = get_mongo_spec(query)
+        fields = get_mongo_fields(query)
         sort = get_mongo_sort(query)
-        limit = get_mongo_limit(query)
+        limit = get_capped_mongo_limit(query, limits['max_results'])
 
-        return self._collection(data_set_id).find(spec, sort=sort, limit=limit)
+        cursor = collection.find(spec, fields=fields, sort=sort, limit=limit)
+        if limits['max_time_ms'] is not None:
+            cursor = cursor.max_time_ms(limits['max_time_ms'])
+        return cursor
 
 
 def get_mongo_spec(query):
@@ -180,7 +604,7 @@ def get_mongo_spec(query):
     PyMongo refers to the query as a spec, this function uses the language
     of the storage engine.
 
-    >>> from ...read.query import Query
+    >>> from ...core.query import Query
     >>> from datetime import datetime as dt
     >>> get_mongo_spec(Query.create())
     {}
@@ -199,7 +623,45 @@ def get_mongo_spec(query):
     else:
         filter_term = query.filter_by_prefix
 
-    return dict(filter_term + time_range.items())
+    spec = dict(filter_term + time_range.items())
+    if query.after:
+        spec = keyset_to_mongo_query(spec, *query.after)
+
+    return spec
+
+
+def keyset_to_mongo_query(spec, timestamp, _id):
+    """Narrow a spec to the documents after a _timestamp and _id
+
+    The _timestamp range keeps the query on the _timestamp index.
+
+    >>> from datetime import datetime as dt
+    >>> keyset_to_mongo_query({}, dt(2012, 12, 12), 'a') == {
+    ...     '_timestamp': {'$gte': dt(2012, 12, 12)},
+    ...     '$or': [{'_timestamp': {'$gt': dt(2012, 12, 12)}},
+    ...             {'_id': {'$gt': 'a'}}]}
+    True
+    >>> keyset_to_mongo_query(
+    ...     {'_timestamp': {'$gte': dt(2013, 1, 1)}}, dt(2012, 12, 12), 'a'
+    ... )['_timestamp']
+    {'$gte': datetime.datetime(2013, 1, 1, 0, 0)}
+    """
+    spec = dict(spec)
+
+    if timestamp is None:
+        # Documents without a _timestamp sort before all others
+        spec['$or'] = [{'_timestamp': {'$ne': None}},
+                       {'_timestamp': None, '_id': {'$gt': _id}}]
+        return spec
+
+    time_range = dict(spec.get('_timestamp', {}))
+    if time_range.get('$gte') is None or time_range['$gte'] < timestamp:
+        time_range['$gte'] = timestamp
+    spec['_timestamp'] = time_range
+    spec['$or'] = [{'_timestamp': {'$gt': timestamp}},
+                   {'_id': {'$gt': _id}}]
+
+    return spec
 
 
 def time_range_to_mongo_query(start_at, end_at, inclusive=False):
@@ -229,16 +691,49 @@ def time_range_to_mongo_query(start_at, end_at, inclusive=False):
     return mongo
 
 
+def get_mongo_fields(query):
+    """Return the projection for the fields a query selects
+
+    _id is only returned if it is asked for.
+
+    >>> from ...core.query import Query
+    >>> get_mongo_fields(Query.create())
+    >>> get_mongo_fields(Query.create(fields=['foo'])) == {
+    ...     'foo': True, '_id': False}
+    True
+    >>> get_mongo_fields(Query.create(fields=['foo', '_id']))
+    {'foo': True, '_id': True}
+
+    Pages also need the fields that their cursor is made from.
+
+    >>> get_mongo_fields(Query.create(fields=['foo'], limit=1,
+    ...                               paginate=True)) == {
+    ...     'foo': True, '_id': True, '_timestamp': True}
+    True
+    """
+    if query.fields:
+        fields = dict((field, True) for field in query.fields)
+        if query.is_paginated:
+            fields.update(_id=True, _timestamp=True)
+        fields.setdefault('_id', False)
+        return fields
+
+
 def get_mongo_sort(query):
     """
-    >>> from ...read.query import Query
+    >>> from ...core.query import Query
     >>> get_mongo_sort(Query.create())
     >>> get_mongo_sort(Query.create(sort_by=['foo', 'ascending']))
     [('foo', 1)]
+    >>> get_mongo_sort(Query.create(limit=10))
+    >>> get_mongo_sort(Query.create(limit=10, paginate=True))
+    [('_timestamp', 1), ('_id', 1)]
     """
     if query.sort_by:
         direction = get_mongo_sort_direction(query.sort_by[1])
         return [(query.sort_by[0], direction)]
+    if query.is_paginated:
+        return [('_timestamp', pymongo.ASCENDING), ('_id', pymongo.ASCENDING)]
 
 
 def get_mongo_sort_direction(direction):
@@ -257,7 +752,7 @@ def get_mongo_sort_direction(direction):
 
 def get_mongo_limit(query):
     """
-    >>> from ...read.query import Query
+    >>> from ...core.query import Query
     >>> get_mongo_limit(Query.create())
     0
     >>> get_mongo_limit(Query.create(limit=100))
@@ -266,6 +761,77 @@ def get_mongo_limit(query):
     return query.limit or 0
 
 
+def get_capped_mongo_limit(query, max_results):
+    """Return the limit for a raw query, which is one more than max_results
+    if the query is not limited to fewer, so that going over it is seen
+
+    >>> from ...core.query import Query
+    >>> get_capped_mongo_limit(Query.create(), None)
+    0
+    >>> get_capped_mongo_limit(Query.create(), 10)
+    11
+    >>> get_capped_mongo_limit(Query.create(limit=5), 10)
+    5
+    >>> get_capped_mongo_limit(Query.create(limit=50), 10)
+    11
+    """
+    limit = get_mongo_limit(query)
+    if max_results is not None and (limit == 0 or limit > max_results):
+        return max_results + 1
+    return limit
+
+
+def get_mongo_command_options(limits):
+    """Return the options that limit a group or aggregate command
+
+    >>> get_mongo_command_options({'max_time_ms': 500})
+    {'maxTimeMS': 500}
+    >>> get_mongo_command_options({'max_time_ms': None})
+    {}
+    """
+    if limits['max_time_ms'] is None:
+        return {}
+    return {'maxTimeMS': limits['max_time_ms']}
+
+
+def estimate_documents_examined(collection, query, max_time_ms=None):
+    """Return at most how many documents a query will examine
+
+    That is the number of documents in its _timestamp range, or after its
+    cursor, or the whole collection if it has neither. These are counted
+    from the _timestamp index without reading any documents; counting the
+    ones matching the filters would cost as much as the query itself.
+
+    A raw query with a limit and no filters stops after that many, unless
+    it is sorted on a field that no index keeps in order.
+
+    >>> from ...core.query import Query
+    >>> estimate_documents_examined(None, Query.create(limit=10))
+    10
+    >>> estimate_documents_examined(None, Query.create(
+    ...     limit=10, sort_by=['_timestamp', 'descending']))
+    10
+    """
+    sorted_by_index = not query.sort_by or query.sort_by[0] == '_timestamp'
+    if not query.is_grouped and query.limit and sorted_by_index and \
+            not query.filter_by and not query.filter_by_prefix:
+        return query.limit
+
+    spec = time_range_to_mongo_query(
+        query.start_at, query.end_at, query.inclusive)
+    if query.after:
+        spec = keyset_to_mongo_query(spec, *query.after)
+        # Only the _timestamp bound of a cursor is served by the index
+        spec.pop('$or')
+    if not spec:
+        return collection.count()
+
+    cursor = collection.find(spec)
+    if max_time_ms is not None:
+        cursor = cursor.max_time_ms(max_time_ms)
+    return cursor.count()
+
+
 def build_group_condition(keys, spec):
     """
     >>> build_group_condition(["foo"], {"bar": "doo"})
@@ -277,6 +843,171 @@ def build_group_condition(keys, spec):
     return dict(spec.items() + key_filter)
 
 
+def build_group_pipeline(keys, spec, collect_fields, pushdown=()):
+    """Build an aggregation pipeline equivalent to the group command
+
+    The $match stage uses the same condition as the group command and the
+    $group stage keys on every grouping field, counting the documents and
+    pushing the values of any collected fields. Collect methods in pushdown
+    are reduced by the $group stage itself. Documents are counted as
+    doubles, as the group command's reducer counts them.
+
+    >>> pipeline = build_group_pipeline(["foo"], {"bar": "doo"}, ["c"])
+    >>> pipeline[0]
+    {'$match': {'foo': {'$ne': None}, 'bar': 'doo'}}
+    >>> pipeline[1] == {'$group': {
+    ...     '_id': {'foo': '$foo'},
+    ...     '_count': {'$sum': 1.0},
+    ...     'c': {'$push': '$c'}}}
+    True
+    """
+    group = {
+        '_id': dict((key, '$' + key) for key in keys),
+        '_count': {'$sum': 1.0},
+    }
+    for field in collect_fields:
+        group[field] = {'$push': '$' + field}
+    for field, method in pushdown:
+        group.update(build_pushdown_accumulators(field, method))
+
+    return [
+        {'$match': build_group_condition(keys, spec)},
+        {'$group': group},
+    ]
+
+
+def split_pushdown_collect(collect):
+    """Split collect methods into those that can be reduced by the database
+    and the fields whose raw values must still be collected
+
+    A field is only reduced by the database if all of its methods can be.
+
+    >>> split_pushdown_collect([('a', 'sum'), ('a', 'default'), ('b', 'mean')])
+    ([('a', 'set'), ('a', 'sum'), ('b', 'mean')], [])
+    >>> split_pushdown_collect([('a', 'sum'), ('a', 'median')])
+    ([], ['a'])
+    """
+    methods = defaultdict(set)
+    for field, method in collect:
+        methods[field].add(replace_default_method(method))
+
+    pushdown, collect_fields = [], []
+    for field in sorted(methods):
+        if methods[field].issubset(PUSHDOWN_METHODS):
+            pushdown.extend((field, method)
+                            for method in sorted(methods[field]))
+        else:
+            collect_fields.append(field)
+
+    return pushdown, collect_fields
+
+
+def _pushdown_key(field, part):
+    return '{0}__{1}'.format(field, part)
+
+
+def build_pushdown_accumulators(field, method):
+    """Return the $group accumulators that reduce a collected field
+
+    The database silently skips values that are not numbers when summing,
+    where the python reducers would fail, so sum and mean also collect the
+    distinct values that are not numbers. Numbers are all collected as 0.
+
+    >>> sorted(build_pushdown_accumulators('c', 'sum').keys())
+    ['c__non_numeric', 'c__sum']
+    >>> build_pushdown_accumulators('c', 'set')
+    {'c__set': {'$addToSet': '$c'}}
+    >>> sorted(build_pushdown_accumulators('c', 'mean').keys())
+    ['c__mean_count', 'c__mean_total', 'c__non_numeric']
+    """
+    value = '$' + field
+    # Numbers sort between null and strings in the BSON comparison order
+    is_number = {'$and': [{'$gt': [value, None]}, {'$lt': [value, '']}]}
+    non_numeric = {_pushdown_key(field, 'non_numeric'): {
+        '$addToSet': {'$cond': [is_number, 0, value]}}}
+
+    if method == 'sum':
+        return dict(non_numeric, **{
+            _pushdown_key(field, 'sum'): {'$sum': value}})
+    elif method == 'mean':
+        return dict(non_numeric, **{
+            _pushdown_key(field, 'mean_total'): {'$sum': value},
+            _pushdown_key(field, 'mean_count'): {
+                '$sum': {'$cond': [is_number, 1, 0]}},
+        })
+    elif method == 'set':
+        return {_pushdown_key(field, 'set'): {'$addToSet': value}}
+
+    raise ValueError("Cannot push down collection method {}".format(method))
+
+
+def _is_number(value):
+    return isinstance(value, (int, long, float)) and \
+        not isinstance(value, bool)
+
+
+def has_non_numeric_values(result, pushdown):
+    """Return whether a sum or mean was pushed down over a field holding
+    values that are not numbers
+
+    >>> has_non_numeric_values({'c__non_numeric': [0]}, [('c', 'sum')])
+    False
+    >>> has_non_numeric_values({'c__non_numeric': [0, None]}, [('c', 'sum')])
+    True
+    >>> has_non_numeric_values({'c__set': [None]}, [('c', 'set')])
+    False
+    """
+    return any(
+        not _is_number(value)
+        for field in set(field for field, _ in pushdown)
+        for value in result.get(_pushdown_key(field, 'non_numeric'), []))
+
+
+def pre_reduce_result(result, pushdown):
+    """Replace the accumulated partials in a result with a PreReduced
+    value for each collected field
+
+    >>> result = pre_reduce_result(
+    ...     {'_count': 2, 'c__sum': 3, 'c__mean_total': 3, 'c__mean_count': 2,
+    ...      'c__non_numeric': [0]},
+    ...     [('c', 'mean'), ('c', 'sum')])
+    >>> sorted(result.keys())
+    ['_count', 'c']
+    >>> result['c'].reduce('sum'), result['c'].reduce('mean')
+    (3, 1.5)
+    """
+    partials = defaultdict(dict)
+    for field, method in pushdown:
+        result.pop(_pushdown_key(field, 'non_numeric'), None)
+        if method == 'mean':
+            partial = (result.pop(_pushdown_key(field, 'mean_total')),
+                       result.pop(_pushdown_key(field, 'mean_count')))
+        elif method == 'set':
+            partial = set(result.pop(_pushdown_key(field, 'set')))
+        else:
+            partial = result.pop(_pushdown_key(field, method))
+        partials[field][method] = partial
+
+    for field, field_partials in partials.items():
+        result[field] = PreReduced(field_partials)
+
+    return result
+
+
+def flatten_group_result(result):
+    """Lift the grouping keys out of an aggregation result's _id
+
+    This gives the same shape of document as the group command returns.
+
+    >>> flatten_group_result({'_id': {'foo': 'bar'}, '_count': 2})
+    {'_count': 2, 'foo': 'bar'}
+    """
+    group = dict(result['_id'])
+    group.update(
+        (key, value) for key, value in result.items() if key != '_id')
+    return group
+
+
 def build_group_initial_state(collect_fields):
     """
     >>> build_group_initial_state([])
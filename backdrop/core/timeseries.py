@@ -1,7 +1,7 @@
 from datetime import timedelta, time
 from itertools import groupby
-import time as _time
-from dateutil.relativedelta import relativedelta, MO
+import calendar
+from dateutil.relativedelta import relativedelta
 import pytz
 import itertools
 
@@ -35,8 +35,12 @@ class Period(object):
         _start = self.start(start).replace(tzinfo=pytz.UTC)
         _end = self.end(end).replace(tzinfo=pytz.UTC)
         while _start < _end:
-            yield (_start, _start + self._delta)
-            _start += self._delta
+            _next = self._next_start(_start)
+            yield (_start, _next)
+            _start = _next
+
+    def _next_start(self, start):
+        return start + self._delta
 
     def valid_start_at(self, timestamp):
         raise NotImplementedError()
@@ -78,7 +82,7 @@ class Week(Period):
         self._delta = timedelta(days=7)
 
     def start(self, timestamp):
-        return _truncate_time(timestamp) + relativedelta(weekday=MO(-1))
+        return _truncate_time(timestamp) - timedelta(days=timestamp.weekday())
 
     def valid_start_at(self, timestamp):
         return timestamp.weekday() == 0 and self._is_start_of_day(timestamp)
@@ -90,6 +94,9 @@ class Month(Period):
         self.name = "month"
         self._delta = relativedelta(months=1)
 
+    def _next_start(self, start):
+        return _add_months(start, 1)
+
     def start(self, timestamp):
         return timestamp.replace(day=1, hour=0, minute=0,
                                  second=0, microsecond=0)
@@ -103,11 +110,13 @@ class Quarter(Period):
     def __init__(self):
         self.name = "quarter"
         self._delta = relativedelta(months=3)
-        self.quarter_starts = [10, 7, 4, 1]
+        self.quarter_starts = set([1, 4, 7, 10])
+
+    def _next_start(self, start):
+        return _add_months(start, 3)
 
     def start(self, timestamp):
-        quarter_month = next(quarter for quarter in self.quarter_starts
-                             if timestamp.month >= quarter)
+        quarter_month = (timestamp.month - 1) // 3 * 3 + 1
 
         return timestamp.replace(month=quarter_month, day=1, hour=0, minute=0,
                                  second=0, microsecond=0)
@@ -123,6 +132,9 @@ class Year(Period):
         self.name = "year"
         self._delta = relativedelta(years=1)
 
+    def _next_start(self, start):
+        return start.replace(year=start.year + 1)
+
     def start(self, timestamp):
         return timestamp.replace(month=1, day=1, hour=0, minute=0, second=0,
                                  microsecond=0)
@@ -148,7 +160,14 @@ def parse_period(period_name):
 
 
 def _time_to_index(dt):
-    return _time.mktime(dt.replace(tzinfo=pytz.utc).timetuple())
+    """Return the whole seconds since the epoch, taking the datetime's
+    wall clock time as UTC
+
+    >>> import datetime
+    >>> _time_to_index(datetime.datetime(2013, 4, 1, tzinfo=pytz.UTC))
+    1364774400
+    """
+    return calendar.timegm(dt.timetuple())
 
 
 def timeseries(start, end, period, data, default):
@@ -170,50 +189,36 @@ def timeseries(start, end, period, data, default):
 
 
 def fill_group_by_permutations(start, end, period, data, default, group_by):
+    """
+    Yield the data for every period from start to end and every combination
+    of the values of the group_by keys, with missing data filled in with
+    default.
 
-    # Generate all permutations of group_by keys
-    def unique_values(key):
-        return set([d[key] for d in data])
-
-    def all_group_by_permutations():
-        possible_keys = {
-            group_key: unique_values(group_key) for group_key in group_by}
-        step_1 = {k: [(k, v) for v in possible_keys[k]] for k in possible_keys}
-        step_2 = list(itertools.product(*[step_1[x] for x in step_1]))
-        return [dict(item) for item in step_2]
-
-    permutations = all_group_by_permutations()
-
-    def hash_datum(datum):
-        return '{0}{1}{2}'.format(
-            datum['_start_at'],
-            datum['_end_at'],
-            str([datum[key] for key in group_by]))
-
-    def hash_permutation(perm, start, end):
-        return '{0}{1}{2}'.format(
-            start, end,
-            str([perm[key] for key in group_by]))
+    Combinations are generated as they are needed, a period at a time,
+    rather than all up front.
+    """
+    values = dict(
+        (key, set(datum[key] for datum in data)) for key in group_by)
+    # The first key changes slowest
+    keys = sorted(values, key=group_by.index)
 
-    hashed_data = {hash_datum(datum): datum for datum in data}
+    data_by_group = dict(
+        ((datum['_start_at'], datum['_end_at']) +
+         tuple(datum[key] for key in keys), datum)
+        for datum in data)
 
-    results = []
     # for each time period (e.g. 1 week) in the period requested (e.g. 3 weeks)
     for period_start, period_end in period.range(start, end):
-        for group in permutations:
-            group['_start_at'] = period_start
-            group['_end_at'] = period_end
+        limits = (period_start, period_end)
+        for combination in itertools.product(*[values[key] for key in keys]):
+            datum = data_by_group.get(limits + combination)
 
-            datum = hashed_data.get(
-                hash_permutation(group, period_start, period_end),
-                None)
+            if datum is None:
+                group = dict(zip(keys, combination))
+                group.update(_period_limits(period_start, period_end))
+                datum = _merge(default, group)
 
-            if datum is not None:
-                results.append(datum)
-            else:
-                results.append(_merge(default, group))
-
-    return results
+            yield datum
 
 
 def _period_limits(start, end):
@@ -239,5 +244,16 @@ def _merge(first, second):
     return dict(first.items() + second.items())
 
 
+def _add_months(timestamp, months):
+    """Move the start of a month by a number of months
+
+    >>> import datetime
+    >>> _add_months(datetime.datetime(2013, 11, 1), 3)
+    datetime.datetime(2014, 2, 1, 0, 0)
+    """
+    year, month = divmod(timestamp.month - 1 + months, 12)
+    return timestamp.replace(year=timestamp.year + year, month=month + 1)
+
+
 def _truncate_time(datetime):
     return datetime.replace(hour=0, minute=0, second=0, microsecond=0)
@@ -1,9 +1,23 @@
 import datetime
+import re
 import time
 from dateutil import parser
+from dateutil.tz import tzoffset, tzutc
 import pytz
 
 
+ISO_8601 = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?'
+    r'(?:(Z)|([+-])(\d{2}):?(\d{2}))?$')
+
+# Parsed timestamps, which repeat a lot in bulk writes and period queries
+_parsed_times = {}
+_MAX_PARSED_TIMES = 10000
+
+_TZ_UTC = tzutc()
+_tz_offsets = {}
+
+
 def now():
     return datetime.datetime.now(pytz.UTC)
 
@@ -12,11 +26,79 @@ def as_seconds(dt):
     return time.mktime(dt.timetuple())
 
 
+def _tz_offset(seconds):
+    if seconds == 0:
+        return _TZ_UTC
+    tz = _tz_offsets.get(seconds)
+    if tz is None:
+        tz = _tz_offsets[seconds] = tzoffset(None, seconds)
+    return tz
+
+
+def parse_iso_8601(time_string):
+    """Parse a timestamp in the yyyy-MM-ddTHH:MM:SS[.ffffff][Z|+hh:mm]
+    format
+
+    Returns None for strings in any other format and raises ValueError for
+    ones that are in the format but are not a real date, as dateutil does.
+
+    >>> parse_iso_8601('2014-01-06T12:30:00+01:00')
+    datetime.datetime(2014, 1, 6, 12, 30, tzinfo=tzoffset(None, 3600))
+    >>> parse_iso_8601('2014-01-06T12:30:00.5Z')
+    datetime.datetime(2014, 1, 6, 12, 30, 0, 500000, tzinfo=tzutc())
+    >>> parse_iso_8601('2014-01-06T12:30:00')
+    datetime.datetime(2014, 1, 6, 12, 30)
+    >>> parse_iso_8601('6th January 2014')
+    >>> parse_iso_8601('2014-02-30T00:00:00Z')
+    Traceback (most recent call last):
+        ...
+    ValueError: day is out of range for month
+    """
+    match = ISO_8601.match(time_string)
+    if match is None:
+        return None
+
+    (year, month, day, hour, minute, second, fraction,
+     zulu, sign, offset_hours, offset_minutes) = match.groups()
+
+    tz = None
+    if zulu:
+        tz = _TZ_UTC
+    elif sign:
+        offset = int(offset_hours) * 3600 + int(offset_minutes) * 60
+        tz = _tz_offset(-offset if sign == '-' else offset)
+
+    return datetime.datetime(
+        int(year), int(month), int(day), int(hour), int(minute), int(second),
+        int(fraction.ljust(6, '0')) if fraction else 0, tz)
+
+
+def parse_time(time_string):
+    """Parse a timestamp string, quickly if it is in the ISO 8601 format
+    that Backdrop documents and with dateutil otherwise"""
+    parsed = _parsed_times.get(time_string)
+    if parsed is not None:
+        return parsed
+
+    if isinstance(time_string, basestring):
+        parsed = parse_iso_8601(time_string)
+    if parsed is None:
+        # Anything dateutil has to fill in can depend on the current date,
+        # so only ISO 8601 timestamps are remembered
+        return parser.parse(time_string)
+
+    if len(_parsed_times) >= _MAX_PARSED_TIMES:
+        _parsed_times.clear()
+    _parsed_times[time_string] = parsed
+
+    return parsed
+
+
 def parse_time_as_utc(time_string):
     if isinstance(time_string, datetime.datetime):
         time = time_string
     else:
-        time = parser.parse(time_string)
+        time = parse_time(time_string)
 
     return as_utc(time)
 
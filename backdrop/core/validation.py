@@ -10,9 +10,10 @@ import json
 import datetime
 import re
 import bson
-from dateutil import parser
 import pytz
 
+from .timeutils import parse_time
+
 
 RESERVED_KEYWORDS = (
     '_timestamp',
@@ -23,12 +24,13 @@ RESERVED_KEYWORDS = (
 VALID_KEY = re.compile('^[a-z_][a-z0-9_]+$')
 
 
-def _is_real_date(value):
+def _parse_real_date(value):
     try:
-        parser.parse(value).astimezone(pytz.UTC)
-        return True
+        date = parse_time(value)
+        date.astimezone(pytz.UTC)
+        return date
     except (TypeError, ValueError):
-        return False
+        return None
 
 
 def _is_valid_format(value):
@@ -40,8 +42,20 @@ def _is_valid_format(value):
     return bool(time_pattern.match(value))
 
 
+def parse_datetime_string(value):
+    """Return the datetime a string represents, or None if it is not a
+    valid datetime string
+
+    >>> parse_datetime_string('2014-01-06T00:00:00+01:00')
+    datetime.datetime(2014, 1, 6, 0, 0, tzinfo=tzoffset(None, 3600))
+    >>> parse_datetime_string('2014-01-06')
+    """
+    if _is_valid_format(value):
+        return _parse_real_date(value)
+
+
 def value_is_valid_datetime_string(value):
-    return _is_valid_format(value) and _is_real_date(value)
+    return parse_datetime_string(value) is not None
 
 
 def value_is_valid(value):
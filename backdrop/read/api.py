@@ -1,21 +1,33 @@
 import datetime
+import hashlib
 import json
+import threading
+from collections import OrderedDict
+from functools import wraps
+from multiprocessing.pool import ThreadPool
 from os import getenv
 from bson import ObjectId
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_featureflags import FeatureFlag
+from werkzeug.datastructures import MultiDict
+from werkzeug.urls import url_encode
 
-from .query import parse_query_from_request
-from .validation import validate_request_args
+from .request_parser import parse_query
+from .serializer import ResponseEncoder
+from .streaming import stream_json, stream_ndjson, stream_csv
 from ..core import log_handler, cache_control, http_validation
+from ..core.admin_cache import CachedAdminAPI
+from ..core.coalescing import QueryCoalescer
 from ..core.data_set import DataSet
-from ..core.errors import InvalidOperationError
+from ..core.errors import InvalidOperationError, QueryLimitError
+from ..core.query_cache import QueryCache, InProcessBackend, MongoBackend
 from ..core.flaskutils import generate_request_id
 from ..core.timeutils import as_utc
 from ..core.response import crossdomain
 
 from ..core.storage.mongo import MongoStorageEngine
+from ..core.storage.index_advisor import IndexAdvisor
 
 from backdrop import statsd
 
@@ -35,7 +47,24 @@ app.config.from_object(
 storage = MongoStorageEngine.create(
     app.config['MONGO_HOSTS'],
     app.config['MONGO_PORT'],
-    app.config['DATABASE_NAME'])
+    app.config['DATABASE_NAME'],
+    group_engine=app.config.get('MONGO_GROUP_ENGINE', 'group'),
+    collect_pushdown=app.config.get('MONGO_COLLECT_PUSHDOWN', False),
+    read_preference=app.config.get('MONGO_READ_PREFERENCE', 'primary'),
+    max_staleness=app.config.get('MONGO_MAX_STALENESS_SECONDS'),
+    query_limits={
+        'max_time_ms': app.config.get('QUERY_MAX_TIME_MS'),
+        'max_documents_examined': app.config.get(
+            'QUERY_MAX_DOCUMENTS_EXAMINED'),
+        'max_results': app.config.get('QUERY_MAX_RESULTS'),
+    })
+
+index_advisor = IndexAdvisor(
+    storage,
+    auto_create=app.config.get('INDEX_ADVISOR_AUTO_CREATE', False),
+    min_queries=app.config.get('INDEX_ADVISOR_MIN_QUERIES', 100),
+    max_shapes=app.config.get('INDEX_ADVISOR_MAX_SHAPES', 100),
+    report_ttl=app.config.get('INDEX_ADVISOR_REPORT_TTL', 60))
 
 admin_api = client.AdminAPI(
     app.config['STAGECRAFT_URL'],
@@ -44,11 +73,21 @@ admin_api = client.AdminAPI(
     request_id_fn=generate_request_id,
 )
 
+if app.config.get('DATA_SET_CONFIG_CACHE_TTL'):
+    admin_api = CachedAdminAPI(
+        admin_api, ttl=app.config['DATA_SET_CONFIG_CACHE_TTL'],
+        max_age=app.config.get('DATA_SET_CONFIG_CACHE_MAX_AGE', 300))
+    if app.config.get('DATA_SET_CONFIG_CACHE_PRELOAD', False):
+        admin_api.preload()
+
 DEFAULT_DATA_SET_QUERYABLE = True
 DEFAULT_DATA_SET_RAW_QUERIES = False
 DEFAULT_DATA_SET_PUBLISHED = True
 DEFAULT_DATA_SET_REALTIME = False
 
+UNPUBLISHED_WARNING = ("Warning: This data-set is unpublished. "
+                       "Data may be subject to change or be inaccurate.")
+
 log_handler.set_up_logging(app, GOVUK_ENV)
 
 
@@ -63,6 +102,31 @@ class JsonEncoder(json.JSONEncoder):
 app.json_encoder = JsonEncoder
 
 
+def create_query_cache(backend_name):
+    max_entries = app.config.get('QUERY_CACHE_MAX_ENTRIES', 1000)
+    max_bytes = app.config.get('QUERY_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+
+    if backend_name == 'memory':
+        backend = InProcessBackend(max_entries=max_entries,
+                                   max_bytes=max_bytes)
+    elif backend_name == 'mongo':
+        backend = MongoBackend(storage.get_capped_collection(
+            '_query_cache', max_bytes, max_documents=max_entries))
+    else:
+        raise ValueError("Unknown query cache backend {}".format(
+            backend_name))
+
+    return QueryCache(backend, cls=JsonEncoder)
+
+query_cache = None
+if app.config.get('QUERY_CACHE_BACKEND'):
+    query_cache = create_query_cache(app.config['QUERY_CACHE_BACKEND'])
+
+query_coalescer = None
+if app.config.get('COALESCE_QUERIES', True):
+    query_coalescer = QueryCoalescer()
+
+
 @app.errorhandler(500)
 @crossdomain(origin='*')
 def uncaught_error_handler(e):
@@ -137,6 +201,15 @@ def data_set_health():
                        message='All data_sets are in date')
 
 
+@app.route('/_status/indexes', methods=['GET'])
+@crossdomain(origin='*')
+@cache_control.nocache
+@statsd.timer('read.route.heath_check.indexes')
+def index_report():
+    """Recommended indexes for the queries seen by this process"""
+    return jsonify(data_sets=index_advisor.report(request.args.get('name')))
+
+
 def _data_set_object(data_set):
     return {
         "name": data_set.name,
@@ -146,6 +219,126 @@ def _data_set_object(data_set):
     }
 
 
+def json_response(payload):
+    # Pretty print in the same cases as jsonify
+    indent = None
+    if app.config['JSONIFY_PRETTYPRINT_REGULAR'] and not request.is_xhr:
+        indent = 2
+
+    return Response(ResponseEncoder(indent=indent).encode(payload),
+                    mimetype='application/json')
+
+
+def data_response(data, streamed, **kwargs):
+    if streamed:
+        return Response(
+            stream_json(data, app.config.get('STREAM_BATCH_SIZE', 1000),
+                        cls=ResponseEncoder, **kwargs),
+            mimetype='application/json')
+
+    kwargs['data'] = data
+    return json_response(kwargs)
+
+
+def export_response(rows, output_format, query):
+    batch_size = app.config.get('STREAM_BATCH_SIZE', 1000)
+    if output_format == 'csv':
+        # Raw queries must have asked for fields
+        columns = query.flat_keys if query.is_grouped else query.fields
+        return Response(stream_csv(rows, batch_size, columns),
+                        mimetype='text/csv')
+    else:
+        return Response(
+            stream_ndjson(rows, batch_size, cls=ResponseEncoder),
+            mimetype='application/x-ndjson')
+
+
+def is_queryable(data_set_config):
+    return data_set_config is not None and data_set_config.get(
+        'queryable', DEFAULT_DATA_SET_QUERYABLE)
+
+
+def is_published(data_set_config):
+    return data_set_config.get('published',
+                               DEFAULT_DATA_SET_PUBLISHED) is not False
+
+
+def cache_control_for(data_set_config):
+    if not is_published(data_set_config):
+        # Do not cache unpublished data-sets
+        return "no-cache"
+
+    # Set cache control based on data set type
+    if data_set_config.get('realtime', DEFAULT_DATA_SET_REALTIME):
+        cache_duration = 120
+    else:
+        cache_duration = 1800
+    return "max-age=%d, must-revalidate" % cache_duration
+
+
+def query_etag(data_set, query, streamed, output_format):
+    """Return an ETag for the response to a query
+
+    It changes whenever the data set is written to, so it is known before
+    the query is run. The ETag is weak as the exact bytes of the response
+    depend on the request, for example whether the JSON is indented.
+    """
+    return hashlib.sha1(json.dumps([
+        data_set.name,
+        data_set.get_version(),
+        str(data_set.get_last_updated()),
+        query.cache_key,
+        is_published(data_set.config),
+        streamed,
+        output_format,
+    ])).hexdigest()
+
+
+def is_relative_to_now(args):
+    """Whether the query window is worked out from the current time
+
+    The results of these queries change as time passes without the data set
+    being written to, so they cannot be validated by when it last was. The
+    ETag still can as it includes the window the query resolved to.
+    """
+    return 'duration' in args and not (
+        args.get('start_at') or args.get('end_at'))
+
+
+def coalesced(kind):
+    """Share one execution between concurrent identical queries"""
+    def decorator(execute):
+        @wraps(execute)
+        def wrapper(data_set, query):
+            if query_coalescer is None:
+                return execute(data_set, query)
+            return query_coalescer.execute(data_set, query, execute, kind)
+        return wrapper
+    return decorator
+
+
+@coalesced('query')
+def run_query(data_set, query):
+    """Return the results of a query, from the query cache if there is one"""
+    if query_cache is not None:
+        return query_cache.execute_query(data_set, query)
+    return data_set.execute_query(query)
+
+
+@coalesced('page')
+def run_page(data_set, query):
+    """Return a page of results and the cursor for the next page"""
+    if query_cache is not None:
+        return query_cache.execute_page(data_set, query)
+    return data_set.execute_page(query)
+
+
+def next_page_url(next_cursor):
+    args = request.args.copy()
+    args['cursor'] = next_cursor
+    return '{0}?{1}'.format(request.base_url, url_encode(args))
+
+
 def log_error_and_respond(data_set, message, status_code):
     app.logger.error('%s: %s' % (data_set, message))
     return jsonify(status='error', message=message), status_code
@@ -171,7 +364,6 @@ def data_set_key():
 
 
 @app.route('/<data_set_name>', methods=['GET', 'OPTIONS'])
-@http_validation.etag
 def query(data_set_name):
     data_set_config = admin_api.get_data_set_by_name(data_set_name)
     return fetch(data_set_config)
@@ -184,10 +376,7 @@ def fetch(data_set_config):
     if data_set_config is None:
         return log_error_and_respond('', error_text, 404)
 
-    data_set_queryable = data_set_config.get('queryable',
-                                             DEFAULT_DATA_SET_QUERYABLE)
-
-    if not data_set_queryable:
+    if not is_queryable(data_set_config):
         return log_error_and_respond(data_set_config['name'], error_text, 404)
 
     if request.method == 'OPTIONS':
@@ -201,7 +390,7 @@ def fetch(data_set_config):
     else:
         raw_queries_allowed = data_set_config.get(
             'raw_queries_allowed', DEFAULT_DATA_SET_RAW_QUERIES)
-        result = validate_request_args(request.args, raw_queries_allowed)
+        result, query = parse_query(request.args, raw_queries_allowed)
 
         if not result.is_valid:
             return log_error_and_respond(
@@ -211,37 +400,237 @@ def fetch(data_set_config):
         data_set = DataSet(storage, data_set_config)
 
         try:
-            query = parse_query_from_request(request)
-            data = data_set.execute_query(query)
+            index_advisor.record(data_set.name, query)
+
+            output_format = request.args.get('format', 'json')
+            if output_format != 'json' and query.is_grouped:
+                # CSV and NDJSON rows are always flat
+                query = query._replace(flatten=True)
+
+            # Pages are small and need their last document for the cursor
+            streamed = not query.is_grouped and not query.is_paginated and (
+                output_format != 'json' or
+                app.config.get('STREAM_RAW_QUERIES', False))
+
+            etag = query_etag(data_set, query, streamed, output_format)
+            last_modified = None
+            if not is_relative_to_now(request.args):
+                last_modified = data_set.get_last_updated()
+            if http_validation.is_fresh(etag, last_modified):
+                response = app.response_class(status=304)
+                response.headers['Cache-Control'] = \
+                    cache_control_for(data_set_config)
+                return http_validation.set_validators(
+                    response, etag, last_modified)
+
+            next_cursor = None
+            if streamed:
+                data = data_set.stream_query(
+                    query, app.config.get('STREAM_BATCH_SIZE', 1000))
+            elif query.is_paginated:
+                data, next_cursor = run_page(data_set, query)
+            else:
+                data = run_query(data_set, query)
 
         except InvalidOperationError:
             return log_error_and_respond(
                 data_set.name, 'invalid collect function',
                 400)
-
-        data_set_is_published = data_set_config.get('published',
-                                                    DEFAULT_DATA_SET_PUBLISHED)
-        if data_set_is_published is False:
-            warning = ("Warning: This data-set is unpublished. "
-                       "Data may be subject to change or be inaccurate.")
-            response = jsonify(data=data, warning=warning)
-            # Do not cache unpublished data-sets
-            response.headers['Cache-Control'] = "no-cache"
+        except QueryLimitError as e:
+            return log_error_and_respond(data_set.name, str(e), 400)
+
+        extra = {}
+        if not is_published(data_set_config):
+            extra['warning'] = UNPUBLISHED_WARNING
+        if next_cursor is not None:
+            extra['next'] = next_cursor
+
+        if output_format != 'json':
+            response = export_response(data, output_format, query)
+            if 'warning' in extra:
+                response.headers['Warning'] = '199 - "{}"'.format(
+                    extra['warning'])
+            if next_cursor is not None:
+                response.headers['Link'] = '<{}>; rel="next"'.format(
+                    next_page_url(next_cursor))
         else:
-            response = jsonify(data=data)
-            # Set cache control based on data set type
-            if data_set_config.get('realtime', DEFAULT_DATA_SET_REALTIME):
-                cache_duration = 120
-            else:
-                cache_duration = 1800
-            response.headers['Cache-Control'] = (
-                "max-age=%d, "
-                "must-revalidate" % cache_duration
-            )
+            response = data_response(data, streamed, **extra)
+
+        response.headers['Cache-Control'] = cache_control_for(data_set_config)
+        http_validation.set_validators(response, etag, last_modified)
 
     return response
 
 
+_batch_pool = None
+_batch_pool_lock = threading.Lock()
+
+
+def batch_pool():
+    """The threads that batched queries run on
+
+    They are started on first use so that they belong to the process
+    serving requests rather than one that forks it.
+    """
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is None:
+            _batch_pool = ThreadPool(app.config.get('BATCH_QUERY_THREADS', 8))
+    return _batch_pool
+
+
+def batch_error(status, message):
+    return {'status': status, 'message': message}
+
+
+def batch_args(params):
+    """Turn the params of a batched query into query string arguments
+
+    >>> batch_args({'group_by': ['a', 'b'], 'limit': 5}).getlist('group_by')
+    ['a', 'b']
+    >>> batch_args({'group_by': ['a', 'b'], 'limit': 5})['limit']
+    '5'
+    """
+    args = MultiDict()
+    for key, value in params.items():
+        values = value if isinstance(value, list) else [value]
+        for value in values:
+            if not isinstance(value, basestring):
+                value = json.dumps(value)
+            args.add(key, value)
+    return args
+
+
+def prepare_batch_query(item, data_sets):
+    """Return the data set and query for an item in a batch, or an error
+    result if it cannot be run
+
+    data_sets holds the data sets already looked up for this batch so that
+    each data set's config is only fetched once.
+    """
+    if not isinstance(item, dict) or \
+            not isinstance(item.get('params', {}), dict):
+        return batch_error(400, 'Each query must be an object with a '
+                                'data set and its params')
+
+    if 'data_set' in item:
+        key = ('name', unicode(item['data_set']))
+    elif 'data_group' in item and 'data_type' in item:
+        key = ('data_set', unicode(item['data_group']),
+               unicode(item['data_type']))
+    else:
+        return batch_error(400, 'Each query must have a data_set or a '
+                                'data_group and data_type')
+
+    if key not in data_sets:
+        if key[0] == 'name':
+            data_set_config = admin_api.get_data_set_by_name(key[1])
+        else:
+            data_set_config = admin_api.get_data_set(key[1], key[2])
+
+        data_sets[key] = None
+        if is_queryable(data_set_config):
+            data_sets[key] = DataSet(storage, data_set_config)
+
+    data_set = data_sets[key]
+    if data_set is None:
+        return batch_error(404, 'data_set not found')
+
+    args = batch_args(item.get('params', {}))
+    result, query = parse_query(args, data_set.config.get(
+        'raw_queries_allowed', DEFAULT_DATA_SET_RAW_QUERIES))
+    if not result.is_valid:
+        return batch_error(400, result.message)
+    if args.get('format', 'json') != 'json':
+        return batch_error(400, 'Batched queries can only return json')
+
+    index_advisor.record(data_set.name, query)
+
+    return data_set, query
+
+
+def run_batch_query(job):
+    data_set, query = job
+    next_cursor = None
+    try:
+        if query.is_paginated:
+            data, next_cursor = run_page(data_set, query)
+        else:
+            data = run_query(data_set, query)
+    except InvalidOperationError:
+        return batch_error(400, 'invalid collect function')
+    except QueryLimitError as e:
+        return batch_error(400, str(e))
+    except Exception as e:
+        app.logger.exception(e)
+        return batch_error(500, 'Internal Server Error: {}'.format(repr(e)))
+
+    result = {'status': 200, 'data': data}
+    if not is_published(data_set.config):
+        result['warning'] = UNPUBLISHED_WARNING
+    if next_cursor is not None:
+        result['next'] = next_cursor
+    return result
+
+
+@app.route('/_batch', methods=['POST'])
+@crossdomain(origin='*')
+@cache_control.nocache
+@statsd.timer('read.route.batch')
+def batch():
+    """Run many queries in one request
+
+    The body names each data set, either by name or by data group and data
+    type, with the parameters it would be given in a GET request:
+
+        {"queries": [
+            {"data_set": "foo", "params": {"group_by": "a"}},
+            {"data_group": "bar", "data_type": "baz",
+             "params": {"period": "week", "duration": 4}}
+        ]}
+
+    Each data set's config is fetched once, identical queries are run once
+    and the rest run concurrently. Results are returned in the order of the
+    queries, each with its own status.
+    """
+    body = request.get_json(silent=True)
+    items = body.get('queries') if isinstance(body, dict) else None
+    if not isinstance(items, list):
+        return jsonify(status='error',
+                       message='Expected a JSON object with a list of '
+                               'queries'), 400
+
+    max_queries = app.config.get('BATCH_MAX_QUERIES', 50)
+    if len(items) > max_queries:
+        return jsonify(status='error',
+                       message='A batch can have at most {} queries'.format(
+                           max_queries)), 400
+
+    data_sets = {}
+    jobs = OrderedDict()
+    planned = []
+    for item in items:
+        prepared = prepare_batch_query(item, data_sets)
+        if isinstance(prepared, dict):
+            planned.append(prepared)
+        else:
+            data_set, query = prepared
+            key = (data_set.name, query.cache_key)
+            jobs.setdefault(key, prepared)
+            planned.append(key)
+
+    queued = [key for key in planned if isinstance(key, tuple)]
+    if len(queued) > len(jobs):
+        statsd.incr('read.batch.deduplicated', len(queued) - len(jobs))
+
+    results = dict(zip(jobs.keys(),
+                       batch_pool().map(run_batch_query, jobs.values())))
+
+    return json_response({'results': [
+        results[key] if isinstance(key, tuple) else key for key in planned
+    ]})
+
+
 def start(port):
     app.debug = True
     app.run(host='0.0.0.0', port=port)
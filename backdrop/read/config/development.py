@@ -1,8 +1,55 @@
 DATABASE_NAME = "backdrop"
 MONGO_HOSTS = ['localhost']
 MONGO_PORT = 27017
+# 'group' uses the legacy group command, 'aggregate' the aggregation pipeline
+MONGO_GROUP_ENGINE = 'group'
+# Reduce collected values in the database (aggregate engine only)
+MONGO_COLLECT_PUSHDOWN = False
+# Where queries may be sent: 'primary', 'primary_preferred', 'secondary',
+# 'secondary_preferred' or 'nearest'. Realtime data sets always use primary.
+MONGO_READ_PREFERENCE = 'primary'
+# Send queries to the primary once secondaries lag by more than this
+MONGO_MAX_STALENESS_SECONDS = 60
+# Defaults for what one query may cost, data sets can set their own with
+# max_query_time_ms, max_query_documents_examined and max_query_results.
+# None is no limit.
+QUERY_MAX_TIME_MS = 30000
+QUERY_MAX_DOCUMENTS_EXAMINED = None
+QUERY_MAX_RESULTS = None
 LOG_LEVEL = "DEBUG"
 
+INDEX_ADVISOR_AUTO_CREATE = False
+INDEX_ADVISOR_MIN_QUERIES = 100
+# Query shapes remembered per data set, least recently used dropped first
+INDEX_ADVISOR_MAX_SHAPES = 100
+# Seconds an index report is reused for
+INDEX_ADVISOR_REPORT_TTL = 60
+
+# Write raw query responses as they are read from the database
+STREAM_RAW_QUERIES = False
+# Documents fetched and encoded at a time when streaming
+STREAM_BATCH_SIZE = 1000
+
+# Cache query results in 'memory' or in 'mongo', None to disable
+QUERY_CACHE_BACKEND = None
+QUERY_CACHE_MAX_ENTRIES = 1000
+QUERY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Threads running the queries of /_batch requests, shared by all requests
+BATCH_QUERY_THREADS = 8
+# Most queries allowed in one /_batch request
+BATCH_MAX_QUERIES = 50
+
+# Let concurrent identical queries share a single execution
+COALESCE_QUERIES = True
+
 STAGECRAFT_URL = 'http://localhost:3103'
+# Seconds to trust data set config from stagecraft, 0 to always ask
+DATA_SET_CONFIG_CACHE_TTL = 60
+# Seconds after which config is fetched again before it is used, rather
+# than served while it is refreshed in the background
+DATA_SET_CONFIG_CACHE_MAX_AGE = 300
+# Fetch every data set's config at start up
+DATA_SET_CONFIG_CACHE_PRELOAD = False
 
 SIGNON_API_USER_TOKEN = 'development-oauth-access-token'
@@ -1,8 +1,33 @@
 DATABASE_NAME = "backdrop_test"
 MONGO_HOSTS = ['localhost']
 MONGO_PORT = 27017
+MONGO_GROUP_ENGINE = 'group'
+MONGO_COLLECT_PUSHDOWN = False
+MONGO_READ_PREFERENCE = 'primary'
+MONGO_MAX_STALENESS_SECONDS = 60
+QUERY_MAX_TIME_MS = None
+QUERY_MAX_DOCUMENTS_EXAMINED = None
+QUERY_MAX_RESULTS = None
 LOG_LEVEL = "ERROR"
 
+INDEX_ADVISOR_AUTO_CREATE = False
+INDEX_ADVISOR_MIN_QUERIES = 100
+INDEX_ADVISOR_MAX_SHAPES = 100
+INDEX_ADVISOR_REPORT_TTL = 60
+
+STREAM_RAW_QUERIES = False
+STREAM_BATCH_SIZE = 1000
+
+QUERY_CACHE_BACKEND = None
+QUERY_CACHE_MAX_ENTRIES = 1000
+QUERY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+BATCH_QUERY_THREADS = 8
+BATCH_MAX_QUERIES = 50
+COALESCE_QUERIES = True
+
 DATA_SET_RATE_LIMIT = '10000/second'
+DATA_SET_CONFIG_CACHE_TTL = 0
+DATA_SET_CONFIG_CACHE_MAX_AGE = 0
 
 from development import STAGECRAFT_URL, SIGNON_API_USER_TOKEN
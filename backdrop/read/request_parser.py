@@ -0,0 +1,431 @@
+"""
+Validate query string arguments and parse them into a Query in one pass
+
+Every argument is read and converted once, up front. The checks then run
+on the converted values in order, and a request gets the message of the
+first one that fails.
+"""
+import re
+from datetime import time
+
+import pytz
+from werkzeug.datastructures import MultiDict
+
+from backdrop.core.pagination import decode_cursor
+from backdrop.core.query import Query
+from backdrop.core.timeseries import PERIODS, parse_period
+from backdrop.core.timeutils import as_utc
+from backdrop.core.validation import parse_datetime_string, key_is_valid, \
+    valid, invalid
+
+
+__all__ = ['parse_query']
+
+
+ALLOWED_PARAMETERS = frozenset([
+    'start_at', 'end_at', 'duration', 'period', 'filter_by',
+    'filter_by_prefix', 'group_by', 'sort_by', 'limit', 'collect', 'flatten',
+    'inclusive', 'fields', 'format', 'cursor', 'paginate',
+])
+
+PERIOD_NAMES = [period.name for period in PERIODS]
+OUTPUT_FORMATS = ['json', 'csv', 'ndjson']
+COLLECT_METHODS = ["sum", "count", "set", "mean"]
+SORT_DIRECTION = re.compile(r'^.+:(ascending|descending)$')
+
+MISSING = object()
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+class _Args(object):
+    """Query string arguments, each converted once"""
+
+    def __init__(self, request_args):
+        self.keys = set(request_args.keys())
+        self.first = dict((key, request_args.get(key)) for key in self.keys)
+        self.lists = dict((key, request_args.getlist(key))
+                          for key in ('filter_by', 'filter_by_prefix',
+                                      'collect', 'fields'))
+
+        self.dates = {}
+        for key in ('start_at', 'end_at', 'date'):
+            if key in self.keys:
+                self.dates[key] = parse_datetime_string(self.first[key])
+
+        self.limit = _to_int(self.first['limit']) \
+            if 'limit' in self.keys else None
+        self.duration = _to_int(self.first['duration']) \
+            if 'duration' in self.keys else None
+
+        self.cursor = None
+        if 'cursor' in self.keys:
+            try:
+                self.cursor = decode_cursor(self.first['cursor'])
+            except ValueError:
+                self.cursor = MISSING
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def get(self, key):
+        return self.first.get(key)
+
+    def date(self, key):
+        """The parsed datetime, in the timezone it was given in, if the
+        argument is a valid non-empty datetime string"""
+        if self.first.get(key):
+            return self.dates.get(key)
+
+
+def check_parameters(args):
+    if args.keys - ALLOWED_PARAMETERS:
+        return "An unrecognised parameter was provided"
+
+
+def check_period_query(args):
+    if 'period' not in args:
+        return
+
+    if 'duration' not in args:
+        if 'start_at' not in args or 'end_at' not in args:
+            return ("Either 'duration' or both 'start_at' and "
+                    "'end_at' are required for a period query")
+
+    if 'group_by' not in args and 'limit' in args:
+        return ("A period query can only be limited if it is "
+                "grouped - please add 'group_by'")
+
+
+def check_datetime(param_name):
+    def check(args):
+        if param_name in args and args.dates[param_name] is None:
+            return '%s is not a valid datetime' % param_name
+    return check
+
+
+def _filter_error(value):
+    if value.find(':') < 0:
+        return ('filter_by must be a field name and value separated by '
+                'a colon (:) eg. authority:Westminster')
+    if not key_is_valid(value.split(':', 1)[0]):
+        return 'Cannot filter by an invalid field name'
+    if value.startswith('$'):
+        return 'filter_by must not start with a $'
+
+
+def check_filter_by(args):
+    if 'filter_by' in args and 'filter_by_prefix' in args:
+        return ("Cannot use both filter_by "
+                "and filter_by_prefix in the same query")
+
+    for value in args.lists['filter_by'] + args.lists['filter_by_prefix']:
+        error = _filter_error(value)
+        if error:
+            return error
+
+
+def check_one_of(param_name, allowed):
+    def check(args):
+        if param_name in args and args.get(param_name) not in allowed:
+            return "'{param}' must be one of {allowed}".format(
+                param=param_name, allowed=str(allowed))
+    return check
+
+
+def check_sort_by(args):
+    if 'sort_by' not in args:
+        return
+
+    sort_by = args.get('sort_by')
+    if 'period' in args and 'group_by' not in args:
+        return ("Cannot sort for period queries without "
+                "group_by. Period queries are always sorted "
+                "by time.")
+    if sort_by.find(':') < 0:
+        return ('sort_by must be a field name and sort direction separated'
+                ' by a colon (:) eg. authority:ascending')
+    if not SORT_DIRECTION.match(sort_by):
+        return ('Unrecognised sort direction. Supported '
+                'directions include: ascending, descending')
+    if not key_is_valid(sort_by.split(':', 1)[0]):
+        return 'Cannot sort by an invalid field name'
+
+
+def check_group_by(args):
+    if 'group_by' not in args:
+        return
+
+    group_by = args.get('group_by')
+    if not key_is_valid(group_by):
+        return 'Cannot group by an invalid field name'
+    if group_by.startswith('_'):
+        return ('Cannot group by internal fields, '
+                'internal fields start with an underscore')
+
+
+def check_positive_integer(param_name, attribute):
+    def check(args):
+        if param_name in args:
+            value = getattr(args, attribute)
+            if value is None or value < 0:
+                return "%s must be a positive integer" % param_name
+    return check
+
+
+def check_depends_on(param_name, depends_on):
+    def check(args):
+        if param_name in args and \
+                all(param not in args for param in depends_on):
+            return '%s can be used only with either %s' % (
+                param_name, depends_on)
+    return check
+
+
+def check_relative_time(args):
+    start_at = args.get('start_at')
+    end_at = args.get('end_at')
+    period = args.get('period')
+    duration = args.get('duration')
+
+    if start_at and end_at and duration:
+        return ("Absolute and relative time cannot be requested at "
+                "the same time - either ask for 'start_at' and "
+                "'end_at', or ask for 'start_at'/'end_at' with "
+                "'duration'")
+
+    if start_at and end_at is None and duration is None:
+        return "Use of 'start_at' requires 'end_at' or 'duration'"
+
+    if end_at and start_at is None and duration is None:
+        return "Use of 'end_at' requires 'start_at' or 'duration'"
+
+    if duration:
+        if duration == '0':
+            return "'duration' must not be zero"
+        if not period:
+            return ("If 'duration' is requested (for relative "
+                    "time), 'period' is required - please add a "
+                    "period (like 'day', 'month' etc)")
+        if args.duration is None:
+            return "'duration' is not a valid Integer"
+
+
+def check_collect(args):
+    for value in args.lists['collect']:
+        if ":" in value:
+            parts = value.split(":")
+            if len(parts) != 2 or parts[1] not in COLLECT_METHODS:
+                return "Unknown collection method"
+            value = parts[0]
+
+        if not key_is_valid(value):
+            return 'Cannot collect an invalid field name'
+        if value.startswith('_'):
+            return ('Cannot collect internal fields, '
+                    'internal fields start '
+                    'with an underscore')
+        if value == args.get('group_by'):
+            return ("Cannot collect by a field that is "
+                    "used for group_by")
+
+
+def check_boolean(param_name):
+    def check(args):
+        if param_name in args and args.get(param_name) not in ['true',
+                                                               'false']:
+            return "{} must be either 'true' or 'false'".format(param_name)
+    return check
+
+
+def check_fields(args):
+    if 'fields' not in args:
+        return
+
+    if 'group_by' in args or 'period' in args:
+        return ("fields can only be used with raw queries, "
+                "grouped queries return the group_by and "
+                "collect fields")
+
+    for value in args.lists['fields']:
+        if not key_is_valid(value):
+            return 'Cannot select an invalid field name'
+
+
+def check_format(args):
+    if args.get('format') == 'csv' and 'fields' not in args \
+            and 'group_by' not in args and 'period' not in args:
+        return ("fields are required to export raw queries as csv, the "
+                "columns must be known before the rows are streamed")
+
+
+def check_pagination(args):
+    if 'cursor' in args:
+        param_name = 'cursor'
+    elif args.get('paginate') == 'true':
+        param_name = 'paginate'
+    else:
+        return
+
+    if 'group_by' in args or 'period' in args:
+        return "{} can only be used with raw queries".format(param_name)
+    elif 'limit' not in args:
+        return "{} can only be used with a limit".format(param_name)
+    elif 'sort_by' in args:
+        return ("{} cannot be used with sort_by, pages are "
+                "ordered by _timestamp".format(param_name))
+
+    if args.cursor is MISSING:
+        return "cursor is not valid"
+
+
+def check_raw_query(args):
+    if 'group_by' not in args and 'period' not in args:
+        return "querying for raw data is not allowed"
+
+
+def check_time_span(args):
+    start_at = args.date('start_at')
+    end_at = args.date('end_at')
+    if start_at and end_at and args.get('period') != 'hour':
+        if (end_at - start_at).days < 7:
+            return 'The minimum time span for a query is 7 days'
+
+
+def check_midnight(param_name):
+    def check(args):
+        timestamp = args.date(param_name)
+        if timestamp and args.get('period') != 'hour':
+            if timestamp.astimezone(pytz.UTC).time() != time(0):
+                return '%s must be midnight' % param_name
+    return check
+
+
+def check_monday(param_name):
+    def check(args):
+        if args.get('period') == 'week':
+            timestamp = args.date(param_name)
+            if timestamp and timestamp.weekday() != 0:
+                return '%s must be a monday' % param_name
+    return check
+
+
+def check_first_of_month(param_name):
+    def check(args):
+        if args.get('period') == 'month':
+            timestamp = args.date(param_name)
+            if timestamp and timestamp.day != 1:
+                return ('\'%s\' must be the first of the month for '
+                        'period=month queries' % param_name)
+    return check
+
+
+CHECKS = [
+    check_parameters,
+    check_period_query,
+    check_datetime('start_at'),
+    check_datetime('end_at'),
+    check_datetime('date'),
+    check_filter_by,
+    check_one_of('period', PERIOD_NAMES),
+    check_sort_by,
+    check_group_by,
+    check_positive_integer('limit', 'limit'),
+    check_positive_integer('duration', 'duration'),
+    check_depends_on('collect', ['group_by', 'period']),
+    check_relative_time,
+    check_collect,
+    check_boolean('flatten'),
+    check_boolean('inclusive'),
+    check_depends_on('inclusive', ['start_at', 'end_at']),
+    check_fields,
+    check_boolean('paginate'),
+    check_pagination,
+    check_one_of('format', OUTPUT_FORMATS),
+    check_format,
+]
+
+RAW_QUERY_CHECKS = CHECKS + [
+    check_raw_query,
+    check_time_span,
+    check_midnight('start_at'),
+    check_midnight('end_at'),
+    check_monday('start_at'),
+    check_monday('end_at'),
+    check_first_of_month('start_at'),
+    check_first_of_month('end_at'),
+]
+
+
+def _boolify(value):
+    return {
+        "true": True,
+        "false": False,
+    }.get(value, value)
+
+
+def _build_query(args, request_args):
+    def filters(name, convert):
+        return [[key, convert(value)] for key, value
+                in (item.split(':', 1) for item in args.lists[name])]
+
+    def prefix_regex(value):
+        return re.compile('^%s.*' % re.escape(value))
+
+    def collect(value):
+        if ':' in value:
+            return tuple(value.split(':'))
+        return (value, 'default')
+
+    start_at = args.dates.get('start_at')
+    end_at = args.dates.get('end_at')
+    sort_by = args.get('sort_by')
+
+    return Query.create(
+        start_at=as_utc(start_at) if start_at else None,
+        end_at=as_utc(end_at) if end_at else None,
+        duration=args.duration,
+        period=parse_period(args.get('period')) if 'period' in args else None,
+        filter_by=filters('filter_by', _boolify),
+        filter_by_prefix=filters('filter_by_prefix', prefix_regex),
+        group_by=request_args.getlist('group_by'),
+        sort_by=sort_by.split(':', 1) if sort_by is not None else None,
+        limit=args.limit,
+        collect=[collect(value) for value in args.lists['collect']],
+        flatten=_boolify(args.get('flatten')),
+        inclusive=_boolify(args.get('inclusive')),
+        fields=args.lists['fields'] or None,
+        after=args.cursor,
+        paginate=_boolify(args.get('paginate')))
+
+
+def parse_query(request_args, raw_queries_allowed=False):
+    """Validate query string arguments and parse them into a Query
+
+    Returns a ValidationResult and the Query, which is None unless the
+    arguments are valid.
+
+    >>> from werkzeug.datastructures import MultiDict
+    >>> result, query = parse_query(MultiDict([('group_by', 'foo')]))
+    >>> result.is_valid, query.group_by
+    (True, ['foo'])
+    >>> parse_query(MultiDict([('limit', 'foo')]), True)
+    (ValidationResult(is_valid=False, message='limit must be a positive \
+integer'), None)
+    """
+    if not isinstance(request_args, MultiDict):
+        request_args = MultiDict(request_args)
+    args = _Args(request_args)
+
+    checks = CHECKS if raw_queries_allowed else RAW_QUERY_CHECKS
+    for check in checks:
+        message = check(args)
+        if message:
+            return invalid(message), None
+
+    return valid(), _build_query(args, request_args)
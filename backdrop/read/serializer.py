@@ -0,0 +1,183 @@
+"""
+Encode read API responses as JSON
+
+Responses are made of dicts, lists and tuples of strings, numbers, booleans,
+None, datetimes and ObjectIds. ResponseEncoder handles just those types,
+writing every piece into a single buffer, and renders each datetime only
+once, which matters for period queries where the same _start_at and _end_at
+values are repeated for every group. The output is exactly what
+json.dumps gives with the read API's JsonEncoder.
+"""
+import datetime
+from json.encoder import encode_basestring_ascii
+
+from bson import ObjectId
+
+from ..core.timeutils import as_utc
+
+
+__all__ = ['ResponseEncoder']
+
+
+INFINITY = float('inf')
+
+
+def _float_string(value):
+    if value != value:
+        return 'NaN'
+    if value == INFINITY:
+        return 'Infinity'
+    if value == -INFINITY:
+        return '-Infinity'
+    return repr(value)
+
+
+def _key_string(key):
+    if isinstance(key, basestring):
+        return encode_basestring_ascii(key)
+    if key is True:
+        return '"true"'
+    if key is False:
+        return '"false"'
+    if key is None:
+        return '"null"'
+    if isinstance(key, (int, long)):
+        return '"{0}"'.format(key)
+    if isinstance(key, float):
+        return '"{0}"'.format(_float_string(key))
+    raise TypeError("key {0!r} is not a string".format(key))
+
+
+class ResponseEncoder(object):
+    """Encode a response the way json.dumps would with the read API's
+    JsonEncoder
+
+    >>> from datetime import datetime
+    >>> ResponseEncoder().encode(
+    ...     {'b': [1, 2.5, None], 'a': datetime(2014, 1, 1)})
+    '{"a": "2014-01-01T00:00:00+00:00", "b": [1, 2.5, null]}'
+    >>> print ResponseEncoder(indent=2).encode({'a': [{}]})
+    {
+      "a": [
+        {}
+      ]
+    }
+    """
+
+    def __init__(self, indent=None, sort_keys=True, max_dates=10000):
+        self._indent = indent
+        self._sort_keys = sort_keys
+        self._max_dates = max_dates
+
+        # Naive and aware datetimes cannot be compared so they are kept apart
+        self._naive_dates = {}
+        self._aware_dates = {}
+
+    def encode(self, obj):
+        chunks = []
+        self._encode(obj, chunks.append, 0)
+        return ''.join(chunks)
+
+    def _encode(self, obj, write, level):
+        obj_type = type(obj)
+        if obj_type is dict:
+            self._encode_dict(obj, write, level)
+        elif obj_type is str or obj_type is unicode:
+            write(encode_basestring_ascii(obj))
+        elif obj_type is float:
+            write(_float_string(obj))
+        elif obj_type is datetime.datetime:
+            write(self._datetime(obj))
+        else:
+            self._encode_other(obj, write, level)
+
+    def _encode_other(self, obj, write, level):
+        if isinstance(obj, basestring):
+            write(encode_basestring_ascii(obj))
+        elif obj is None:
+            write('null')
+        elif obj is True:
+            write('true')
+        elif obj is False:
+            write('false')
+        elif isinstance(obj, (int, long)):
+            write(str(obj))
+        elif isinstance(obj, float):
+            write(_float_string(obj))
+        elif isinstance(obj, datetime.datetime):
+            write(self._datetime(obj))
+        elif isinstance(obj, dict):
+            self._encode_dict(obj, write, level)
+        elif isinstance(obj, (list, tuple)):
+            self._encode_list(obj, write, level)
+        elif isinstance(obj, ObjectId):
+            write(encode_basestring_ascii(str(obj)))
+        else:
+            raise TypeError(repr(obj) + " is not JSON serializable")
+
+    def _datetime(self, value):
+        dates = self._naive_dates if value.tzinfo is None \
+            else self._aware_dates
+
+        rendered = dates.get(value)
+        if rendered is None:
+            if len(dates) >= self._max_dates:
+                dates.clear()
+            rendered = dates[value] = encode_basestring_ascii(
+                as_utc(value).isoformat())
+        return rendered
+
+    def _newline(self, level):
+        return '\n' + ' ' * (self._indent * level)
+
+    def _encode_list(self, values, write, level):
+        if not values:
+            write('[]')
+            return
+
+        if self._indent is None:
+            separator = ', '
+            write('[')
+        else:
+            separator = ', ' + self._newline(level + 1)
+            write('[' + self._newline(level + 1))
+
+        first = True
+        for value in values:
+            if not first:
+                write(separator)
+            first = False
+            self._encode(value, write, level + 1)
+
+        if self._indent is not None:
+            write(self._newline(level))
+        write(']')
+
+    def _encode_dict(self, values, write, level):
+        if not values:
+            write('{}')
+            return
+
+        if self._indent is None:
+            separator = ', '
+            write('{')
+        else:
+            separator = ', ' + self._newline(level + 1)
+            write('{' + self._newline(level + 1))
+
+        items = values.items()
+        if self._sort_keys:
+            items.sort(key=lambda item: item[0])
+
+        first = True
+        for key, value in items:
+            if not first:
+                write(separator)
+            first = False
+            write(_key_string(key))
+            write(': ')
+            self._encode(value, write, level + 1)
+
+        if self._indent is not None:
+            write(self._newline(level))
+        write('}')
@@ -0,0 +1,108 @@
+"""
+Write responses incrementally so that large raw queries never have to be
+held in memory as a whole
+"""
+import csv
+import datetime
+import json
+from cStringIO import StringIO
+from itertools import islice
+
+from ..core.timeutils import as_utc
+from .serializer import ResponseEncoder
+
+
+def batches(iterable, size):
+    """Split an iterable into lists of at most size items
+
+    >>> list(batches(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def stream_json(documents, batch_size, cls=json.JSONEncoder, **extra):
+    """Yield a JSON object with the documents under 'data' and any extra
+    keys, encoding batch_size documents at a time
+
+    >>> ''.join(stream_json(iter([{'a': 1}, {'a': 2}]), 1, warning='!'))
+    '{"data": [{"a": 1}, {"a": 2}], "warning": "!"}'
+    >>> ''.join(stream_json(iter([]), 10))
+    '{"data": []}'
+    """
+    encoder = cls(sort_keys=True)
+
+    yield '{"data": ['
+    separator = ''
+    for batch in batches(documents, batch_size):
+        yield separator + ', '.join(encoder.encode(doc) for doc in batch)
+        separator = ', '
+    yield ']'
+
+    for key in sorted(extra):
+        yield ', {0}: {1}'.format(json.dumps(key), encoder.encode(extra[key]))
+    yield '}'
+
+
+def stream_ndjson(rows, batch_size, cls=json.JSONEncoder):
+    """Yield each row as a line of JSON, encoding batch_size rows at a time
+
+    >>> ''.join(stream_ndjson(iter([{'a': 1}, {'a': 2}]), 1))
+    '{"a": 1}\\n{"a": 2}\\n'
+    """
+    encoder = cls(sort_keys=True)
+
+    for batch in batches(rows, batch_size):
+        yield ''.join(encoder.encode(row) + '\n' for row in batch)
+
+
+def stream_csv(rows, batch_size, columns):
+    """Yield rows as CSV with the given columns, batch_size rows at a time
+
+    Values that are not strings, numbers or datetimes are written as JSON.
+
+    >>> print ''.join(stream_csv(
+    ...     iter([{'a': 1, 'b': None}, {'a': [2]}]), 1, ['a', 'b']))
+    a,b
+    1,
+    [2],
+    <BLANKLINE>
+    """
+    encoder = ResponseEncoder()
+
+    def cell(value):
+        if value is None:
+            return ''
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        if isinstance(value, str):
+            return value
+        if isinstance(value, datetime.datetime):
+            return as_utc(value).isoformat()
+        return encoder.encode(value)
+
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+
+    def flush():
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    writer.writerow(map(cell, columns))
+
+    for batch in batches(rows, batch_size):
+        for row in batch:
+            writer.writerow([cell(row.get(column)) for column in columns])
+
+        yield flush()
+
+    if buffer.tell():
+        # Only the header has been written
+        yield flush()
@@ -4,7 +4,6 @@ import pytz
 from os import getenv
 from celery import Celery
 
-from dateutil.parser import parse as datetime_parse
 from flask import abort, Flask, g, jsonify, request
 from flask_featureflags import FeatureFlag
 from backdrop import statsd
@@ -14,9 +13,11 @@ from backdrop.write.decompressing_request import DecompressingRequest
 
 from ..core.errors import ParseError, ValidationError
 from ..core import log_handler, cache_control
+from ..core.admin_cache import CachedAdminAPI
 from ..core.flaskutils import generate_request_id
+from ..core.timeutils import parse_time
 
-from ..core.storage.mongo import MongoStorageEngine
+from ..core.storage.mongo import MongoStorageEngine, BULK_WRITE_CHUNK_SIZE
 
 from .validation import auth_header_is_valid, extract_bearer_token
 
@@ -38,7 +39,9 @@ app.config.from_object(
 storage = MongoStorageEngine.create(
     app.config['MONGO_HOSTS'],
     app.config['MONGO_PORT'],
-    app.config['DATABASE_NAME'])
+    app.config['DATABASE_NAME'],
+    bulk_write_chunk_size=app.config.get('MONGO_BULK_WRITE_CHUNK_SIZE',
+                                         BULK_WRITE_CHUNK_SIZE))
 
 admin_api = client.AdminAPI(
     app.config['STAGECRAFT_URL'],
@@ -47,6 +50,15 @@ admin_api = client.AdminAPI(
     request_id_fn=generate_request_id,
 )
 
+if app.config.get('DATA_SET_CONFIG_CACHE_TTL'):
+    # Tokens are checked against this config, so revoked or rotated tokens
+    # must not outlive the ttl, even while stagecraft is down
+    admin_api = CachedAdminAPI(
+        admin_api, ttl=app.config['DATA_SET_CONFIG_CACHE_TTL'],
+        max_age=app.config['DATA_SET_CONFIG_CACHE_TTL'])
+    if app.config.get('DATA_SET_CONFIG_CACHE_PRELOAD', False):
+        admin_api.preload()
+
 log_handler.set_up_logging(app, GOVUK_ENV)
 log_handler.set_up_audit_logging(app, GOVUK_ENV)
 
@@ -326,9 +338,9 @@ def bounding_dates(data):
 
 def parse_bounding_dates(data):
     if '_start_at' in data:
-        start_at = datetime_parse(data['_start_at'])
+        start_at = parse_time(data['_start_at'])
         if '_end_at' in data:
-            end_at = datetime_parse(data['_end_at'])
+            end_at = parse_time(data['_end_at'])
         else:
             end_at = datetime.datetime.now(pytz.UTC).replace(microsecond=0)
     else:
@@ -1,6 +1,7 @@
 DATABASE_NAME = "backdrop"
 MONGO_HOSTS = ['localhost']
 MONGO_PORT = 27017
+MONGO_BULK_WRITE_CHUNK_SIZE = 1000
 LOG_LEVEL = "DEBUG"
 DATA_SET_AUTO_ID_KEYS = {
     "lpa_volumes": ("key", "start_at", "end_at")
@@ -14,6 +15,10 @@ except ImportError:
     from development_environment_sample import *
 
 STAGECRAFT_URL = 'http://localhost:3103'
+# Seconds to trust data set config from stagecraft, 0 to always ask
+DATA_SET_CONFIG_CACHE_TTL = 60
+# Fetch every data set's config at start up
+DATA_SET_CONFIG_CACHE_PRELOAD = False
 
 SIGNON_API_USER_TOKEN = 'development-oauth-access-token'
 
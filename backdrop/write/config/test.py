@@ -1,6 +1,7 @@
 DATABASE_NAME = "backdrop_test"
 MONGO_HOSTS = ['localhost']
 MONGO_PORT = 27017
+MONGO_BULK_WRITE_CHUNK_SIZE = 1000
 LOG_LEVEL = "DEBUG"
 CLIENT_ID = "it's not important here"
 CLIENT_SECRET = "it's not important here"
@@ -10,6 +11,7 @@ DATA_SET_AUTO_ID_KEYS = {
     "evl_volumetrics": ["_timestamp", "service", "transaction"],
 }
 TRANSFORMER_AMQP_URL = 'memory://'
+DATA_SET_CONFIG_CACHE_TTL = 0
 
 from development import (STAGECRAFT_COLLECTION_ENDPOINT_TOKEN, STAGECRAFT_URL,
                          SIGNON_API_USER_TOKEN)
@@ -0,0 +1,121 @@
+from hamcrest import assert_that, is_, contains, has_entries
+from mock import Mock, patch
+
+from backdrop.core.query import Query
+from backdrop.core.storage.index_advisor import IndexAdvisor
+from backdrop.core.timeseries import WEEK
+
+from tests.support.test_helpers import d_tz
+
+
+class TestIndexAdvisor(object):
+    def setup(self):
+        self.storage = Mock()
+        self.storage.get_indexes.return_value = [[('_timestamp', -1)]]
+        self.storage.count.return_value = 0
+
+    def wait_for_indexes(self, advisor):
+        for thread in advisor._provisioning.values():
+            thread.join(5)
+
+    def test_queries_of_the_same_shape_are_counted_together(self):
+        advisor = IndexAdvisor(self.storage)
+
+        advisor.record('foo', Query.create(filter_by=[('a', 'x')]))
+        advisor.record('foo', Query.create(filter_by=[('a', 'y')]))
+        advisor.record('foo', Query.create(
+            filter_by=[('a', 'y')], group_by=['b'], period=WEEK,
+            start_at=d_tz(2014, 1, 6), end_at=d_tz(2014, 2, 3)))
+
+        report = advisor.report()
+
+        assert_that(report, contains(has_entries({
+            'name': 'foo',
+            'recommendations': contains(
+                has_entries({'index': [('a', 1)], 'queries': 2}),
+                has_entries({'index': [('a', 1), ('_timestamp', -1)],
+                             'queries': 1})),
+        })))
+
+    def test_report_estimates_scan_savings(self):
+        advisor = IndexAdvisor(self.storage)
+        self.storage.count.side_effect = \
+            lambda name, spec=None: 10 if spec else 1000
+
+        advisor.record('foo', Query.create(filter_by=[('a', 'x')]))
+        advisor.record('foo', Query.create(filter_by=[('a', 'x')]))
+
+        [report] = advisor.report('foo')
+
+        assert_that(report['recommendations'][0], has_entries({
+            'exists': False,
+            'documents_scanned': 1000,
+            'documents_scanned_with_index': 10,
+            'estimated_scan_savings': 1980,
+        }))
+
+    def test_indexes_are_not_created_by_default(self):
+        advisor = IndexAdvisor(self.storage, min_queries=1)
+
+        advisor.record('foo', Query.create(filter_by=[('a', 'x')]))
+        self.wait_for_indexes(advisor)
+
+        assert_that(self.storage.create_index.called, is_(False))
+
+    def test_indexes_are_created_once_a_shape_is_common(self):
+        advisor = IndexAdvisor(self.storage, auto_create=True, min_queries=2)
+
+        advisor.record('foo', Query.create(filter_by=[('a', 'x')]))
+        assert_that(self.storage.create_index.called, is_(False))
+
+        advisor.record('foo', Query.create(filter_by=[('a', 'x')]))
+        advisor.record('foo', Query.create(filter_by=[('a', 'x')]))
+        self.wait_for_indexes(advisor)
+        self.storage.create_index.assert_called_once_with('foo', [('a', 1)])
+
+    def test_existing_indexes_are_not_recreated(self):
+        self.storage.get_indexes.return_value = [[('a', 1), ('b', 1)]]
+        advisor = IndexAdvisor(self.storage, auto_create=True, min_queries=1)
+
+        advisor.record('foo', Query.create(filter_by=[('a', 'x')]))
+        self.wait_for_indexes(advisor)
+
+        assert_that(self.storage.create_index.called, is_(False))
+
+    @patch('backdrop.core.storage.index_advisor.logger')
+    def test_failing_to_create_an_index_is_logged(self, logger):
+        self.storage.create_index.side_effect = Exception('boom')
+        advisor = IndexAdvisor(self.storage, auto_create=True, min_queries=1)
+
+        advisor.record('foo', Query.create(filter_by=[('a', 'x')]))
+        self.wait_for_indexes(advisor)
+
+        assert_that(logger.exception.called, is_(True))
+
+    def test_least_recently_used_shapes_are_forgotten(self):
+        advisor = IndexAdvisor(self.storage, max_shapes=2)
+
+        advisor.record('foo', Query.create(filter_by=[('a', 'x')]))
+        advisor.record('foo', Query.create(filter_by=[('b', 'x')]))
+        advisor.record('foo', Query.create(filter_by=[('a', 'x')]))
+        advisor.record('foo', Query.create(filter_by=[('c', 'x')]))
+
+        [report] = advisor.report()
+
+        assert_that(report['recommendations'], contains(
+            has_entries({'index': [('a', 1)], 'queries': 2}),
+            has_entries({'index': [('c', 1)], 'queries': 1})))
+
+    @patch('backdrop.core.storage.index_advisor.time')
+    def test_reports_are_reused_until_they_expire(self, time):
+        time.time.return_value = 0
+        advisor = IndexAdvisor(self.storage, report_ttl=60)
+        advisor.record('foo', Query.create(filter_by=[('a', 'x')]))
+
+        advisor.report()
+        advisor.report('foo')
+        assert_that(self.storage.count.call_count, is_(2))
+
+        time.time.return_value = 60
+        advisor.report()
+        assert_that(self.storage.count.call_count, is_(4))
@@ -6,18 +6,24 @@ amount of setup and mocking. Small unit tests are in doctest format in the
 module itself.
 """
 
-from hamcrest import assert_that, is_, has_key
+from hamcrest import assert_that, is_, has_key, has_entries, instance_of
 from nose.tools import assert_raises
-from mock import Mock
+from mock import Mock, MagicMock, patch
 
 import datetime
+import json
 
-from pymongo.errors import AutoReconnect
+from pymongo.errors import AutoReconnect, BulkWriteError, ExecutionTimeout
+from pymongo.read_preferences import ReadPreference
 
-from backdrop.core.storage.mongo import MongoStorageEngine, reconnecting_save, time_as_utc
+from backdrop.core.storage.mongo import MongoStorageEngine, \
+    reconnecting_save, reconnecting_bulk_save, time_as_utc, PAGE_INDEX
 from backdrop.core.data_set import DataSet
+from backdrop.core.errors import QueryLimitError
+from backdrop.core.query import Query
 
 from .test_storage import BaseStorageTest
+from tests.support.test_helpers import d_tz
 
 
 class TestMongoStorageEngine(BaseStorageTest):
@@ -31,7 +37,8 @@ class TestMongoStorageEngine(BaseStorageTest):
         coll = self.engine._collection('should_have_index')
         indicies = coll.index_information()
 
-        assert_that(indicies, has_key('_timestamp_-1'))
+        # _timestamp queries use the prefix of the index pages are read from
+        assert_that(indicies, has_key('_timestamp_-1__id_-1'))
 
     def test_batch_last_updated(self):
         timestamp = time_as_utc(datetime.datetime.utcnow())
@@ -52,10 +59,449 @@ class TestMongoStorageEngine(BaseStorageTest):
         assert_that(last_updated.minute, is_(timestamp.minute))
         assert_that(last_updated.second, is_(timestamp.second))
 
+    def test_group_and_aggregate_engines_give_identical_results(self):
+        self.engine.create_data_set('foo_bar', 0)
+        for record in [{'foo': 'a', 'c': 1}, {'foo': 'a', 'c': 2.5},
+                       {'foo': 'b', 'c': None}, {'foo': 'b'}]:
+            self.engine.save_record('foo_bar', record)
+        query = Query.create(group_by=['foo'], collect=[('c', 'sum')])
+
+        def results(group_engine):
+            engine = MongoStorageEngine(self.engine._mongo, 'backdrop_test',
+                                        group_engine=group_engine)
+            return json.dumps(
+                sorted(engine.execute_query('foo_bar', query),
+                       key=lambda result: result['foo']),
+                sort_keys=True)
+
+        assert_that(results('aggregate'), is_(results('group')))
+
     def teardown(self):
         self.engine._mongo.drop_database('backdrop_test')
 
 
+class TestMongoStorageEngineWithAggregation(TestMongoStorageEngine):
+    def setup(self):
+        self.engine = MongoStorageEngine.create(
+            ['localhost'], 27017, 'backdrop_test', group_engine='aggregate')
+
+
+class TestAggregateGroupEngine(object):
+    def setup(self):
+        self.mongo = MagicMock()
+        self.collection = self.mongo['backdrop_test']['foo_bar']
+        self.engine = MongoStorageEngine(
+            self.mongo, 'backdrop_test', group_engine='aggregate')
+
+    def test_grouped_query_uses_the_aggregation_pipeline(self):
+        self.collection.aggregate.return_value = iter([
+            {'_id': {'foo': 'bar'}, '_count': 2, 'c': [1, 3]}])
+
+        results = self.engine.execute_query('foo_bar', Query.create(
+            group_by=['foo'], collect=[('c', 'sum')]))
+
+        assert_that(self.collection.group.called, is_(False))
+        assert_that(results, is_([{'foo': 'bar', '_count': 2, 'c': [1, 3]}]))
+
+    def test_documents_are_counted_as_doubles(self):
+        self.collection.aggregate.return_value = iter([])
+
+        self.engine.execute_query('foo_bar', Query.create(group_by=['foo']))
+
+        pipeline = self.collection.aggregate.call_args[0][0]
+        count = pipeline[1]['$group']['_count']['$sum']
+        assert_that(count, instance_of(float))
+
+    def test_collect_methods_are_reduced_by_the_database(self):
+        engine = MongoStorageEngine(
+            self.mongo, 'backdrop_test',
+            group_engine='aggregate', collect_pushdown=True)
+        self.collection.aggregate.return_value = iter([
+            {'_id': {'foo': 'bar'}, '_count': 2,
+             'c__sum': 4, 'c__set': [1, 3], 'c__non_numeric': [0]}])
+
+        results = engine.execute_query('foo_bar', Query.create(
+            group_by=['foo'], collect=[('c', 'sum'), ('c', 'set')]))
+
+        pipeline = self.collection.aggregate.call_args[0][0]
+        assert_that(pipeline[1]['$group'], has_entries({
+            'c__sum': {'$sum': '$c'},
+            'c__set': {'$addToSet': '$c'},
+        }))
+        assert_that(results[0]['c'].reduce('sum'), is_(4))
+        assert_that(results[0]['c'].reduce('set'), is_([1, 3]))
+
+    def test_collect_pushdown_falls_back_for_values_that_are_not_numbers(self):
+        engine = MongoStorageEngine(
+            self.mongo, 'backdrop_test',
+            group_engine='aggregate', collect_pushdown=True)
+        self.collection.aggregate.side_effect = [
+            iter([{'_id': {'foo': 'bar'}, '_count': 2,
+                   'c__sum': 1, 'c__non_numeric': [0, None]}]),
+            iter([{'_id': {'foo': 'bar'}, '_count': 2, 'c': [1, None]}]),
+        ]
+
+        results = engine.execute_query('foo_bar', Query.create(
+            group_by=['foo'], collect=[('c', 'sum')]))
+
+        pipeline = self.collection.aggregate.call_args[0][0]
+        assert_that(pipeline[1]['$group']['c'], is_({'$push': '$c'}))
+        assert_that(results, is_([{'foo': 'bar', '_count': 2,
+                                   'c': [1, None]}]))
+
+    def test_count_is_not_pushed_down(self):
+        engine = MongoStorageEngine(
+            self.mongo, 'backdrop_test',
+            group_engine='aggregate', collect_pushdown=True)
+        self.collection.aggregate.return_value = iter([])
+
+        engine.execute_query('foo_bar', Query.create(
+            group_by=['foo'], collect=[('c', 'count')]))
+
+        pipeline = self.collection.aggregate.call_args[0][0]
+        assert_that(pipeline[1]['$group']['c'], is_({'$push': '$c'}))
+
+    def test_collect_pushdown_requires_the_aggregate_engine(self):
+        assert_raises(ValueError, MongoStorageEngine,
+                      self.mongo, 'backdrop_test', collect_pushdown=True)
+
+    def test_unknown_group_engine_is_rejected(self):
+        assert_raises(ValueError, MongoStorageEngine,
+                      self.mongo, 'backdrop_test', group_engine='mapreduce')
+
+
+class TestFreshness(object):
+    def setup(self):
+        self.mongo = MagicMock()
+        self.collections = {
+            'foo_bar': MagicMock(),
+            '_data_set_freshness': MagicMock(),
+        }
+        self.mongo['backdrop_test'].__getitem__.side_effect = \
+            self.collections.__getitem__
+        self.freshness = self.collections['_data_set_freshness']
+        self.engine = MongoStorageEngine(self.mongo, 'backdrop_test')
+
+    def test_saving_records_updates_the_freshness(self):
+        timestamp = time_as_utc(datetime.datetime(2014, 1, 1))
+
+        self.engine.save_records('foo_bar', [
+            {'_timestamp': timestamp}, {'foo': 'bar'}])
+
+        spec, update = self.freshness.update.call_args[0]
+        assert_that(spec, is_({'_id': 'foo_bar'}))
+        assert_that(update['$max'], has_entries({
+            '_timestamp': timestamp,
+            '_updated_at': instance_of(datetime.datetime),
+        }))
+
+    def test_get_last_updated_reads_the_freshness(self):
+        self.freshness.find_one.return_value = {
+            '_id': 'foo_bar',
+            '_updated_at': datetime.datetime(2014, 1, 1)}
+
+        last_updated = self.engine.get_last_updated('foo_bar')
+
+        assert_that(last_updated, is_(d_tz(2014, 1, 1)))
+        assert_that(self.collections['foo_bar'].find_one.called, is_(False))
+
+    def test_batch_last_updated_reads_the_freshness_once(self):
+        self.freshness.find.return_value = [
+            {'_id': 'foo_bar', '_timestamp': datetime.datetime(2014, 1, 1)}]
+        data_set = DataSet(self.engine, {'name': 'foo_bar'})
+
+        self.engine.batch_last_updated([data_set])
+
+        assert_that(data_set.get_last_updated(), is_(d_tz(2014, 1, 1)))
+        assert_that(self.freshness.find.call_count, is_(1))
+
+    def test_freshness_is_backfilled_for_older_data_sets(self):
+        self.freshness.find_one.return_value = None
+        self.collections['foo_bar'].find_one.return_value = {
+            '_updated_at': datetime.datetime(2014, 1, 1),
+            '_timestamp': datetime.datetime(2013, 1, 1)}
+
+        last_updated = self.engine.get_last_updated('foo_bar')
+
+        assert_that(last_updated, is_(d_tz(2014, 1, 1)))
+        assert_that(self.freshness.update.called, is_(True))
+
+    def test_version_starts_at_zero(self):
+        self.freshness.find_one.return_value = None
+
+        assert_that(self.engine.get_version('foo_bar'), is_(0))
+
+    def test_bumping_the_version_increments_it(self):
+        self.engine.bump_version('foo_bar')
+
+        self.freshness.update.assert_called_once_with(
+            {'_id': 'foo_bar'}, {'$inc': {'_version': 1}}, upsert=True)
+
+
+class TestDataSetExists(object):
+    def setup(self):
+        self.mongo = MagicMock()
+        self.db = self.mongo['backdrop_test']
+        self.db.name = 'backdrop_test'
+        self.namespaces = self.db['system.namespaces']
+        self.engine = MongoStorageEngine(self.mongo, 'backdrop_test')
+
+    def test_only_the_one_collection_is_looked_up(self):
+        self.namespaces.find_one.return_value = {
+            'name': 'backdrop_test.foo_bar'}
+
+        assert_that(self.engine.data_set_exists('foo_bar'), is_(True))
+        self.namespaces.find_one.assert_called_once_with(
+            {'name': 'backdrop_test.foo_bar'}, fields=['name'])
+        assert_that(self.db.collection_names.called, is_(False))
+
+    def test_collections_dropped_elsewhere_are_not_trusted(self):
+        self.namespaces.find_one.return_value = {
+            'name': 'backdrop_test.foo_bar'}
+        self.engine.data_set_exists('foo_bar')
+        self.namespaces.find_one.return_value = None
+
+        assert_that(self.engine.data_set_exists('foo_bar'), is_(False))
+
+
+class TestReadPreference(object):
+    def setup(self):
+        self.mongo = MagicMock()
+        self.collection = self.mongo['backdrop_test']['foo_bar']
+        self.collection.find.return_value = []
+        self.replica_set_status = {'members': [
+            {'stateStr': 'PRIMARY',
+             'optimeDate': datetime.datetime(2014, 1, 1, 0, 0, 30)},
+            {'stateStr': 'SECONDARY',
+             'optimeDate': datetime.datetime(2014, 1, 1, 0, 0, 25)},
+        ]}
+        self.mongo.admin.command.return_value = self.replica_set_status
+
+    def engine(self, **kwargs):
+        return MongoStorageEngine(self.mongo, 'backdrop_test', **kwargs)
+
+    def test_queries_go_to_the_primary_by_default(self):
+        self.engine().execute_query('foo_bar', Query.create())
+
+        assert_that(self.collection.read_preference,
+                    is_(ReadPreference.PRIMARY))
+
+    def test_queries_go_to_secondaries_when_configured(self):
+        engine = self.engine(read_preference='secondary_preferred')
+
+        engine.execute_query('foo_bar', Query.create())
+
+        assert_that(self.collection.read_preference,
+                    is_(ReadPreference.SECONDARY_PREFERRED))
+
+    def test_queries_that_need_the_latest_writes_go_to_the_primary(self):
+        engine = self.engine(read_preference='secondary_preferred')
+
+        engine.execute_query('foo_bar', Query.create(), secondary_ok=False)
+
+        assert_that(self.collection.read_preference,
+                    is_(ReadPreference.PRIMARY))
+
+    def test_queries_go_to_the_primary_when_secondaries_are_stale(self):
+        engine = self.engine(
+            read_preference='secondary_preferred', max_staleness=2)
+
+        engine.execute_query('foo_bar', Query.create())
+
+        assert_that(self.collection.read_preference,
+                    is_(ReadPreference.PRIMARY))
+
+    def test_replication_lag_is_only_checked_periodically(self):
+        engine = self.engine(
+            read_preference='secondary_preferred', max_staleness=10)
+
+        engine.execute_query('foo_bar', Query.create())
+        engine.execute_query('foo_bar', Query.create())
+
+        assert_that(self.collection.read_preference,
+                    is_(ReadPreference.SECONDARY_PREFERRED))
+        self.mongo.admin.command.assert_called_once_with('replSetGetStatus')
+
+    def test_unknown_read_preference_is_rejected(self):
+        assert_raises(ValueError, self.engine, read_preference='anywhere')
+
+
+class TestStreamQuery(object):
+    def setup(self):
+        self.mongo = MagicMock()
+        self.collection = self.mongo['backdrop_test']['foo_bar']
+        self.cursor = self.collection.find.return_value.batch_size
+        self.engine = MongoStorageEngine(self.mongo, 'backdrop_test')
+
+    def test_results_are_fetched_in_batches(self):
+        self.cursor.return_value = iter([
+            {'_timestamp': datetime.datetime(2014, 1, 1)}])
+
+        results = self.engine.stream_query('foo_bar', Query.create(), 100)
+
+        self.cursor.assert_called_once_with(100)
+        assert_that(list(results), is_([
+            {'_timestamp': d_tz(2014, 1, 1)}]))
+
+    def test_grouped_queries_cannot_be_streamed(self):
+        assert_raises(ValueError, self.engine.stream_query,
+                      'foo_bar', Query.create(group_by=['foo']), 100)
+
+
+class TestPageIndex(object):
+    def setup(self):
+        self.mongo = MagicMock()
+        self.collection = self.mongo['backdrop_test']['foo_bar']
+        self.collection.find.return_value = []
+        self.engine = MongoStorageEngine(self.mongo, 'backdrop_test')
+
+    def test_the_index_is_built_when_a_data_set_is_first_paginated(self):
+        query = Query.create(limit=10, paginate=True)
+
+        self.engine.execute_query('foo_bar', query)
+        self.engine.execute_query('foo_bar', query)
+
+        self.collection.ensure_index.assert_called_once_with(
+            PAGE_INDEX, background=True)
+
+    def test_unpaginated_queries_do_not_build_the_index(self):
+        self.engine.execute_query('foo_bar', Query.create(limit=10))
+
+        assert_that(self.collection.ensure_index.called, is_(False))
+
+
+class TestQueryLimits(object):
+    def setup(self):
+        self.mongo = MagicMock()
+        self.collection = self.mongo['backdrop_test']['foo_bar']
+        self.cursor = self.collection.find.return_value
+        self.cursor.max_time_ms.return_value = self.cursor
+        self.cursor.__iter__.return_value = iter([])
+
+    def engine(self, **query_limits):
+        return MongoStorageEngine(self.mongo, 'backdrop_test',
+                                  query_limits=query_limits)
+
+    def test_queries_are_given_the_default_time_limit(self):
+        self.engine(max_time_ms=500).execute_query('foo_bar', Query.create())
+
+        self.cursor.max_time_ms.assert_called_once_with(500)
+
+    def test_data_sets_can_set_their_own_limits(self):
+        self.engine(max_time_ms=500).execute_query(
+            'foo_bar', Query.create(), limits={'max_time_ms': 100})
+
+        self.cursor.max_time_ms.assert_called_once_with(100)
+
+    def test_grouped_queries_are_given_the_time_limit(self):
+        self.collection.group.return_value = []
+
+        self.engine(max_time_ms=500).execute_query(
+            'foo_bar', Query.create(group_by=['foo']))
+
+        assert_that(self.collection.group.call_args[1],
+                    has_entries({'maxTimeMS': 500}))
+
+    @patch('backdrop.core.storage.mongo.statsd')
+    def test_queries_that_time_out_raise_a_query_limit_error(self, statsd):
+        self.cursor.__iter__.side_effect = ExecutionTimeout('timed out')
+
+        assert_raises(QueryLimitError, self.engine(max_time_ms=500).
+                      execute_query, 'foo_bar', Query.create())
+        statsd.incr.assert_called_once_with(
+            'storage.query_limit.max_time_ms', data_set='foo_bar')
+
+    def test_raw_queries_fetch_one_more_than_the_result_limit(self):
+        self.engine(max_results=10).execute_query(
+            'foo_bar', Query.create(limit=100))
+
+        assert_that(self.collection.find.call_args[1],
+                    has_entries({'limit': 11}))
+
+    def test_too_many_results_raise_a_query_limit_error(self):
+        self.collection.group.return_value = [{'foo': 'a'}, {'foo': 'b'}]
+
+        assert_raises(QueryLimitError, self.engine(max_results=1).
+                      execute_query, 'foo_bar',
+                      Query.create(group_by=['foo']))
+
+    def test_queries_without_a_time_range_examine_the_whole_collection(self):
+        self.collection.count.return_value = 1000
+
+        assert_raises(QueryLimitError,
+                      self.engine(max_documents_examined=999).execute_query,
+                      'foo_bar', Query.create(group_by=['foo']))
+        assert_that(self.collection.group.called, is_(False))
+
+    def test_queries_examine_the_documents_in_their_time_range(self):
+        self.cursor.count.return_value = 100
+        self.collection.group.return_value = []
+
+        self.engine(max_documents_examined=100).execute_query(
+            'foo_bar', Query.create(group_by=['foo'],
+                                    start_at=d_tz(2014, 1, 1)))
+
+        self.collection.find.assert_called_once_with(
+            {'_timestamp': {'$gte': d_tz(2014, 1, 1)}})
+
+    def test_filters_are_not_counted_as_the_query_would_be_run_twice(self):
+        self.cursor.count.return_value = 100
+        self.collection.group.return_value = []
+
+        self.engine(max_documents_examined=100).execute_query(
+            'foo_bar', Query.create(group_by=['foo'],
+                                    start_at=d_tz(2014, 1, 1),
+                                    filter_by=[('bar', 'baz')]))
+
+        self.collection.find.assert_called_once_with(
+            {'_timestamp': {'$gte': d_tz(2014, 1, 1)}})
+
+    def test_filtered_queries_without_a_time_range_examine_everything(self):
+        self.collection.count.return_value = 1000
+        self.collection.group.return_value = []
+
+        assert_raises(QueryLimitError,
+                      self.engine(max_documents_examined=999).execute_query,
+                      'foo_bar', Query.create(group_by=['foo'],
+                                              filter_by=[('bar', 'baz')]))
+        assert_that(self.collection.find.called, is_(False))
+
+    def test_pages_examine_the_documents_after_their_cursor(self):
+        self.cursor.count.return_value = 100
+        query = Query.create(filter_by=[('bar', 'baz')], limit=10,
+                             after=(d_tz(2014, 1, 1), 'abc'))
+
+        self.engine(max_documents_examined=100).execute_query(
+            'foo_bar', query)
+
+        self.collection.find.assert_any_call(
+            {'_timestamp': {'$gte': d_tz(2014, 1, 1)}})
+
+    def test_raw_queries_with_only_a_limit_examine_that_many(self):
+        self.engine(max_documents_examined=100).execute_query(
+            'foo_bar', Query.create(limit=100))
+
+        assert_that(self.collection.count.called, is_(False))
+
+    def test_raw_queries_sorted_without_an_index_examine_everything(self):
+        self.collection.count.return_value = 1000
+
+        assert_raises(QueryLimitError,
+                      self.engine(max_documents_examined=999).execute_query,
+                      'foo_bar', Query.create(limit=10,
+                                              sort_by=['foo', 'ascending']))
+
+    def test_streamed_queries_check_the_documents_examined(self):
+        self.collection.count.return_value = 1000
+
+        assert_raises(QueryLimitError,
+                      self.engine(max_documents_examined=999).stream_query,
+                      'foo_bar', Query.create(), 100)
+
+    def test_unknown_query_limits_are_rejected(self):
+        assert_raises(ValueError, self.engine, max_rows=10)
+
+
 class TestReconnectingSave(object):
     def test_reconnecting_save_retries(self):
         collection = Mock()
@@ -70,3 +516,59 @@ class TestReconnectingSave(object):
         collection.save.side_effect = [AutoReconnect, AutoReconnect, AutoReconnect, None]
 
         assert_raises(AutoReconnect, reconnecting_save, collection, 'record')
+
+
+class TestReconnectingBulkSave(object):
+    def test_reconnecting_bulk_save_retries(self):
+        collection = Mock()
+        bulk = collection.initialize_unordered_bulk_op.return_value
+        bulk.execute.side_effect = [AutoReconnect, None]
+
+        reconnecting_bulk_save(collection, [{'_id': 'a'}])
+
+        assert_that(bulk.execute.call_count, is_(2))
+
+    def test_reconnecting_bulk_save_fails_after_3_retries(self):
+        collection = Mock()
+        bulk = collection.initialize_unordered_bulk_op.return_value
+        bulk.execute.side_effect = [AutoReconnect, AutoReconnect,
+                                    AutoReconnect, None]
+
+        assert_raises(AutoReconnect, reconnecting_bulk_save,
+                      collection, [{'_id': 'a'}])
+
+
+class TestSaveRecords(object):
+    def setup(self):
+        self.mongo = MagicMock()
+        self.collection = self.mongo['backdrop_test']['foo_bar']
+        self.bulk = self.collection.initialize_unordered_bulk_op.return_value
+        self.engine = MongoStorageEngine(
+            self.mongo, 'backdrop_test', bulk_write_chunk_size=2)
+
+    def test_records_are_saved_in_chunks(self):
+        records = [{'_id': i} for i in range(5)]
+
+        self.engine.save_records('foo_bar', records)
+
+        assert_that(self.bulk.execute.call_count, is_(3))
+        assert_that(self.bulk.find.call_count, is_(5))
+
+    def test_records_without_an_id_are_given_one(self):
+        records = [{'foo': 'bar'}]
+
+        self.engine.save_records('foo_bar', records)
+
+        assert_that(records[0], has_key('_id'))
+        assert_that(records[0], has_key('_updated_at'))
+
+    def test_write_errors_are_reported_per_record(self):
+        self.bulk.execute.side_effect = [
+            None,
+            BulkWriteError({'writeErrors': [
+                {'index': 1, 'code': 11000, 'errmsg': 'duplicate key'}]})]
+
+        errors = self.engine.save_records(
+            'foo_bar', [{'_id': i} for i in range(4)])
+
+        assert_that(errors, is_(['record 3 could not be saved: duplicate key']))
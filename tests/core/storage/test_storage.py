@@ -87,6 +87,21 @@ class BaseStorageTest(object):
     def test_get_last_updated_returns_none_if_there_is_none(self):
         assert_that(self.engine.get_last_updated('foo_bar'), is_(None))
 
+    def test_get_last_updated_after_saving_in_bulk(self):
+        self.engine.create_data_set('foo_bar', 0)
+        with freeze_time('2012-12-12'):
+            self.engine.save_records('foo_bar', [{'foo': 'first'}])
+
+        assert_that(self.engine.get_last_updated('foo_bar'),
+                    is_(d_tz(2012, 12, 12)))
+
+    def test_get_last_updated_returns_none_once_emptied(self):
+        self._save_all('foo_bar', {'foo': 'bar'})
+
+        self.engine.empty_data_set('foo_bar')
+
+        assert_that(self.engine.get_last_updated('foo_bar'), is_(None))
+
     def test_saving_a_record_with_an_id_updates_it(self):
         self._save_all('foo_bar',
                        {'_id': 'first', 'foo': 'bar'},
@@ -97,6 +112,23 @@ class BaseStorageTest(object):
         assert_that(len(results), is_(1))
         assert_that(results, contains(has_entries({'foo': 'foo'})))
 
+    def test_saving_records_in_bulk(self):
+        self.engine.create_data_set('foo_bar', 0)
+
+        errors = self.engine.save_records('foo_bar', [
+            {'_id': 'first', 'foo': 'bar'},
+            {'foo': 'baz'},
+            {'_id': 'first', 'foo': 'foo'}])
+
+        results = self.engine.execute_query('foo_bar', Query.create(
+            sort_by=('foo', 'ascending')))
+
+        assert_that(errors, is_([]))
+        assert_that(results, contains(
+            has_entries({'foo': 'baz',
+                         '_updated_at': instance_of(datetime.datetime)}),
+            has_entries({'_id': 'first', 'foo': 'foo'})))
+
     def test_capped_data_set_is_capped(self):
         self.engine.create_data_set('foo_bar', 1)
 
@@ -202,6 +234,29 @@ class BaseStorageTest(object):
 
         assert_that(len(list(results)), is_(1))
 
+    def test_basic_query_with_fields(self):
+        self._save_all('foo_bar', {'foo': 'bar', 'bar': 'foo'})
+
+        results = self.engine.execute_query('foo_bar', Query.create(
+            fields=['foo']))
+
+        assert_that(results, contains({'foo': 'bar'}))
+
+    def test_basic_query_pages_follow_on_from_each_other(self):
+        self._save_all('foo_bar',
+                       {'_id': 'c', '_timestamp': d_tz(2014, 1, 1)},
+                       {'_id': 'a', '_timestamp': d_tz(2014, 1, 2)},
+                       {'_id': 'b', '_timestamp': d_tz(2014, 1, 1)})
+
+        first = self.engine.execute_query('foo_bar', Query.create(
+            limit=2, paginate=True))
+        second = self.engine.execute_query('foo_bar', Query.create(
+            limit=2, after=(d_tz(2014, 1, 1), 'c')))
+
+        assert_that(first, contains(has_entry('_id', 'b'),
+                                    has_entry('_id', 'c')))
+        assert_that(second, contains(has_entry('_id', 'a')))
+
     # !GROUPED!
     def test_query_grouped_by_field(self):
         self._save_all('foo_bar',
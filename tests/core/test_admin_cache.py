@@ -0,0 +1,139 @@
+from hamcrest import assert_that, is_, calling, raises
+from mock import Mock, patch
+
+from backdrop.core.admin_cache import CachedAdminAPI
+
+
+class SynchronousThread(object):
+    def __init__(self, target, args):
+        self.target = target
+        self.args = args
+
+    def start(self):
+        self.target(*self.args)
+
+
+def data_set_config(name='foo', **kwargs):
+    config = {'name': name, 'data_group': 'group', 'data_type': 'type'}
+    config.update(kwargs)
+    return config
+
+
+@patch('backdrop.core.admin_cache.threading.Thread', SynchronousThread)
+@patch('backdrop.core.admin_cache.time.time')
+class TestCachedAdminAPI(object):
+    def setup(self):
+        self.admin_api = Mock()
+        self.admin_api.get_data_set_by_name.return_value = data_set_config()
+        self.admin_api.get_data_set.return_value = data_set_config()
+        self.cached = CachedAdminAPI(self.admin_api, ttl=60, max_age=300)
+
+    def test_fresh_configs_are_served_from_the_cache(self, now):
+        now.return_value = 0
+        self.cached.get_data_set_by_name('foo')
+        now.return_value = 59
+        config = self.cached.get_data_set_by_name('foo')
+
+        assert_that(config, is_(data_set_config()))
+        assert_that(self.admin_api.get_data_set_by_name.call_count, is_(1))
+
+    def test_configs_are_shared_between_lookups_by_name_and_type(self, now):
+        now.return_value = 0
+        self.cached.get_data_set_by_name('foo')
+        config = self.cached.get_data_set('group', 'type')
+
+        assert_that(config, is_(data_set_config()))
+        assert_that(self.admin_api.get_data_set.called, is_(False))
+
+    def test_stale_configs_are_served_while_they_are_refreshed(self, now):
+        now.return_value = 0
+        self.cached.get_data_set_by_name('foo')
+        self.admin_api.get_data_set_by_name.return_value = \
+            data_set_config(realtime=True)
+
+        now.return_value = 61
+        stale = self.cached.get_data_set_by_name('foo')
+        refreshed = self.cached.get_data_set_by_name('foo')
+
+        assert_that(stale, is_(data_set_config()))
+        assert_that(refreshed, is_(data_set_config(realtime=True)))
+
+    def test_stale_configs_are_kept_if_stagecraft_fails(self, now):
+        now.return_value = 0
+        self.cached.get_data_set_by_name('foo')
+        self.admin_api.get_data_set_by_name.side_effect = IOError()
+
+        now.return_value = 61
+        self.cached.get_data_set_by_name('foo')
+
+        assert_that(self.cached.get_data_set_by_name('foo'),
+                    is_(data_set_config()))
+
+    def test_stale_configs_are_not_served_past_the_max_age(self, now):
+        now.return_value = 0
+        self.cached.get_data_set_by_name('foo')
+        self.admin_api.get_data_set_by_name.side_effect = IOError()
+
+        now.return_value = 61
+        self.cached.get_data_set_by_name('foo')
+        now.return_value = 300
+
+        assert_that(calling(self.cached.get_data_set_by_name).with_args('foo'),
+                    raises(IOError))
+
+    def test_expired_configs_are_fetched_before_they_are_used(self, now):
+        now.return_value = 0
+        self.cached.get_data_set_by_name('foo')
+        self.admin_api.get_data_set_by_name.return_value = \
+            data_set_config(bearer_token='rotated')
+
+        now.return_value = 300
+        config = self.cached.get_data_set_by_name('foo')
+
+        assert_that(config, is_(data_set_config(bearer_token='rotated')))
+
+    def test_stale_configs_are_never_served_if_max_age_is_the_ttl(self, now):
+        cached = CachedAdminAPI(self.admin_api, ttl=60, max_age=60)
+        now.return_value = 0
+        cached.get_data_set_by_name('foo')
+        self.admin_api.get_data_set_by_name.side_effect = IOError()
+
+        now.return_value = 60
+
+        assert_that(calling(cached.get_data_set_by_name).with_args('foo'),
+                    raises(IOError))
+
+    def test_deleted_data_sets_are_forgotten(self, now):
+        now.return_value = 0
+        self.cached.get_data_set_by_name('foo')
+        self.admin_api.get_data_set_by_name.return_value = None
+
+        now.return_value = 61
+        self.cached.get_data_set_by_name('foo')
+
+        assert_that(self.cached.get_data_set_by_name('foo'), is_(None))
+
+    def test_missing_data_sets_are_not_cached(self, now):
+        now.return_value = 0
+        self.admin_api.get_data_set_by_name.return_value = None
+
+        self.cached.get_data_set_by_name('foo')
+        self.cached.get_data_set_by_name('foo')
+
+        assert_that(self.admin_api.get_data_set_by_name.call_count, is_(2))
+
+    def test_preloading_fills_the_cache(self, now):
+        now.return_value = 0
+        self.admin_api.list_data_sets.return_value = [
+            data_set_config('foo'), data_set_config('bar')]
+
+        self.cached.preload()
+
+        assert_that(self.cached.get_data_set_by_name('bar'),
+                    is_(data_set_config('bar')))
+        assert_that(self.admin_api.get_data_set_by_name.called, is_(False))
+
+    def test_other_methods_are_passed_through(self, now):
+        self.cached.get_user('foo@example.com')
+
+        self.admin_api.get_user.assert_called_once_with('foo@example.com')
@@ -0,0 +1,137 @@
+import threading
+import time
+
+from hamcrest import assert_that, is_, contains, calling, raises
+from mock import Mock, patch
+
+from backdrop.core.coalescing import QueryCoalescer
+from backdrop.core.query import Query
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("Timed out waiting")
+        time.sleep(0.001)
+
+
+class TestQueryCoalescer(object):
+    def setup(self):
+        self.data_set = Mock()
+        self.data_set.name = 'foo'
+        self.data_set.get_version.return_value = 1
+        self.coalescer = QueryCoalescer()
+
+        self.release = threading.Event()
+        self.calls = []
+
+    def execute(self, data_set, query):
+        self.calls.append(query)
+        self.release.wait(5)
+        return [{'_count': len(self.calls)}]
+
+    def run_concurrently(self, queries, waiting):
+        results = [None] * len(queries)
+
+        def run(index, query):
+            results[index] = self.coalescer.execute(
+                self.data_set, query, self.execute)
+
+        threads = [threading.Thread(target=run, args=(i, query))
+                   for i, query in enumerate(queries)]
+        threads[0].start()
+        wait_for(lambda: len(self.calls) == 1)
+        for thread in threads[1:]:
+            thread.start()
+        wait_for(lambda: sum(
+            flight.waiters for flight in self.coalescer._flights.values()
+        ) == waiting)
+
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    @patch('backdrop.core.coalescing.statsd')
+    def test_identical_queries_share_one_execution(self, statsd):
+        # Mock's call counting is not thread safe
+        saved = []
+        statsd.incr.side_effect = lambda *args, **kwargs: saved.append(
+            (args, kwargs))
+
+        results = self.run_concurrently([Query.create(limit=1)] * 3, 2)
+
+        assert_that(len(self.calls), is_(1))
+        assert_that(results, contains(*[[{'_count': 1}]] * 3))
+        assert_that(saved, is_(
+            [(('query_coalescing.saved',), {'data_set': 'foo'})] * 2))
+
+    def test_different_queries_are_executed_separately(self):
+        self.release.set()
+        self.coalescer.execute(self.data_set, Query.create(), self.execute)
+        self.coalescer.execute(self.data_set, Query.create(limit=1),
+                               self.execute)
+
+        assert_that(len(self.calls), is_(2))
+
+    def test_finished_queries_are_not_shared(self):
+        self.release.set()
+        self.coalescer.execute(self.data_set, Query.create(), self.execute)
+        data = self.coalescer.execute(self.data_set, Query.create(),
+                                      self.execute)
+
+        assert_that(data, is_([{'_count': 2}]))
+        assert_that(self.coalescer._flights, is_({}))
+
+    def test_queries_on_a_newer_version_are_not_shared(self):
+        self.coalescer.execute(self.data_set, Query.create(),
+                               lambda data_set, query: [])
+        self.data_set.get_version.return_value = 2
+
+        def execute(data_set, query):
+            self.calls.append(query)
+            return []
+
+        self.coalescer.execute(self.data_set, Query.create(), execute)
+
+        assert_that(len(self.calls), is_(1))
+
+    @patch('backdrop.core.coalescing.statsd')
+    def test_errors_are_raised_in_every_waiting_request(self, statsd):
+        errors = []
+
+        def execute(data_set, query):
+            self.calls.append(query)
+            self.release.wait(5)
+            raise ValueError('boom')
+
+        def run():
+            try:
+                self.coalescer.execute(self.data_set, Query.create(),
+                                       execute)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(3)]
+        threads[0].start()
+        wait_for(lambda: len(self.calls) == 1)
+        for thread in threads[1:]:
+            thread.start()
+        wait_for(lambda: self.coalescer._flights.values()[0].waiters == 2)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+
+        assert_that(len(self.calls), is_(1))
+        assert_that(len(errors), is_(3))
+        assert_that(self.coalescer._flights, is_({}))
+
+    def test_errors_are_raised_for_a_single_request(self):
+        def execute(data_set, query):
+            raise ValueError('boom')
+
+        assert_that(
+            calling(self.coalescer.execute).with_args(
+                self.data_set, Query.create(), execute),
+            raises(ValueError))
@@ -6,6 +6,7 @@ from mock import Mock, patch
 from freezegun import freeze_time
 
 from backdrop.core import data_set
+from backdrop.core.pagination import decode_cursor
 from backdrop.core.query import Query
 from backdrop.core.timeseries import WEEK, MONTH
 from backdrop.core.errors import ValidationError
@@ -29,6 +30,7 @@ def mock_repository():
 class BaseDataSetTest(object):
     def setup_config(self, additional_config={}):
         self.mock_storage = Mock()
+        self.mock_storage.save_records.return_value = []
         base_config = {
             'name': 'test_data_set',
             'data_group': 'group',
@@ -87,14 +89,14 @@ class TestDataSet_store(BaseDataSetTest):
 
     def test_storing_a_simple_record(self):
         self.data_set.store([{'foo': 'bar'}])
-        self.mock_storage.save_record.assert_called_with(
-            'test_data_set', {'foo': 'bar'})
+        self.mock_storage.save_records.assert_called_with(
+            'test_data_set', [{'foo': 'bar'}])
 
     def test_id_gets_automatically_generated_if_auto_ids_are_set(self):
         self.setup_config({'auto_ids': ['foo']})
         self.data_set.store([{'foo': 'bar'}])
-        self.mock_storage.save_record.assert_called_with(
-            'test_data_set', match(has_entry('_id', 'YmFy')))
+        self.mock_storage.save_records.assert_called_with(
+            'test_data_set', match(contains(has_entry('_id', 'YmFy'))))
 
     def test_timestamp_gets_parsed(self):
         """Test that timestamps get parsed
@@ -102,9 +104,9 @@ class TestDataSet_store(BaseDataSetTest):
         see the backdrop.core.records module
         """
         self.data_set.store([{'_timestamp': '2012-12-12T00:00:00+00:00'}])
-        self.mock_storage.save_record.assert_called_with(
+        self.mock_storage.save_records.assert_called_with(
             'test_data_set',
-            match(has_entry('_timestamp',  d_tz(2012, 12, 12))))
+            match(contains(has_entry('_timestamp',  d_tz(2012, 12, 12)))))
 
     def test_record_gets_validated(self):
         errors = self.data_set.store([{'_foo': 'bar'}])
@@ -123,11 +125,42 @@ class TestDataSet_store(BaseDataSetTest):
 
     def test_period_keys_are_added(self):
         self.data_set.store([{'_timestamp': '2012-12-12T00:00:00+00:00'}])
-        self.mock_storage.save_record.assert_called_with(
+        self.mock_storage.save_records.assert_called_with(
             'test_data_set',
-            match(has_entry('_day_start_at', d_tz(2012, 12, 12))))
+            match(contains(has_entry('_day_start_at', d_tz(2012, 12, 12)))))
 
-    @patch('backdrop.core.storage.mongo.MongoStorageEngine.save_record')
+    def test_storage_errors_are_returned(self):
+        self.mock_storage.save_records.return_value = [
+            'record 0 could not be saved: duplicate key']
+
+        errors = self.data_set.store([{'foo': 'bar'}])
+
+        assert_that(errors,
+                    is_(['record 0 could not be saved: duplicate key']))
+
+    def test_storing_records_bumps_the_version(self):
+        self.data_set.store([{'foo': 'bar'}])
+        self.mock_storage.bump_version.assert_called_with('test_data_set')
+
+    def test_invalid_records_do_not_bump_the_version(self):
+        self.data_set.store([{'_foo': 'bar'}])
+        assert_that(self.mock_storage.bump_version.called, is_(False))
+
+    def test_emptying_bumps_the_version(self):
+        self.data_set.empty()
+        self.mock_storage.bump_version.assert_called_with('test_data_set')
+
+    def test_version_is_read_again_after_a_write(self):
+        self.mock_storage.get_version.return_value = 1
+        self.data_set.get_version()
+        self.data_set.get_version()
+        assert_that(self.mock_storage.get_version.call_count, is_(1))
+
+        self.data_set.store([{'foo': 'bar'}])
+        self.data_set.get_version()
+        assert_that(self.mock_storage.get_version.call_count, is_(2))
+
+    @patch('backdrop.core.storage.mongo.MongoStorageEngine.save_records')
     @patch('backdrop.core.records.add_period_keys')
     def test_store_returns_array_of_errors_if_errors(
             self,
@@ -179,7 +212,7 @@ class TestDataSet_store(BaseDataSetTest):
         assert_that(add_period_keys_patch.called, is_(False))
         assert_that(save_record_patch.called, is_(False))
 
-    @patch('backdrop.core.storage.mongo.MongoStorageEngine.save_record')
+    @patch('backdrop.core.storage.mongo.MongoStorageEngine.save_records')
     @patch('backdrop.core.records.add_period_keys')
     def test_store_does_not_get_auto_id_type_error_due_to_datetime(
             self,
@@ -244,6 +277,79 @@ class TestDataSet_execute_query(BaseDataSetTest):
         assert_that(second_last_updated, is_(3))
         assert_that(self.mock_storage.get_last_updated.call_count, 1)
 
+    def test_queries_may_be_read_from_secondaries(self):
+        self.mock_storage.execute_query.return_value = []
+
+        self.data_set.execute_query(Query.create())
+
+        self.mock_storage.execute_query.assert_called_with(
+            'test_data_set', Query.create(), secondary_ok=True, limits={})
+
+    def test_realtime_queries_are_read_from_the_primary(self):
+        self.setup_config({'realtime': True})
+        self.mock_storage.execute_query.return_value = []
+
+        self.data_set.execute_query(Query.create())
+
+        self.mock_storage.execute_query.assert_called_with(
+            'test_data_set', Query.create(), secondary_ok=False, limits={})
+
+    def test_queries_are_run_with_the_data_sets_query_limits(self):
+        self.setup_config({'max_query_time_ms': 500,
+                           'max_query_results': None})
+        self.mock_storage.execute_query.return_value = []
+
+        self.data_set.execute_query(Query.create())
+
+        self.mock_storage.execute_query.assert_called_with(
+            'test_data_set', Query.create(), secondary_ok=True,
+            limits={'max_time_ms': 500})
+
+    def test_raw_queries_can_be_streamed(self):
+        self.mock_storage.stream_query.return_value = iter([
+            {'_id': 'a', 'foo': 'bar', '_timestamp': d(2014, 1, 1)}])
+
+        results = self.data_set.stream_query(
+            Query.create(fields=['foo']), 100)
+
+        assert_that(list(results), contains({'foo': 'bar'}))
+        self.mock_storage.stream_query.assert_called_with(
+            'test_data_set', Query.create(fields=['foo']), 100,
+            secondary_ok=True, limits={})
+
+    def test_full_pages_have_a_cursor_for_the_next_page(self):
+        self.mock_storage.execute_query.return_value = [
+            {'_id': 'a', 'foo': 'bar', '_timestamp': d(2014, 1, 1)},
+            {'_id': 'b', 'foo': 'baz', '_timestamp': d(2014, 1, 2)}]
+
+        data, next_cursor = self.data_set.execute_page(
+            Query.create(limit=2, fields=['foo'], paginate=True))
+
+        assert_that(data, contains({'foo': 'bar'}, {'foo': 'baz'}))
+        assert_that(decode_cursor(next_cursor),
+                    is_((d_tz(2014, 1, 2), 'b')))
+
+    def test_the_last_page_has_no_cursor(self):
+        self.mock_storage.execute_query.return_value = [
+            {'_id': 'a', 'foo': 'bar', '_timestamp': d(2014, 1, 1)}]
+
+        _, next_cursor = self.data_set.execute_page(
+            Query.create(limit=2, paginate=True))
+
+        assert_that(next_cursor, is_(None))
+
+    def test_unlimited_queries_cannot_be_paginated(self):
+        assert_raises(ValueError, self.data_set.execute_page,
+                      Query.create(paginate=True))
+
+    def test_limited_queries_are_not_paginated_unless_asked(self):
+        assert_raises(ValueError, self.data_set.execute_page,
+                      Query.create(limit=2))
+
+    def test_grouped_queries_cannot_be_streamed(self):
+        assert_raises(ValueError, self.data_set.stream_query,
+                      Query.create(group_by=['foo']), 100)
+
     def test_period_query_fails_when_months_do_not_start_on_the_1st(self):
         self.mock_storage.execute_query.return_value = [
             {"_month_start_at": d(2013, 1, 7, 0, 0, 0), "_count": 3},
@@ -279,6 +385,86 @@ class TestDataSet_execute_query(BaseDataSetTest):
             has_entries({"_start_at": d_tz(2013, 2, 11), "_count": 0}),
         ))
 
+    def test_backward_duration_query_is_shifted_to_the_latest_data(self):
+        self.mock_storage.execute_query.return_value = [
+            {"_week_start_at": d(2013, 12, 30), "_count": 5},
+            {"_week_start_at": d(2014, 1, 6), "_count": 3},
+        ]
+        query = Query.create(period=WEEK, duration=3,
+                             end_at=d_tz(2014, 1, 27))
+
+        result = self.data_set.execute_query(query)
+
+        self.mock_storage.execute_query.assert_called_once_with(
+            'test_data_set',
+            query._replace(start_at=d_tz(2013, 12, 23)),
+            secondary_ok=True, limits={})
+        assert_that(result, contains(
+            has_entries({"_start_at": d_tz(2013, 12, 23), "_count": 0}),
+            has_entries({"_start_at": d_tz(2013, 12, 30), "_count": 5}),
+            has_entries({"_start_at": d_tz(2014, 1, 6), "_count": 3}),
+        ))
+
+    def test_forward_duration_query_is_shifted_to_the_earliest_data(self):
+        self.mock_storage.execute_query.return_value = [
+            {"_week_start_at": d(2014, 1, 20), "_count": 4},
+            {"_week_start_at": d(2014, 2, 3), "_count": 2},
+            {"_week_start_at": d(2014, 2, 10), "_count": 9},
+        ]
+        query = Query.create(period=WEEK, duration=3,
+                             start_at=d_tz(2014, 1, 6))
+
+        result = self.data_set.execute_query(query)
+
+        self.mock_storage.execute_query.assert_called_once_with(
+            'test_data_set',
+            query._replace(end_at=d_tz(2014, 2, 10)),
+            secondary_ok=True, limits={})
+        assert_that(result, contains(
+            has_entries({"_start_at": d_tz(2014, 1, 20), "_count": 4}),
+            has_entries({"_start_at": d_tz(2014, 1, 27), "_count": 0}),
+            has_entries({"_start_at": d_tz(2014, 2, 3), "_count": 2}),
+        ))
+
+    def test_duration_query_with_data_at_the_edge_is_not_shifted(self):
+        self.mock_storage.execute_query.return_value = [
+            {"_week_start_at": d(2013, 12, 30), "_count": 5},
+            {"_week_start_at": d(2014, 1, 20), "_count": 1},
+        ]
+
+        result = self.data_set.execute_query(Query.create(
+            period=WEEK, duration=2, end_at=d_tz(2014, 1, 27)))
+
+        assert_that(result, contains(
+            has_entries({"_start_at": d_tz(2014, 1, 13), "_count": 0}),
+            has_entries({"_start_at": d_tz(2014, 1, 20), "_count": 1}),
+        ))
+
+    def test_grouped_duration_query_only_has_groups_in_the_window(self):
+        self.mock_storage.execute_query.return_value = [
+            {"some_group": "a", "_week_start_at": d(2013, 12, 23),
+             "_count": 7},
+            {"some_group": "b", "_week_start_at": d(2014, 1, 6),
+             "_count": 3},
+            {"some_group": "b", "_week_start_at": d(2014, 1, 13),
+             "_count": 2},
+        ]
+
+        result = self.data_set.execute_query(Query.create(
+            period=WEEK, group_by=['some_group'], duration=3,
+            end_at=d_tz(2014, 1, 27)))
+
+        assert_that(self.mock_storage.execute_query.call_count, is_(1))
+        assert_that(result, contains(has_entries({
+            "some_group": "b",
+            "_count": 5,
+            "values": contains(
+                has_entries({"_start_at": d_tz(2013, 12, 30), "_count": 0}),
+                has_entries({"_start_at": d_tz(2014, 1, 6), "_count": 3}),
+                has_entries({"_start_at": d_tz(2014, 1, 13), "_count": 2}),
+            ),
+        })))
+
     def test_week_and_group_query(self):
         self.mock_storage.execute_query.return_value = [
             {"some_group": "val1", "_week_start_at": d(2013, 1, 7), "_count": 1},
@@ -1,6 +1,12 @@
+import copy
+import itertools
+import json
+import random
+
 from hamcrest import assert_that, is_, contains, has_entries, has_entry
-from backdrop.core.nested_merge import nested_merge, group_by, \
-    apply_collect_to_group, collect_all_values
+from backdrop.core.nested_merge import nested_merge, \
+    apply_collect_to_group, collect_all_values, PreReduced, apply_collect, \
+    remove_keys
 from backdrop.core.timeseries import WEEK, MONTH
 
 
@@ -23,6 +29,73 @@ def datum(name=None, version=None, place=None, age=None, stamp=None, count=1):
     return result
 
 
+# The way nested_merge used to group results, a whole step at a time. It is
+# kept to check that nested_merge still gives the same results.
+
+def values_of(keys):
+    return lambda obj: tuple(obj[key] for key in keys)
+
+
+def group_by(data, keys):
+    """Recursively group an array of results by a list of keys
+
+    data: a list of dictionaries as returned by MongoDriver.group
+    keys: a list of combinations of keys to group by
+    """
+    key_combo = keys[0]
+    getter = values_of(key_combo)
+    data = sorted(data, key=getter)
+
+    if len(keys) > 1:
+        grouped_data = []
+        for values, subgroups in itertools.groupby(data, getter):
+            # create a dict containing key value pairs and _subgroup
+            result = dict(zip(key_combo, values))
+            result['_subgroup'] = group_by(
+                remove_keys_from_all(subgroups, key_combo),
+                keys[1:]
+            )
+            grouped_data.append(result)
+        data = grouped_data
+
+    return data
+
+
+def remove_keys_from_all(groups, keys):
+    """Remove keys from each group in a list of groups
+
+    groups: a list of groups (dictionaries)
+    key: the key to remove
+    """
+    return [remove_keys(group, keys) for group in groups]
+
+
+def apply_counts(groups):
+    """Add the _count and _group_count fields to a list of groups"""
+    return [
+        apply_counts_to_group(group)
+        for group in groups
+    ]
+
+
+def apply_counts_to_group(group):
+    """Add the _count and _group_count fields to a group"""
+    if '_subgroup' in group:
+        subgroups = apply_counts(group['_subgroup'])
+        group['_subgroup'] = subgroups
+        group['_count'] = sum(subgroup['_count'] for subgroup in subgroups)
+        group['_group_count'] = len(subgroups)
+    return group
+
+
+def sort_subgroups(data, keys):
+    key_combo = keys[0]
+    if len(keys) > 1:
+        for i, group in enumerate(data):
+            data[i]['_subgroup'] = sort_subgroups(group['_subgroup'], keys[1:])
+    return sorted(data, key=values_of(key_combo))
+
+
 class TestNestedMerge(object):
 
     def test_one_level_grouping_with_collect(self):
@@ -265,6 +338,72 @@ class TestApplyCollectToGroup(object):
                                              }),
                                          )))
 
+    def test_double_level_collect_of_pre_reduced_values(self):
+        group = {'name': 'Joanne', '_subgroup': [
+            {'place': 'Kettering',
+             'age': PreReduced({'sum': 90, 'mean': (90, 2)})},
+            {'place': 'Keswick',
+             'age': PreReduced({'sum': 89, 'mean': (89, 2)})},
+        ]}
+
+        collected = apply_collect_to_group(
+            group, [('age', 'sum'), ('age', 'mean')])
+
+        assert_that(collected, has_entries({
+            'age:sum': 179,
+            'age:mean': 44.75,
+        }))
+        assert_that(collected, has_entry('_subgroup',
+                                         contains(
+                                             has_entries({
+                                                 'age:sum': 90,
+                                                 'age:mean': 45,
+                                             }),
+                                             has_entries({
+                                                 'age:sum': 89,
+                                                 'age:mean': 44.5,
+                                             }),
+                                         )))
+
+
+class TestCollectPartials(object):
+    def test_partial_results_are_merged_up_the_hierarchy(self):
+        data = [
+            datum(name='Jill', place='Kent', age=[1, 3]),
+            datum(name='Jill', place='Bath', age=[2]),
+        ]
+
+        results = nested_merge([['name'], ['place']],
+                               [('age', 'mean'), ('age', 'count')], data)
+
+        assert_that(results[0], has_entries({'age:mean': 2.0,
+                                             'age:count': 3}))
+
+    def test_mean_of_no_values_is_none(self):
+        # Reducing the raw values used to raise ZeroDivisionError
+        results = nested_merge([['name']], [('age', 'mean')],
+                               [datum(name='Jill', age=[])])
+
+        assert_that(results[0]['age:mean'], is_(None))
+        assert_that(PreReduced({'mean': (0, 0)}).reduce('mean'), is_(None))
+
+    def test_parent_sums_add_the_sums_of_their_subgroups(self):
+        # Floats are no longer summed one value at a time across every
+        # subgroup, which gave sum([0.1, 0.1, 0.2, 0.7]) == 1.1
+        results = nested_merge([['name'], ['place']], [('age', 'sum')], [
+            datum(name='Jill', place='Bath', age=[0.1, 0.1]),
+            datum(name='Jill', place='Kent', age=[0.2, 0.7]),
+        ])
+
+        assert_that(results[0]['age:sum'], is_((0.1 + 0.1) + (0.2 + 0.7)))
+        assert_that(results[0]['age:sum'], is_(1.0999999999999999))
+
+    def test_raw_values_become_partial_results(self):
+        pre_reduced = PreReduced.from_values([1, 2, 2], ['count', 'set'])
+
+        assert_that(pre_reduced.partials,
+                    is_({'count': 3, 'set': set([1, 2])}))
+
 
 class TestCollectAllValues(object):
     def test_single_level_collect(self):
@@ -282,3 +421,70 @@ class TestCollectAllValues(object):
             ]
         }
         assert_that(collect_all_values(group, 'age'), [1, 2, 3, 4])
+
+
+def merge_by_grouping(keys, collect, data):
+    if len(keys) > 1:
+        data = group_by(data, keys)
+        data = apply_counts(data)
+
+    data = apply_collect(data, collect)
+    return sort_subgroups(data, keys)
+
+
+class TestNestedMergeMatchesGrouping(object):
+    KEYS = [
+        [['name']],
+        [['name'], ['place']],
+        [['name', 'version'], ['place']],
+        [['name'], ['version'], ['place']],
+    ]
+    COLLECT = [
+        [],
+        [('age', 'sum')],
+        [('age', 'default'), ('age', 'mean')],
+        [('age', 'count'), ('age', 'set'), ('age', 'sum')],
+    ]
+
+    def random_data(self, rng):
+        values = ['a', 'b', 'c', 0, 1, 2.5]
+        return [datum(name=rng.choice(values), version=rng.choice(values),
+                      place=rng.choice(values),
+                      # Whole numbers sum the same in any order
+                      age=[rng.choice([1, 2, 3, 7])
+                           for _ in range(rng.randint(1, 3))],
+                      count=rng.choice([1, 2, 0.5]))
+                for _ in range(rng.randint(1, 30))]
+
+    def test_random_merges_are_identical(self):
+        rng = random.Random(24)
+        for _ in range(500):
+            keys = rng.choice(self.KEYS)
+            collect = rng.choice(self.COLLECT)
+            data = self.random_data(rng)
+            original = copy.deepcopy(data)
+
+            expected = merge_by_grouping(keys, collect, copy.deepcopy(data))
+            results = nested_merge(keys, collect, data)
+
+            assert_that(json.dumps(results, sort_keys=True),
+                        is_(json.dumps(expected, sort_keys=True)))
+            assert_that(data, is_(original))
+
+    def test_pre_reduced_merges_are_identical(self):
+        def pre_reduced(value):
+            return PreReduced({'sum': value, 'mean': (value, 1),
+                               'set': set([value])})
+
+        rng = random.Random(25)
+        for _ in range(100):
+            keys = rng.choice(self.KEYS[1:])
+            data = [dict(result, age=pre_reduced(result['age'][0]))
+                    for result in self.random_data(rng)]
+            collect = [('age', 'sum'), ('age', 'mean'), ('age', 'default')]
+
+            expected = merge_by_grouping(keys, collect, data)
+            results = nested_merge(keys, collect, data)
+
+            assert_that(json.dumps(results, sort_keys=True),
+                        is_(json.dumps(expected, sort_keys=True)))
@@ -1,6 +1,6 @@
 from datetime import datetime
 from freezegun import freeze_time
-from hamcrest import assert_that, is_
+from hamcrest import assert_that, is_, is_not
 import pytz
 from unittest import TestCase
 
@@ -11,6 +11,20 @@ from tests.support.test_helpers import d_tz
 
 
 class TestBuild_query(TestCase):
+    def test_cache_key_ignores_the_order_of_fields_and_collects(self):
+        query = Query.create(fields=['a', 'b'],
+                             collect=[('c', 'sum'), ('d', 'set')])
+        same_query = Query.create(fields=['b', 'a'],
+                                  collect=[('d', 'set'), ('c', 'sum')])
+
+        assert_that(query.cache_key, is_(same_query.cache_key))
+
+    def test_cache_key_depends_on_the_time_range(self):
+        query = Query.create(start_at=d_tz(2014, 1, 1))
+        other_query = Query.create(start_at=d_tz(2014, 1, 2))
+
+        assert_that(query.cache_key, is_not(other_query.cache_key))
+
     @freeze_time('2014, 1, 09 00:00:00')
     def test_no_end_at_means_now(self):
         query = Query.create(
@@ -0,0 +1,79 @@
+from hamcrest import assert_that, is_
+from mock import Mock
+
+from pymongo.errors import DuplicateKeyError
+
+from backdrop.core.query import Query
+from backdrop.core.query_cache import QueryCache, InProcessBackend, \
+    MongoBackend
+
+
+class TestQueryCache(object):
+    def setup(self):
+        self.data_set = Mock()
+        self.data_set.name = 'foo'
+        self.data_set.get_version.return_value = 1
+        self.data_set.execute_query.return_value = ({'_count': 1},)
+        self.cache = QueryCache(InProcessBackend())
+
+    def test_results_are_cached(self):
+        self.cache.execute_query(self.data_set, Query.create())
+        data = self.cache.execute_query(self.data_set, Query.create())
+
+        assert_that(data, is_([{'_count': 1}]))
+        assert_that(self.data_set.execute_query.call_count, is_(1))
+
+    def test_different_queries_are_cached_separately(self):
+        self.cache.execute_query(self.data_set, Query.create())
+        self.cache.execute_query(self.data_set, Query.create(limit=1))
+
+        assert_that(self.data_set.execute_query.call_count, is_(2))
+
+    def test_writes_to_the_data_set_invalidate_results(self):
+        self.cache.execute_query(self.data_set, Query.create())
+        self.data_set.get_version.return_value = 2
+        self.cache.execute_query(self.data_set, Query.create())
+
+        assert_that(self.data_set.execute_query.call_count, is_(2))
+
+
+class TestInProcessBackend(object):
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = InProcessBackend(max_entries=2)
+
+        cache.set('a', '1')
+        cache.set('b', '2')
+        cache.get('a')
+        cache.set('c', '3')
+
+        assert_that(cache.get('a'), is_('1'))
+        assert_that(cache.get('b'), is_(None))
+        assert_that(cache.get('c'), is_('3'))
+
+    def test_values_larger_than_the_cache_are_not_stored(self):
+        cache = InProcessBackend(max_bytes=2)
+
+        cache.set('a', '123')
+
+        assert_that(cache.get('a'), is_(None))
+
+
+class TestMongoBackend(object):
+    def setup(self):
+        self.collection = Mock()
+        self.cache = MongoBackend(self.collection, max_value_bytes=10)
+
+    def test_values_are_read_from_the_collection(self):
+        self.collection.find_one.return_value = {'_id': 'a', 'value': '1'}
+
+        assert_that(self.cache.get('a'), is_('1'))
+
+    def test_values_cached_by_another_process_are_left_alone(self):
+        self.collection.insert.side_effect = DuplicateKeyError('a')
+
+        self.cache.set('a', '1')
+
+    def test_values_too_large_for_a_document_are_not_stored(self):
+        self.cache.set('a', '12345678901')
+
+        assert_that(self.collection.insert.called, is_(False))
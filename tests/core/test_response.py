@@ -42,12 +42,12 @@ class TestPeriodFlatData(TestCase):
             }
         ]
 
-        series = fill_group_by_permutations(start=datetime.datetime(2013, 1, 1, 0, 0, tzinfo=pytz.UTC),
-                                            end=datetime.datetime(2013, 2, 1, 0, 0, tzinfo=pytz.UTC),
-                                            period=MONTH,
-                                            data=data,
-                                            default={"_count": 0},
-                                            group_by=['paymentStatus', 'paymentThing', 'no'])
+        series = list(fill_group_by_permutations(start=datetime.datetime(2013, 1, 1, 0, 0, tzinfo=pytz.UTC),
+                                                 end=datetime.datetime(2013, 2, 1, 0, 0, tzinfo=pytz.UTC),
+                                                 period=MONTH,
+                                                 data=data,
+                                                 default={"_count": 0},
+                                                 group_by=['paymentStatus', 'paymentThing', 'no']))
 
         assert_that(series, has_length(18))
 
@@ -78,12 +78,12 @@ class TestPeriodFlatData(TestCase):
             },
         ]
 
-        series = fill_group_by_permutations(start=datetime.datetime(2013, 1, 1, 0, 0, tzinfo=pytz.UTC),
-                                            end=datetime.datetime(2013, 3, 1, 0, 0, tzinfo=pytz.UTC),
-                                            period=MONTH,
-                                            data=data,
-                                            default={"_count": 0},
-                                            group_by=['paymentStatus', 'paymentThing', 'no'])
+        series = list(fill_group_by_permutations(start=datetime.datetime(2013, 1, 1, 0, 0, tzinfo=pytz.UTC),
+                                                 end=datetime.datetime(2013, 3, 1, 0, 0, tzinfo=pytz.UTC),
+                                                 period=MONTH,
+                                                 data=data,
+                                                 default={"_count": 0},
+                                                 group_by=['paymentStatus', 'paymentThing', 'no']))
 
         assert_that(series, has_length(16))
 
@@ -1,7 +1,10 @@
 from unittest import TestCase
 import datetime
+import random
+from dateutil.relativedelta import relativedelta, MO
 from hamcrest import assert_that, is_, contains
-from backdrop.core.timeseries import timeseries, HOUR, DAY, WEEK, MONTH, QUARTER, YEAR
+import pytz
+from backdrop.core.timeseries import timeseries, HOUR, DAY, WEEK, MONTH, QUARTER, YEAR, PERIODS
 from tests.support.test_helpers import d, d_tz
 
 
@@ -471,3 +474,58 @@ class TestYear(TestCase):
             (d_tz(2013, 1, 1), d_tz(2014, 1, 1)),
             (d_tz(2014, 1, 1), d_tz(2015, 1, 1)),
         ))
+
+
+def relativedelta_start(period, timestamp):
+    """Period starts as they were found before they were computed with
+    integer arithmetic"""
+    day = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period is WEEK:
+        return day + relativedelta(weekday=MO(-1))
+    if period is QUARTER:
+        month = next(quarter for quarter in [10, 7, 4, 1]
+                     if timestamp.month >= quarter)
+        return day.replace(month=month, day=1)
+    return period.start(timestamp)
+
+
+def relativedelta_range(period, start, end):
+    """Period ranges as they were stepped before, a delta at a time"""
+    _start = period.start(start).replace(tzinfo=pytz.UTC)
+    _end = period.end(end).replace(tzinfo=pytz.UTC)
+    while _start < _end:
+        yield (_start, _start + period.delta)
+        _start += period.delta
+
+
+class TestPeriodsMatchRelativedelta(TestCase):
+    def random_timestamps(self, count):
+        generator = random.Random(1)
+        london = pytz.timezone('Europe/London')
+        for _ in range(count):
+            timestamp = datetime.datetime(
+                generator.randint(1971, 2036), generator.randint(1, 12),
+                generator.randint(1, 28), generator.randint(0, 23),
+                generator.choice([0, 0, 30, 59]), generator.choice([0, 1]))
+            zone = generator.choice([None, pytz.UTC, london])
+            yield zone.localize(timestamp) if zone else timestamp
+
+    def test_starts_are_unchanged(self):
+        for timestamp in self.random_timestamps(5000):
+            for period in PERIODS:
+                start = period.start(timestamp)
+                expected = relativedelta_start(period, timestamp)
+                assert_that(start, is_(expected))
+                assert_that(repr(start), is_(repr(expected)))
+
+    def test_ranges_are_unchanged(self):
+        generator = random.Random(2)
+        for start in self.random_timestamps(500):
+            start = start.replace(tzinfo=pytz.UTC)
+            for period in PERIODS:
+                end = start + datetime.timedelta(
+                    days=0 if period is HOUR else generator.randint(0, 400),
+                    hours=generator.randint(0, 50))
+                assert_that(list(period.range(start, end)),
+                            is_(list(relativedelta_range(period, start, end))),
+                            '{0} {1} {2}'.format(period.name, start, end))
@@ -1,8 +1,12 @@
 import unittest
-from hamcrest import assert_that, equal_to
+from dateutil import parser
+from hamcrest import assert_that, equal_to, is_, same_instance
+from mock import patch
 import pytz
 import datetime
-from backdrop.core.timeutils import parse_time_as_utc, as_seconds
+from backdrop.core import timeutils
+from backdrop.core.timeutils import parse_time_as_utc, as_seconds, \
+    parse_time
 from tests.support.test_helpers import d_tz, d
 
 
@@ -36,3 +40,50 @@ class TransformTimesTestCase(unittest.TestCase):
         assert_that(
             as_seconds(datetime.datetime(2013, 11, 29, 15, 57, 43, 662372)),
             equal_to(1385740663.0))
+
+
+class ParseTimeTestCase(unittest.TestCase):
+
+    def test_iso_8601_timestamps_are_parsed_as_dateutil_does(self):
+        for time_string in ['2012-12-12T12:12:12Z',
+                            '2012-12-12T12:12:12+00:00',
+                            '2012-12-12T12:12:12-00:00',
+                            '2012-12-12T12:12:12+05:30',
+                            '2012-12-12T12:12:12-0800',
+                            '2012-12-12T12:12:12.25Z',
+                            '2012-12-12T12:12:12.123456+01:00',
+                            '2012-12-12T12:12:12',
+                            u'2012-02-29T00:00:00Z']:
+            parsed = parse_time(time_string)
+            expected = parser.parse(time_string)
+
+            assert_that(parsed, equal_to(expected))
+            assert_that(parsed.utcoffset(), equal_to(expected.utcoffset()))
+
+    def test_other_formats_fall_back_to_dateutil(self):
+        assert_that(parse_time('12 December 2012 12:12'),
+                    equal_to(datetime.datetime(2012, 12, 12, 12, 12)))
+
+    def test_invalid_dates_raise_value_error(self):
+        self.assertRaises(ValueError, parse_time, '2013-02-29T00:00:00Z')
+        self.assertRaises(ValueError, parse_time, '2013-01-01T24:00:00Z')
+
+    def test_parsed_timestamps_are_remembered(self):
+        first = parse_time('2012-12-12T12:12:12Z')
+
+        assert_that(parse_time('2012-12-12T12:12:12Z'), same_instance(first))
+
+    def test_remembered_timestamps_are_bounded(self):
+        with patch.object(timeutils, '_MAX_PARSED_TIMES', 2):
+            timeutils._parsed_times.clear()
+            parse_time('2012-12-12T12:12:12Z')
+            parse_time('2012-12-13T12:12:12Z')
+            parse_time('2012-12-14T12:12:12Z')
+
+            assert_that(len(timeutils._parsed_times), is_(1))
+
+    def test_dateutil_results_are_not_remembered(self):
+        timeutils._parsed_times.clear()
+        parse_time('12 December 2012 12:12')
+
+        assert_that(len(timeutils._parsed_times), is_(0))
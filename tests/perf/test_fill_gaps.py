@@ -1,9 +1,14 @@
 import cProfile
 import cPickle as pickle
+import datetime
+import resource
+from itertools import islice
+
+import pytz
 
 from hamcrest import assert_that, equal_to
 
-from backdrop.core.timeseries import fill_group_by_permutations
+from backdrop.core.timeseries import fill_group_by_permutations, WEEK
 
 
 def run_and_assert(base_path):
@@ -13,7 +18,7 @@ def run_and_assert(base_path):
 
     profile = cProfile.Profile()
     profile.enable()
-    result = fill_group_by_permutations(*args, **kwargs)
+    result = list(fill_group_by_permutations(*args, **kwargs))
     profile.disable()
     profile.print_stats()
 
@@ -26,3 +31,22 @@ def test_filling_gaps_single_group():
 
 def test_filling_gaps_multi_group():
     run_and_assert('./tests/fixtures/perf/multi-group')
+
+
+def test_filling_gaps_is_memory_bounded():
+    # A billion combinations of group values for each of 52 weeks
+    start = datetime.datetime(2014, 1, 6, tzinfo=pytz.UTC)
+    data = [{'_start_at': start, '_end_at': start + WEEK.delta, '_count': 1,
+             'channel': i, 'region': i, 'service': i} for i in range(1000)]
+
+    max_rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    series = fill_group_by_permutations(
+        start, start + 52 * WEEK.delta, WEEK, data, {'_count': 0},
+        ['channel', 'region', 'service'])
+    first = list(islice(series, 10000))
+    max_rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    assert_that(len(first), equal_to(10000))
+    # ru_maxrss is in kilobytes
+    assert_that(max_rss_after - max_rss_before < 50 * 1024,
+                equal_to(True))
@@ -0,0 +1,65 @@
+import cProfile
+import datetime
+import json
+
+from bson import ObjectId
+from hamcrest import assert_that, equal_to
+from mock import patch
+
+from backdrop.core.timeutils import as_utc
+from backdrop.read.serializer import ResponseEncoder
+from tests.support.test_helpers import d_tz
+
+
+class JsonEncoder(json.JSONEncoder):
+    """The encoder the read API used before ResponseEncoder"""
+
+    def default(self, obj):
+        if isinstance(obj, ObjectId):
+            return str(obj)
+        if isinstance(obj, datetime.datetime):
+            return as_utc(obj).isoformat()
+        return json.JSONEncoder.default(self, obj)
+
+
+def period_grouped_response(groups, weeks):
+    start_at = d_tz(2013, 1, 7)
+    week = datetime.timedelta(weeks=1)
+    return {'data': tuple({
+        'key': 'group-{}'.format(group),
+        '_count': float(weeks),
+        '_group_count': weeks,
+        'values': [{
+            '_start_at': start_at + week * i,
+            '_end_at': start_at + week * (i + 1),
+            '_count': 1.0,
+            'value:sum': 12.5,
+        } for i in range(weeks)],
+    } for group in range(groups))}
+
+
+def compare(response, indent, distinct_dates):
+    json_encoded = json.dumps(response, cls=JsonEncoder, sort_keys=True,
+                              indent=indent)
+
+    profile = cProfile.Profile()
+    with patch('backdrop.read.serializer.as_utc',
+               wraps=as_utc) as formatted:
+        profile.enable()
+        encoded = ResponseEncoder(indent=indent).encode(response)
+        profile.disable()
+    profile.print_stats()
+
+    assert_that(encoded, equal_to(json_encoded))
+    # Each datetime is rendered once however many groups repeat it
+    assert_that(formatted.call_count, equal_to(distinct_dates))
+
+
+def test_encoding_period_grouped_data():
+    compare(period_grouped_response(groups=100, weeks=53), indent=None,
+            distinct_dates=54)
+
+
+def test_encoding_indented_period_grouped_data():
+    compare(period_grouped_response(groups=100, weeks=53), indent=2,
+            distinct_dates=54)
@@ -0,0 +1,46 @@
+from dateutil import parser
+from hamcrest import assert_that, equal_to
+from mock import patch
+
+from backdrop.core import timeutils
+from backdrop.core.records import parse_timestamps
+
+
+def records(count):
+    return [{
+        '_timestamp': '2014-01-{0:02d}T00:00:00Z'.format(i % 28 + 1),
+        '_start_at': '2014-01-{0:02d}T00:00:00+00:00'.format(i % 28 + 1),
+        '_end_at': '2014-01-{0:02d}T12:{1:02d}:00.5+01:00'.format(
+            i % 28 + 1, i % 60),
+    } for i in range(count)]
+
+
+def parse_all(batch):
+    return [parse_timestamps(dict(record)) for record in batch]
+
+
+def test_record_timestamps_are_parsed_like_dateutil():
+    batch = records(1000)
+    expected = [(dict((key, parser.parse(value))
+                      for key, value in record.items()), None)
+                for record in batch]
+
+    timeutils._parsed_times.clear()
+
+    assert_that(parse_all(batch), equal_to(expected))
+
+
+@patch('backdrop.core.timeutils.parser')
+def test_documented_formats_do_not_fall_back_to_dateutil(mock_parser):
+    timeutils._parsed_times.clear()
+
+    parse_all(records(1000))
+
+    assert_that(mock_parser.parse.called, equal_to(False))
+
+
+@patch('backdrop.core.timeutils.parser')
+def test_other_formats_fall_back_to_dateutil(mock_parser):
+    timeutils.parse_time('6th January 2014')
+
+    mock_parser.parse.assert_called_once_with('6th January 2014')
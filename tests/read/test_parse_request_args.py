@@ -6,57 +6,68 @@ from hamcrest import assert_that, is_, has_item
 import pytz
 from werkzeug.datastructures import MultiDict
 
-from backdrop.read.query import parse_request_args
+from backdrop.read.request_parser import parse_query
+from backdrop.core.pagination import encode_cursor
+
+
+def parse_request_args(request_args):
+    result, query = parse_query(request_args, raw_queries_allowed=True)
+    assert_that(result.is_valid, is_(True), result.message)
+    return query
 
 
 class Test_parse_request_args(unittest.TestCase):
     def test_start_at_is_parsed(self):
         request_args = MultiDict([
-            ("start_at", "2012-12-12T08:12:43+00:00")])
+            ("start_at", "2012-12-12T08:12:43+00:00"),
+            ("end_at", "2012-12-20T08:12:43+00:00")])
 
-        args = parse_request_args(request_args)
+        query = parse_request_args(request_args)
 
-        assert_that(args['start_at'], is_(
+        assert_that(query.start_at, is_(
             datetime(2012, 12, 12, 8, 12, 43, tzinfo=pytz.UTC)))
 
     def test_first_start_at_is_used(self):
         request_args = MultiDict([
             ("start_at", "2012-12-12T08:12:43+00:00"),
             ("start_at", "2012-12-13T08:12:43+00:00"),
+            ("end_at", "2012-12-20T08:12:43+00:00"),
         ])
 
-        args = parse_request_args(request_args)
+        query = parse_request_args(request_args)
 
-        assert_that(args['start_at'], is_(
+        assert_that(query.start_at, is_(
             datetime(2012, 12, 12, 8, 12, 43, tzinfo=pytz.UTC)))
 
     def test_end_at_is_parsed(self):
         request_args = MultiDict([
+            ("start_at", "2012-12-01T08:12:43+00:00"),
             ("end_at", "2012-12-12T08:12:43+00:00")])
 
-        args = parse_request_args(request_args)
+        query = parse_request_args(request_args)
 
-        assert_that(args['end_at'], is_(
+        assert_that(query.end_at, is_(
             datetime(2012, 12, 12, 8, 12, 43, tzinfo=pytz.UTC)))
 
     def test_first_end_at_is_used(self):
         request_args = MultiDict([
+            ("start_at", "2012-12-01T08:12:43+00:00"),
             ("end_at", "2012-12-12T08:12:43+00:00"),
             ("end_at", "2012-12-13T08:12:43+00:00"),
         ])
 
-        args = parse_request_args(request_args)
+        query = parse_request_args(request_args)
 
-        assert_that(args['end_at'], is_(
+        assert_that(query.end_at, is_(
             datetime(2012, 12, 12, 8, 12, 43, tzinfo=pytz.UTC)))
 
     def test_one_filter_by_is_parsed(self):
         request_args = MultiDict([
             ("filter_by", "foo:bar")])
 
-        args = parse_request_args(request_args)
+        query = parse_request_args(request_args)
 
-        assert_that(args['filter_by'], has_item(["foo", "bar"]))
+        assert_that(query.filter_by, has_item(["foo", "bar"]))
 
     def test_many_filter_by_are_parsed(self):
         request_args = MultiDict([
@@ -64,10 +75,10 @@ class Test_parse_request_args(unittest.TestCase):
             ("filter_by", "bar:foo")
         ])
 
-        args = parse_request_args(request_args)
+        query = parse_request_args(request_args)
 
-        assert_that(args['filter_by'], has_item(["foo", "bar"]))
-        assert_that(args['filter_by'], has_item(["bar", "foo"]))
+        assert_that(query.filter_by, has_item(["foo", "bar"]))
+        assert_that(query.filter_by, has_item(["bar", "foo"]))
 
     def test_build_query_with_boolean_value(self):
         request_args = MultiDict([
@@ -75,61 +86,61 @@ class Test_parse_request_args(unittest.TestCase):
             ("filter_by", "star:false"),
         ])
 
-        args = parse_request_args(request_args)
+        query = parse_request_args(request_args)
 
-        assert_that(args['filter_by'], has_item([ "planet", True ]))
-        assert_that(args['filter_by'], has_item([ "star", False ]))
+        assert_that(query.filter_by, has_item([ "planet", True ]))
+        assert_that(query.filter_by, has_item([ "star", False ]))
 
     def test_one_filter_by_prefix_is_parsed(self):
         request_args = MultiDict([
             ("filter_by_prefix", "foo:/hello/world")])
 
-        args = parse_request_args(request_args)
+        query = parse_request_args(request_args)
 
         parsed_regex = re.compile('^\\/hello\\/world.*')
 
-        assert_that(args['filter_by_prefix'],
+        assert_that(query.filter_by_prefix,
                     has_item(["foo", parsed_regex]))
 
-    def test_many_filter_by_are_parsed(self):
+    def test_many_filter_by_prefix_are_parsed(self):
         request_args = MultiDict([
             ("filter_by_prefix", "foo:bar"),
             ("filter_by_prefix", "bar:foo")
         ])
 
-        args = parse_request_args(request_args)
+        query = parse_request_args(request_args)
 
         parsed_regex1 = re.compile('^bar.*')
         parsed_regex2 = re.compile('^foo.*')
 
-        assert_that(args['filter_by_prefix'], has_item(["foo", parsed_regex1]))
-        assert_that(args['filter_by_prefix'], has_item(["bar", parsed_regex2]))
+        assert_that(query.filter_by_prefix, has_item(["foo", parsed_regex1]))
+        assert_that(query.filter_by_prefix, has_item(["bar", parsed_regex2]))
 
     def test_filter_by_prefix_escapes_regex_group_operators(self):
         request_args = MultiDict([
             ("filter_by_prefix", "foo:(a)+")])
 
-        args = parse_request_args(request_args)
+        query = parse_request_args(request_args)
 
         parsed_regex = re.compile('^\(a\)\+.*')
 
-        assert_that(args['filter_by_prefix'],
+        assert_that(query.filter_by_prefix,
                     has_item(["foo", parsed_regex]))
 
     def test_group_by_is_passed_through_untouched(self):
         request_args = MultiDict([("group_by", "foobar")])
 
-        args = parse_request_args(request_args)
+        query = parse_request_args(request_args)
 
-        assert_that(args['group_by'], is_(['foobar']))
+        assert_that(query.group_by, is_(['foobar']))
 
     def test_sort_is_parsed(self):
         request_args = MultiDict([
             ("sort_by", "foo:ascending")])
 
-        args = parse_request_args(request_args)
+        query = parse_request_args(request_args)
 
-        assert_that(args['sort_by'], is_(["foo", "ascending"]))
+        assert_that(query.sort_by, is_(["foo", "ascending"]))
 
     def test_sort_will_use_first_argument_only(self):
         request_args = MultiDict([
@@ -137,44 +148,88 @@ class Test_parse_request_args(unittest.TestCase):
             ("sort_by", "foo:ascending"),
         ])
 
-        args = parse_request_args(request_args)
+        query = parse_request_args(request_args)
 
-        assert_that(args['sort_by'], is_(["foo", "descending"]))
+        assert_that(query.sort_by, is_(["foo", "descending"]))
 
     def test_limit_is_parsed(self):
         request_args = MultiDict([
             ("limit", "123")
         ])
 
-        args = parse_request_args(request_args)
+        query = parse_request_args(request_args)
 
-        assert_that(args['limit'], is_(123))
+        assert_that(query.limit, is_(123))
 
     def test_one_collect_is_parsed_with_default_method(self):
         request_args = MultiDict([
+            ("group_by", "foo"),
             ("collect", "some_key")
         ])
 
-        args = parse_request_args(request_args)
+        query = parse_request_args(request_args)
 
-        assert_that(args['collect'], is_([("some_key", "default")]))
+        assert_that(query.collect, is_([("some_key", "default")]))
 
     def test_two_collects_are_parsed_with_default_methods(self):
         request_args = MultiDict([
+            ("group_by", "foo"),
             ("collect", "some_key"),
             ("collect", "some_other_key")
         ])
 
-        args = parse_request_args(request_args)
+        query = parse_request_args(request_args)
 
-        assert_that(args['collect'], is_([("some_key", "default"),
-                                          ("some_other_key", "default")]))
+        assert_that(query.collect, is_([("some_key", "default"),
+                                        ("some_other_key", "default")]))
 
     def test_one_collect_is_parsed_with_custom_method(self):
         request_args = MultiDict([
+            ("group_by", "foo"),
             ("collect", "some_key:mean")
         ])
 
-        args = parse_request_args(request_args)
+        query = parse_request_args(request_args)
+
+        assert_that(query.collect, is_([("some_key", "mean")]))
+
+    def test_fields_are_parsed(self):
+        request_args = MultiDict([
+            ("fields", "foo"),
+            ("fields", "bar"),
+        ])
+
+        query = parse_request_args(request_args)
+
+        assert_that(query.fields, is_(["foo", "bar"]))
+
+    def test_cursor_is_parsed(self):
+        request_args = MultiDict([
+            ("cursor", encode_cursor(datetime(2014, 1, 1), 'abc')),
+            ("limit", "10"),
+        ])
+
+        query = parse_request_args(request_args)
+
+        assert_that(query.after, is_(
+            (datetime(2014, 1, 1, tzinfo=pytz.UTC), 'abc')))
+
+    def test_paginate_is_parsed(self):
+        request_args = MultiDict([
+            ("paginate", "true"),
+            ("limit", "10"),
+        ])
+
+        query = parse_request_args(request_args)
+
+        assert_that(query.is_paginated, is_(True))
+
+    def test_limited_queries_are_not_paginated_by_default(self):
+        query = parse_request_args(MultiDict([("limit", "10")]))
+
+        assert_that(query.is_paginated, is_(False))
+
+    def test_all_fields_are_returned_by_default(self):
+        query = parse_request_args(MultiDict([]))
 
-        assert_that(args['collect'], is_([("some_key", "mean")]))
+        assert_that(query.fields, is_(None))
@@ -0,0 +1,110 @@
+import json
+import unittest
+
+from hamcrest import assert_that, is_, contains, has_entries, has_length
+from mock import patch
+
+from backdrop.read import api
+from tests.support.performanceplatform_client import fake_data_set_exists
+from tests.support.test_helpers import has_status
+
+
+class BatchApiTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = api.app.test_client()
+
+    def post_batch(self, queries):
+        response = self.app.post('/_batch',
+                                 data=json.dumps({'queries': queries}),
+                                 content_type='application/json')
+        return response, json.loads(response.data)
+
+    @fake_data_set_exists("foo", data_group="some-group", data_type="some-type")
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    def test_results_are_returned_in_order(self, mock_query):
+        mock_query.side_effect = lambda query: [{'by': query.group_by}]
+
+        response, body = self.post_batch([
+            {'data_set': 'foo', 'params': {'group_by': 'channel'}},
+            {'data_group': 'some-group', 'data_type': 'some-type',
+             'params': {'group_by': ['region']}},
+        ])
+
+        assert_that(response, has_status(200))
+        assert_that(body['results'], contains(
+            {'status': 200, 'data': [{'by': ['channel']}]},
+            {'status': 200, 'data': [{'by': ['region']}]},
+        ))
+
+    @fake_data_set_exists("foo", data_group="some-group", data_type="some-type")
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    def test_identical_queries_are_run_once(self, mock_query):
+        mock_query.return_value = [{'a': 1}]
+
+        _, body = self.post_batch([
+            {'data_set': 'foo', 'params': {'group_by': 'channel'}},
+            {'data_group': 'some-group', 'data_type': 'some-type',
+             'params': {'group_by': 'channel'}},
+        ])
+
+        assert_that(mock_query.call_count, is_(1))
+        assert_that(body['results'], has_length(2))
+        assert_that(body['results'][0], is_(body['results'][1]))
+
+    @fake_data_set_exists("foo", data_group="some-group", data_type="some-type")
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    def test_data_set_config_is_fetched_once(self, mock_query):
+        mock_query.return_value = []
+
+        with patch.object(api.admin_api, 'get_data_set_by_name',
+                          return_value={'name': 'foo'}) as get_config:
+            self.post_batch([
+                {'data_set': 'foo', 'params': {'group_by': 'channel'}},
+                {'data_set': 'foo', 'params': {'group_by': 'region'}},
+            ])
+
+        get_config.assert_called_once_with(u'foo')
+
+    @fake_data_set_exists("foo", data_group="some-group", data_type="some-type")
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    def test_each_result_has_its_own_status(self, mock_query):
+        mock_query.return_value = []
+
+        response, body = self.post_batch([
+            {'data_set': 'bar', 'params': {}},
+            {'data_set': 'foo', 'params': {'limit': 'lots'}},
+            {'params': {}},
+            {'data_set': 'foo', 'params': {'group_by': 'channel'}},
+        ])
+
+        assert_that(response, has_status(200))
+        assert_that(body['results'], contains(
+            has_entries({'status': 404, 'message': 'data_set not found'}),
+            has_entries({'status': 400}),
+            has_entries({'status': 400}),
+            has_entries({'status': 200, 'data': []}),
+        ))
+
+    @fake_data_set_exists("foo", published=False)
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    def test_unpublished_results_have_a_warning(self, mock_query):
+        mock_query.return_value = []
+
+        _, body = self.post_batch([
+            {'data_set': 'foo', 'params': {'group_by': 'channel'}}])
+
+        assert_that(body['results'][0], has_entries({
+            'warning': api.UNPUBLISHED_WARNING}))
+
+    def test_body_must_have_a_list_of_queries(self):
+        response = self.app.post('/_batch', data='{"queries": "foo"}',
+                                 content_type='application/json')
+
+        assert_that(response, has_status(400))
+
+    def test_batches_are_limited_in_size(self):
+        response, _ = self.post_batch(
+            [{'data_set': 'foo'}] * (api.app.config['BATCH_MAX_QUERIES'] + 1))
+
+        assert_that(response, has_status(400))
@@ -1,10 +1,12 @@
 import unittest
 import urllib
 import datetime
+import json
 from hamcrest import assert_that, is_
 from mock import patch
 import pytz
 from backdrop.read import api
+from backdrop.core.errors import QueryLimitError
 from backdrop.core.query import Query
 from tests.support.performanceplatform_client import fake_data_set_exists
 from tests.support.test_helpers import has_status, has_header
@@ -92,6 +94,16 @@ class QueryingApiTestCase(unittest.TestCase):
         assert_that(response, has_status(500))
         assert_that(response, has_header('Access-Control-Allow-Origin', '*'))
 
+    @fake_data_set_exists("foo", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    def test_queries_over_a_limit_are_rejected(self, mock_query):
+        mock_query.side_effect = QueryLimitError('took too long')
+        response = self.app.get('/foo')
+
+        assert_that(response, has_status(400))
+        assert_that(json.loads(response.data)['message'],
+                    is_('took too long'))
+
 
 class PreflightChecksApiTestCase(unittest.TestCase):
     def setUp(self):
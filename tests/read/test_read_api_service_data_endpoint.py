@@ -1,3 +1,4 @@
+import json
 import unittest
 import urllib
 import datetime
@@ -6,6 +7,7 @@ from mock import patch
 import pytz
 from backdrop.core.timeseries import WEEK
 from backdrop.read import api
+from backdrop.core.pagination import encode_cursor
 from backdrop.core.query import Query
 from tests.support.performanceplatform_client import fake_data_set_exists, fake_no_data_sets_exist
 from tests.support.test_helpers import has_status, has_header, d_tz
@@ -100,6 +102,95 @@ class QueryingApiTestCase(unittest.TestCase):
         mock_query.assert_called_with(
             Query.create(sort_by=["value", "descending"]))
 
+    @fake_data_set_exists("foo", data_group="some-group", data_type="some-type", raw_queries_allowed=True)
+    @patch.dict(api.app.config, {'STREAM_RAW_QUERIES': True})
+    @patch('backdrop.core.data_set.DataSet.stream_query')
+    def test_raw_queries_can_be_streamed(self, mock_stream):
+        mock_stream.return_value = iter([{'foo': 'bar'}, {'foo': 'baz'}])
+
+        response = self.app.get('/data/some-group/some-type?fields=foo')
+
+        mock_stream.assert_called_with(Query.create(fields=[u'foo']), 1000)
+        assert_that(json.loads(response.data), is_(
+            {'data': [{'foo': 'bar'}, {'foo': 'baz'}]}))
+
+    @fake_data_set_exists("foo", data_group="some-group", data_type="some-type", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.execute_page')
+    def test_paginated_raw_queries_link_to_the_next_page(self, mock_page):
+        mock_page.return_value = ({'foo': 'bar'},), 'next-cursor'
+
+        response = self.app.get(
+            '/data/some-group/some-type?limit=1&paginate=true')
+
+        assert_that(json.loads(response.data), is_({
+            'data': [{'foo': 'bar'}], 'next': 'next-cursor'}))
+
+    @fake_data_set_exists("foo", data_group="some-group", data_type="some-type", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    def test_limited_raw_queries_are_not_paginated(self, mock_query):
+        mock_query.return_value = [{'foo': 'bar'}]
+
+        response = self.app.get('/data/some-group/some-type?limit=1')
+
+        mock_query.assert_called_with(Query.create(limit=1))
+        assert_that(json.loads(response.data), is_({
+            'data': [{'foo': 'bar'}]}))
+
+    @fake_data_set_exists("foo", data_group="some-group", data_type="some-type", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.execute_page')
+    def test_the_next_page_is_queried_after_the_cursor(self, mock_page):
+        mock_page.return_value = (), None
+        cursor = encode_cursor(d_tz(2014, 1, 1), 'abc')
+
+        response = self.app.get(
+            '/data/some-group/some-type?limit=1&cursor=' + cursor)
+
+        mock_page.assert_called_with(
+            Query.create(limit=1, after=(d_tz(2014, 1, 1), 'abc')))
+        assert_that(json.loads(response.data), is_({'data': []}))
+
+    @fake_data_set_exists("foo", data_group="some-group", data_type="some-type", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.stream_query')
+    def test_raw_queries_can_be_exported_as_csv(self, mock_stream):
+        mock_stream.return_value = iter([{'foo': 'bar'}, {'foo': 'baz'}])
+
+        response = self.app.get(
+            '/data/some-group/some-type?format=csv&fields=foo')
+
+        assert_that(response, has_header('Content-Type', 'text/csv; charset=utf-8'))
+        assert_that(response.data, is_('foo\nbar\nbaz\n'))
+
+    @fake_data_set_exists("foo", data_group="some-group", data_type="some-type", raw_queries_allowed=True)
+    def test_raw_queries_need_fields_to_be_exported_as_csv(self):
+        response = self.app.get('/data/some-group/some-type?format=csv')
+
+        assert_that(response, has_status(400))
+
+    @fake_data_set_exists("foo", data_group="some-group", data_type="some-type")
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    def test_grouped_queries_are_exported_flat(self, mock_query):
+        mock_query.return_value = ({'foo': 'bar', '_count': 1},)
+
+        response = self.app.get(
+            '/data/some-group/some-type?group_by=foo&format=ndjson')
+
+        mock_query.assert_called_with(
+            Query.create(group_by=[u'foo'], flatten=True))
+        assert_that(response.data, is_('{"_count": 1, "foo": "bar"}\n'))
+
+    @fake_data_set_exists("foo", data_group="some-group", data_type="some-type")
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    def test_grouped_csv_columns_come_from_the_query(self, mock_query):
+        mock_query.return_value = (
+            {'foo': 'bar', '_count': 2, 'value:sum': 3},
+            {'foo': 'baz', '_count': 1, 'value:sum': None})
+
+        response = self.app.get('/data/some-group/some-type?group_by=foo'
+                                '&collect=value:sum&format=csv')
+
+        assert_that(response.data, is_(
+            'foo,_count,value:sum\nbar,2,3\nbaz,1,\n'))
+
     @fake_data_set_exists("data_set", data_group="some-group", data_type="some-type", queryable=False)
     def test_returns_404_when_data_set_is_not_queryable(self):
         response = self.app.get('/data/some-group/some-type')
@@ -161,3 +252,79 @@ class PreflightChecksApiTestCase(unittest.TestCase):
     def test_cache_control_is_set_to_no_cache_for_unpublished_data_sets(self):
         response = self.app.get('/data/some-group/some-type')
         assert_that(response, has_header('Cache-Control', 'no-cache'))
+
+    @fake_data_set_exists("data_set", data_group="some-group", data_type="some-type", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.get_last_updated')
+    @patch('backdrop.core.data_set.DataSet.get_version')
+    def test_responses_have_validators(self, get_version, get_last_updated):
+        get_version.return_value = 3
+        get_last_updated.return_value = d_tz(2014, 1, 1)
+
+        response = self.app.get('/data/some-group/some-type')
+
+        assert_that(response, has_header(
+            'Last-Modified', 'Wed, 01 Jan 2014 00:00:00 GMT'))
+        assert_that(response.headers['ETag'].startswith('W/"'), is_(True))
+
+    @fake_data_set_exists("data_set", data_group="some-group", data_type="some-type", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    @patch('backdrop.core.data_set.DataSet.get_version')
+    def test_unchanged_data_sets_are_not_queried_again(self, get_version,
+                                                       mock_query):
+        get_version.return_value = 3
+        mock_query.return_value = []
+        etag = self.app.get('/data/some-group/some-type').headers['ETag']
+
+        response = self.app.get('/data/some-group/some-type',
+                                headers={'If-None-Match': etag})
+
+        assert_that(response, has_status(304))
+        assert_that(mock_query.call_count, is_(1))
+
+    @fake_data_set_exists("data_set", data_group="some-group", data_type="some-type", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    @patch('backdrop.core.data_set.DataSet.get_last_updated')
+    def test_queries_relative_to_now_are_not_validated_by_last_modified(
+            self, get_last_updated, mock_query):
+        get_last_updated.return_value = d_tz(2014, 1, 1)
+        mock_query.return_value = []
+
+        response = self.app.get(
+            '/data/some-group/some-type?period=week&duration=2',
+            headers={'If-Modified-Since': 'Thu, 01 Jan 2015 00:00:00 GMT'})
+
+        assert_that(response, has_status(200))
+        assert_that('Last-Modified' in response.headers, is_(False))
+
+    @fake_data_set_exists("data_set", data_group="some-group", data_type="some-type", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    @patch('backdrop.core.query.now')
+    def test_queries_relative_to_now_change_etag_as_time_passes(
+            self, now, mock_query):
+        mock_query.return_value = []
+        url = '/data/some-group/some-type?period=week&duration=2'
+        now.return_value = d_tz(2014, 1, 6)
+        etag = self.app.get(url).headers['ETag']
+
+        now.return_value = d_tz(2014, 1, 13)
+        response = self.app.get(url, headers={'If-None-Match': etag})
+
+        assert_that(response, has_status(200))
+        assert_that(mock_query.call_count, is_(2))
+
+    @fake_data_set_exists("data_set", data_group="some-group", data_type="some-type", raw_queries_allowed=True)
+    @patch('backdrop.core.data_set.DataSet.execute_query')
+    @patch('backdrop.core.data_set.DataSet.get_version')
+    def test_data_sets_that_have_been_written_to_are_queried(self,
+                                                             get_version,
+                                                             mock_query):
+        get_version.return_value = 3
+        mock_query.return_value = []
+        etag = self.app.get('/data/some-group/some-type').headers['ETag']
+
+        get_version.return_value = 4
+        response = self.app.get('/data/some-group/some-type',
+                                headers={'If-None-Match': etag})
+
+        assert_that(response, has_status(200))
+        assert_that(mock_query.call_count, is_(2))
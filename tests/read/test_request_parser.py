@@ -0,0 +1,89 @@
+import itertools
+import random
+import unittest
+
+from hamcrest import assert_that, is_
+from werkzeug.datastructures import MultiDict
+
+from backdrop.core.pagination import encode_cursor
+from backdrop.read.request_parser import parse_query
+from tests.support.test_helpers import d_tz
+
+
+PARAMETER_VALUES = {
+    'start_at': ['2014-01-06T00:00:00Z', '2014-02-01T00:00:00+00:00',
+                 '2014-01-08T12:30:00+01:00', '2014-01-06', 'nope', ''],
+    'end_at': ['2014-03-03T00:00:00Z', '2014-01-09T00:00:00Z',
+               '2014-03-01T00:00:00-05:00', '2014-13-01T00:00:00Z'],
+    'duration': ['3', '0', '-1', 'x'],
+    'period': ['week', 'month', 'hour', 'fortnight'],
+    'filter_by': ['name:foo', 'active:true', 'nocolon', '$a:b', 'b!d:x'],
+    'filter_by_prefix': ['name:fo', 'name'],
+    'group_by': ['name', '_name', 'b!d'],
+    'sort_by': ['name:ascending', 'name:sideways', 'name', 'b!d:descending'],
+    'limit': ['10', '-5', 'ten'],
+    'collect': ['value', 'value:sum', 'value:median', '_value', 'name'],
+    'flatten': ['true', 'false', 'yes'],
+    'inclusive': ['true', 'maybe'],
+    'fields': ['name', 'b!d'],
+    'format': ['json', 'csv', 'xml'],
+    'cursor': [encode_cursor(d_tz(2014, 1, 1), 'abc'), 'garbage'],
+    'date': ['2014-01-06T00:00:00Z'],
+    'unknown': ['1'],
+}
+
+
+def request_args_corpus(count, seed=1):
+    """Random combinations of valid and invalid query string arguments"""
+    generator = random.Random(seed)
+    names = sorted(PARAMETER_VALUES)
+    common = ['start_at', 'end_at', 'duration', 'period', 'group_by',
+              'collect', 'limit', 'sort_by']
+
+    for _ in range(count):
+        chosen = generator.sample(common, generator.randint(0, 5))
+        if generator.random() < 0.5:
+            chosen += generator.sample(names, generator.randint(1, 3))
+
+        items = []
+        for name in set(chosen):
+            values = PARAMETER_VALUES[name]
+            for _ in range(generator.choice([1, 1, 1, 2])):
+                items.append((name, generator.choice(values)))
+        yield MultiDict(items)
+
+
+class TestParseQuery(unittest.TestCase):
+
+    def test_requests_are_either_parsed_or_rejected(self):
+        corpus = itertools.chain(
+            [MultiDict(), MultiDict([('period', 'week'),
+                                     ('start_at', '2014-01-06T00:00:00Z'),
+                                     ('end_at', '2014-03-03T00:00:00Z')])],
+            request_args_corpus(1000))
+
+        valid_count = 0
+        for request_args in corpus:
+            for raw_queries_allowed in [True, False]:
+                result, query = parse_query(request_args, raw_queries_allowed)
+
+                assert_that(query is not None, is_(result.is_valid),
+                            '{0} raw={1}'.format(request_args,
+                                                 raw_queries_allowed))
+                valid_count += result.is_valid
+
+        # Make sure the corpus is not all errors
+        assert_that(valid_count > 100, is_(True))
+
+    def test_collect_with_more_than_one_method_is_an_error(self):
+        result, query = parse_query(MultiDict([
+            ('group_by', 'name'), ('collect', 'value:sum:mean')]))
+
+        assert_that(result.message, is_("Unknown collection method"))
+        assert_that(query, is_(None))
+
+    def test_plain_dicts_are_accepted(self):
+        result, query = parse_query({'group_by': 'name'})
+
+        assert_that(result.is_valid, is_(True))
+        assert_that(query.group_by, is_(['name']))
@@ -0,0 +1,67 @@
+import datetime
+import json
+import unittest
+
+import pytz
+from bson import ObjectId
+from hamcrest import assert_that, is_
+
+from backdrop.core.timeutils import as_utc
+from backdrop.read.serializer import ResponseEncoder
+from tests.support.test_helpers import d_tz, d
+
+
+def reference_default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, datetime.datetime):
+        return as_utc(obj).isoformat()
+    raise TypeError(repr(obj) + " is not JSON serializable")
+
+
+class TestResponseEncoder(unittest.TestCase):
+    def assert_encodes_like_json(self, obj):
+        for indent in [None, 2]:
+            assert_that(
+                ResponseEncoder(indent=indent).encode(obj),
+                is_(json.dumps(obj, sort_keys=True, indent=indent,
+                               default=reference_default)))
+
+    def test_period_grouped_data(self):
+        self.assert_encodes_like_json({'data': ({
+            'key': 'foo',
+            '_count': 2.0,
+            '_group_count': 2,
+            'values': [
+                {'_start_at': d_tz(2014, 1, 6), '_end_at': d_tz(2014, 1, 13),
+                 '_count': 1.0, 'value:sum': 1.5},
+                {'_start_at': d_tz(2014, 1, 13), '_end_at': d_tz(2014, 1, 20),
+                 '_count': 1.0, 'value:sum': None},
+            ],
+        },), 'warning': 'unpublished'})
+
+    def test_simple_data(self):
+        self.assert_encodes_like_json({'data': (
+            {'_id': ObjectId('5368a1d2e4b0f3f7a5b3c4d1'),
+             '_timestamp': d(2014, 1, 1),
+             'name': u'caf\xe9', 'bytes': 'caf\xc3\xa9',
+             'big': 10 ** 20, 'flag': True, 'other': False},
+        )})
+
+    def test_empty_containers_and_special_floats(self):
+        self.assert_encodes_like_json(
+            {'a': [], 'b': {}, 'c': [[]], 'd': [float('nan'), float('inf')]})
+
+    def test_non_string_keys(self):
+        self.assert_encodes_like_json({1: 'a', 2.5: 'b', None: 'c'})
+
+    def test_datetimes_are_rendered_in_utc(self):
+        eastern = pytz.timezone('US/Eastern')
+        date = eastern.localize(datetime.datetime(2014, 4, 29, 1, 0))
+
+        assert_that(ResponseEncoder().encode([date, date]),
+                    is_('["2014-04-29T05:00:00+00:00", '
+                        '"2014-04-29T05:00:00+00:00"]'))
+
+    def test_unknown_types_are_rejected(self):
+        self.assertRaises(TypeError, ResponseEncoder().encode, set([1]))
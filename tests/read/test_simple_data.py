@@ -14,6 +14,19 @@ class TestSimpleData(unittest.TestCase):
         assert_that(data.data()[0], has_entry("_timestamp",
                                               d_tz(2014, 1, 1)))
 
+    def test_documents_are_trimmed_to_the_requested_fields(self):
+        stub_document = {
+            "_id": "abc",
+            "_timestamp": d(2014, 1, 1),
+            "_week_start_at": d(2013, 12, 30),
+            "foo": "bar",
+        }
+        data = SimpleData([stub_document], fields=["foo", "_timestamp"])
+        assert_that(data.data()[0], is_({
+            "_timestamp": d_tz(2014, 1, 1),
+            "foo": "bar",
+        }))
+
     def test_returned_data_should_be_immutable(self):
         stub_doc = {
             "_timestamp": d(2014, 1, 1)
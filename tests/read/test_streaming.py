@@ -0,0 +1,69 @@
+# encoding: utf-8
+import json
+
+from hamcrest import assert_that, is_
+
+from backdrop.read.serializer import ResponseEncoder
+from backdrop.read.streaming import stream_json, stream_ndjson, stream_csv
+from tests.support.test_helpers import d_tz
+
+
+class TestStreamJson(object):
+    def test_output_is_the_json_envelope(self):
+        rows = iter([{'a': d_tz(2014, 1, 1)}, {'a': None}, {'a': 1}])
+
+        output = ''.join(stream_json(rows, 2, cls=ResponseEncoder))
+
+        assert_that(json.loads(output), is_({'data': [
+            {'a': '2014-01-01T00:00:00+00:00'}, {'a': None}, {'a': 1}]}))
+
+
+class TestStreamNdjson(object):
+    def test_each_row_is_a_line(self):
+        rows = iter([{'a': d_tz(2014, 1, 1)}, {'b': [1, 2]}])
+
+        output = ''.join(stream_ndjson(rows, 1, cls=ResponseEncoder))
+
+        assert_that(output, is_('{"a": "2014-01-01T00:00:00+00:00"}\n'
+                                '{"b": [1, 2]}\n'))
+
+
+class TestStreamCsv(object):
+    def test_columns_are_the_requested_fields(self):
+        rows = iter([{'a': 1, 'b': 2, 'c': 3}])
+
+        output = ''.join(stream_csv(rows, 10, ['c', 'a']))
+
+        assert_that(output, is_('c,a\n3,1\n'))
+
+    def test_missing_values_are_empty(self):
+        rows = iter([{'b': 1}, {'a': 2}, {'c': 3}])
+
+        output = ''.join(stream_csv(rows, 2, ['a', 'b', 'c']))
+
+        assert_that(output, is_('a,b,c\n,1,\n2,,\n,,3\n'))
+
+    def test_rows_are_written_as_they_are_read(self):
+        def rows():
+            yield {'a': 1}
+            yield {'a': 2}
+            raise AssertionError("read past the first batch")
+
+        output = stream_csv(rows(), 1, ['a'])
+
+        assert_that(next(output), is_('a\n1\n'))
+
+    def test_values_are_rendered_like_json(self):
+        rows = iter([{'date': d_tz(2014, 1, 1), 'flag': True,
+                      'name': u'café', 'values': ['a', 'b']}])
+
+        output = ''.join(stream_csv(
+            rows, 10, ['date', 'flag', 'name', 'values']))
+
+        assert_that(output, is_(
+            'date,flag,name,values\n'
+            '2014-01-01T00:00:00+00:00,true,café,"[""a"", ""b""]"\n'))
+
+    def test_no_rows_gives_just_the_header(self):
+        assert_that(''.join(stream_csv(iter([]), 10, ['a', 'b'])),
+                    is_('a,b\n'))
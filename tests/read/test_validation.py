@@ -1,7 +1,9 @@
 from unittest import TestCase
 from hamcrest import assert_that, is_
-from backdrop.read import validation
-from backdrop.read.api import validate_request_args as _validate_request_args
+from backdrop.core.pagination import encode_cursor
+from backdrop.core import validation
+from backdrop.read.validation import validate_request_args as \
+    _validate_request_args
 from werkzeug.datastructures import MultiDict
 from tests.support.validity_matcher import is_invalid_with_message, is_valid
 
@@ -265,6 +267,97 @@ class TestRequestValidation(TestCase):
                         "collect can be used only with either "
                         "['group_by', 'period']"))
 
+    def test_queries_with_fields_are_allowed(self):
+        validation_result = validate_request_args(MultiDict([
+            ("fields", 'foo'),
+            ("fields", '_timestamp'),
+        ]))
+        assert_that(validation_result, is_valid())
+
+    def test_queries_with_invalid_fields_are_disallowed(self):
+        validation_result = validate_request_args(MultiDict([
+            ("fields", '$foo'),
+        ]))
+        assert_that(validation_result, is_invalid_with_message(
+            "Cannot select an invalid field name"))
+
+    def test_grouped_queries_with_fields_are_disallowed(self):
+        validation_result = validate_request_args(MultiDict([
+            ("fields", 'foo'),
+            ("group_by", 'bar'),
+        ]))
+        assert_that(validation_result, is_invalid_with_message(
+            "fields can only be used with raw queries, grouped queries "
+            "return the group_by and collect fields"))
+
+    def test_raw_queries_with_a_cursor_and_limit_are_allowed(self):
+        validation_result = validate_request_args(MultiDict([
+            ("cursor", encode_cursor(None, 'abc')),
+            ("limit", '10'),
+        ]))
+        assert_that(validation_result, is_valid())
+
+    def test_queries_with_an_invalid_cursor_are_disallowed(self):
+        validation_result = validate_request_args(MultiDict([
+            ("cursor", 'foo'),
+            ("limit", '10'),
+        ]))
+        assert_that(validation_result, is_invalid_with_message(
+            "cursor is not valid"))
+
+    def test_queries_with_a_cursor_and_no_limit_are_disallowed(self):
+        validation_result = validate_request_args(MultiDict([
+            ("cursor", encode_cursor(None, 'abc')),
+        ]))
+        assert_that(validation_result, is_invalid_with_message(
+            "cursor can only be used with a limit"))
+
+    def test_sorted_queries_with_a_cursor_are_disallowed(self):
+        validation_result = validate_request_args(MultiDict([
+            ("cursor", encode_cursor(None, 'abc')),
+            ("limit", '10'),
+            ("sort_by", 'foo:ascending'),
+        ]))
+        assert_that(validation_result, is_invalid_with_message(
+            "cursor cannot be used with sort_by, pages are ordered by "
+            "_timestamp"))
+
+    def test_raw_queries_asking_for_pages_with_a_limit_are_allowed(self):
+        validation_result = validate_request_args(MultiDict([
+            ("paginate", 'true'),
+            ("limit", '10'),
+        ]))
+        assert_that(validation_result, is_valid())
+
+    def test_sorted_queries_asking_for_pages_are_disallowed(self):
+        validation_result = validate_request_args(MultiDict([
+            ("paginate", 'true'),
+            ("limit", '10'),
+            ("sort_by", 'foo:ascending'),
+        ]))
+        assert_that(validation_result, is_invalid_with_message(
+            "paginate cannot be used with sort_by, pages are ordered by "
+            "_timestamp"))
+
+    def test_queries_with_a_known_format_are_allowed(self):
+        validation_result = validate_request_args({'format': 'ndjson'})
+        assert_that(validation_result, is_valid())
+
+    def test_raw_queries_exported_as_csv_must_select_fields(self):
+        validation_result = validate_request_args({'format': 'csv'})
+        assert_that(validation_result, is_invalid_with_message(
+            "fields are required to export raw queries as csv, the "
+            "columns must be known before the rows are streamed"))
+
+        validation_result = validate_request_args(MultiDict([
+            ('format', 'csv'), ('fields', 'foo')]))
+        assert_that(validation_result, is_valid())
+
+    def test_queries_with_an_unknown_format_are_disallowed(self):
+        validation_result = validate_request_args({'format': 'xml'})
+        assert_that(validation_result, is_invalid_with_message(
+            "'format' must be one of ['json', 'csv', 'ndjson']"))
+
     def test_queries_without_code_injection_collect_values_are_allowed(self):
         validation_result_without_group_by = validate_request_args(MultiDict([
             ("group_by", 'bar'),
@@ -7,6 +7,9 @@ Rough and ready conversion script to turn our JSON output into CSV.
 Note that this only works on "flat" data like, such as what you get from a raw
 query in backdrop. It can't handle nesting, like when you've used a group_by
 query.
+
+The read API can return CSV itself, including for grouped queries, when
+asked with format=csv.
 """
 
 import json